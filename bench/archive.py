@@ -0,0 +1,74 @@
+# Архив завершенных задач: размер горячей таблицы tasks и её индексов до и после переноса,
+# скорость переноса пачками и задержка списков "Активные"/"Завершенные" (вторые читают обе таблицы).
+# Запуск: python -m bench.archive [пользователей] [задач на пользователя]
+import asyncio
+import statistics
+import sys
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from bench.fake_api import FakeBotAPI, prepare_environment
+
+prepare_environment(FakeBotAPI())
+
+import sqlalchemy  # noqa: E402
+
+from bench.common import seed_tasks  # noqa: E402
+from data.archive import archiver  # noqa: E402
+from data.database import engine, new_session, setup_database  # noqa: E402
+from data.models import TaskModel  # noqa: E402
+from data.tasks import fetch_page  # noqa: E402
+
+HOT = ("tasks", "ix_tasks_user_done_due", "ix_tasks_remind", "ix_tasks_done_at")
+
+
+async def hot_size():  # страниц в B-деревьях tasks и её индексов, МиБ
+    async with engine.connect() as conn:
+        result = await conn.exec_driver_sql(
+            f"SELECT sum(pgsize) FROM dbstat WHERE name IN ({', '.join('?' * len(HOT))})", HOT
+        )
+        return result.scalar() / 2 ** 20
+
+
+async def listing(user_id, is_done, repeats=50):
+    times = list()
+    async with new_session() as session:
+        for _ in range(repeats):
+            started = perf_counter()
+            await fetch_page(session, user_id, is_done)
+            times.append((perf_counter() - started) * 1000)
+    return statistics.median(times)
+
+
+async def report(label, user_id):
+    print(f"{label:<12} | tasks {await hot_size():>7.1f} МиБ | активные {await listing(user_id, False):>6.2f} мс | "
+          f"завершенные {await listing(user_id, True):>6.2f} мс")
+
+
+async def run(users, tasks):
+    await setup_database()
+    for user_id in range(users):
+        await seed_tasks(engine, 1000 + user_id, tasks, tags=3, is_done=True)
+    async with engine.begin() as conn:  # каждая десятая задача активна, остальные завершены год назад
+        await conn.execute(sqlalchemy.update(TaskModel).where(TaskModel.id % 10 == 0).values(is_done=False))
+        await conn.execute(sqlalchemy.update(TaskModel).where(TaskModel.is_done == True)
+                           .values(done_at=datetime.now() - timedelta(days=365)))
+    print(f"{users} пользователей x {tasks} задач, из них завершенных 90%")
+    await report("до архива", 1000)
+
+    started = perf_counter()
+    count = await archiver.archive()
+    elapsed = perf_counter() - started
+    print(f"перенесено {count} задач за {elapsed:.2f} c, {count / elapsed:.0f} в секунду, "
+          f"пачками по {archiver.batch}")
+    await report("после архива", 1000)
+    async with new_session() as session:
+        left = (await session.execute(
+            sqlalchemy.select(sqlalchemy.func.count()).select_from(TaskModel).where(TaskModel.is_done == True)
+        )).scalar()
+    return count == users * tasks * 9 // 10 - left and left == 0
+
+
+if __name__ == "__main__":
+    arguments = [int(value) for value in sys.argv[1:3]]
+    sys.exit(0 if asyncio.run(run(*(arguments or [20, 10000]))) else 1)
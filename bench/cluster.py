@@ -0,0 +1,124 @@
+# Кластер: супервизор с N рабочими процессами на фейковом Bot API. Пропускная способность сценария
+# пользователей, затем отказ ведущего: его процесс убивается, аренду должен забрать другой рабочий,
+# а напоминания - уйти ровно по одному на задачу.
+# Запуск: python -m bench.cluster [рабочих] [пользователей]
+import asyncio
+import os
+import signal
+import sys
+from datetime import date, datetime, timedelta
+from time import perf_counter
+
+from bench.fake_api import FakeBotAPI, prepare_environment
+
+api = FakeBotAPI()
+prepare_environment(api, LEASE_TTL=3, LEASE_RENEW=1, REMINDER_REFRESH=1,
+                    REMINDER_GLOBAL_RATE=100000, REMINDER_CHAT_INTERVAL=0)
+
+import sqlalchemy  # noqa: E402
+
+import main  # noqa: E402
+from data.cluster import Supervisor  # noqa: E402
+from data.database import new_session, setup_database  # noqa: E402
+from data.models import LeaseModel, TaskModel  # noqa: E402
+
+# рабочему нужен тот же подставной токен, что и бенчмарку: data/config.py в репозиторий не входит
+WORKER_COMMAND = [sys.executable, "-c",
+                  "from bench.fake_api import use_fake_token; use_fake_token(); "
+                  "import runpy; runpy.run_path('main.py', run_name='__main__')"]
+
+
+async def user_flow(user_id, tasks, errors):
+    due = (date.today() + timedelta(days=3)).strftime("%d-%m-%Y")
+    texts = ["/start"]
+    for number in range(tasks):
+        texts += ["/add_task", f"Задача {number}", due]
+    texts.append("/tasks")
+    for text in texts:
+        try:  # update_id выдается в момент отправки: getUpdates отбрасывает id меньше подтвержденного
+            await api.send(api.message_update(user_id, text), user_id, timeout=30)
+        except asyncio.TimeoutError:
+            errors.append(user_id)
+            return
+
+
+async def lease_holder():
+    async with new_session() as session:
+        return (await session.execute(
+            sqlalchemy.select(LeaseModel.holder).where(LeaseModel.expires_at > datetime.now())
+        )).scalar()
+
+
+async def wait_for(predicate, timeout):
+    started = perf_counter()
+    while perf_counter() - started < timeout:
+        if await predicate():
+            return perf_counter() - started
+        await asyncio.sleep(0.1)
+    return None
+
+
+async def run(workers, users, tasks=3):
+    await api.start()
+    await setup_database()  # миграции один раз до запуска рабочих
+    bot = main.make_bot()
+    supervisor = Supervisor(WORKER_COMMAND, workers)
+    supervisor.start()
+    polling = asyncio.create_task(supervisor.poll(bot))
+    await api.send(api.message_update(1, "/start"), 1, timeout=60)  # все рабочие поднялись хотя бы частично
+
+    errors = list()
+    started = perf_counter()
+    await asyncio.gather(*[user_flow(10000 + user, tasks, errors) for user in range(users)])
+    elapsed = perf_counter() - started
+    updates = users * (tasks * 3 + 2)
+    print(f"{workers} рабочих, {users} пользователей: {updates} обновлений за {elapsed:.2f} c, "
+          f"{updates / elapsed:.1f} в секунду, без ответа: {len(errors)}")
+
+    holder_started = await wait_for(lease_holder, 10)
+    holder = await lease_holder()
+    print(f"ведущий: {holder}, аренда получена через {holder_started:.1f} c")
+    ok = not errors and holder is not None
+    if holder and workers > 1:
+        pid = int(holder.rsplit(":", 1)[1])
+        victim = next(worker for worker in supervisor.workers if worker.process.pid == pid)
+        os.kill(pid, signal.SIGKILL)
+        failover = await wait_for(lambda: _new_holder(holder), 30)
+        print(f"ведущий {victim.index} убит, новый ведущий {await lease_holder()} через "
+              f"{failover if failover is None else round(failover, 1)} c")
+        ok = ok and failover is not None
+
+    # все задачи становятся просроченными; отправить их должен ровно один процесс
+    sent = api.count("sendMessage")
+    async with new_session() as session:
+        await session.execute(sqlalchemy.update(TaskModel).values(notify_time=datetime.now()))
+        await session.commit()
+    delivered = await wait_for(lambda: _sent_at_least(sent + users * tasks), 30)
+    await asyncio.sleep(2)  # дубли пришли бы в течение следующих перечитываний
+    reminders_sent = api.count("sendMessage") - sent
+    print(f"напоминаний отправлено {reminders_sent} из {users * tasks}, "
+          f"за {delivered if delivered is None else round(delivered, 1)} c")
+    print(f"перезапусков рабочих: {sum(worker.restarts for worker in supervisor.workers)}")
+    ok = ok and reminders_sent == users * tasks
+
+    polling.cancel()
+    await asyncio.gather(polling, return_exceptions=True)
+    await supervisor.stop()
+    await bot.session.close()
+    await api.stop()
+    print("OK" if ok else "FAIL")
+    return ok
+
+
+async def _new_holder(old):
+    holder = await lease_holder()
+    return holder is not None and holder != old
+
+
+async def _sent_at_least(count):
+    return api.count("sendMessage") >= count
+
+
+if __name__ == "__main__":
+    arguments = [int(value) for value in sys.argv[1:3]]
+    sys.exit(0 if asyncio.run(run(*(arguments or [4, 200]))) else 1)
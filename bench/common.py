@@ -0,0 +1,85 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from time import perf_counter
+
+import sqlalchemy
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from data.database import Base
+from data.models import TaskModel, TagModel, UserModel
+
+
+async def temp_database():  # движок и фабрика сессий на временном файле SQLite
+    path = os.path.join(tempfile.mkdtemp(prefix="taskbot-bench-"), "taskbot.db")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return engine, async_sessionmaker(engine, expire_on_commit=False)
+
+
+async def seed_tasks(engine, user_id, count, tags=10, is_done=False):  # массовая вставка задач одного пользователя
+    today = date.today()
+    async with engine.begin() as conn:
+        await conn.execute(sqlalchemy.insert(UserModel), [{"tg_id": user_id, "username": f"user{user_id}"}])
+        await conn.execute(
+            sqlalchemy.insert(TagModel),
+            [{"user_id": user_id, "title": f"tag{user_id}_{i}"} for i in range(tags)],
+        )
+        tag_ids = (await conn.execute(
+            sqlalchemy.select(TagModel.id).where(TagModel.user_id == user_id)
+        )).scalars().all()
+        rows = list()
+        for i in range(count):
+            due_date = today + timedelta(days=i % 365)
+            rows.append({
+                "user_id": user_id,
+                "title": f"Задача {i}",
+                "tag_id": tag_ids[i % len(tag_ids)] if i % 3 else None,
+                "due_date": due_date,
+                "is_done": is_done,
+                "notify_time": datetime.combine(due_date, datetime.min.time()),
+                "send_remind": False,
+            })
+            if len(rows) == 10000:
+                await conn.execute(sqlalchemy.insert(TaskModel), rows)
+                rows = list()
+        if rows:
+            await conn.execute(sqlalchemy.insert(TaskModel), rows)
+
+
+class PoolCounter:  # выдачи соединений из пула и наибольшее число одновременно занятых
+    def __init__(self, engine):
+        self.checkouts = 0
+        self.in_use = 0
+        self.peak = 0
+        sqlalchemy.event.listen(engine.sync_engine.pool, "checkout", self._on_checkout)
+        sqlalchemy.event.listen(engine.sync_engine.pool, "checkin", self._on_checkin)
+
+    def _on_checkout(self, *args):
+        self.checkouts += 1
+        self.in_use += 1
+        self.peak = max(self.peak, self.in_use)
+
+    def _on_checkin(self, *args):
+        self.in_use -= 1
+
+
+class QueryCounter:  # подсчет запросов к БД через события SQLAlchemy
+    def __init__(self, *engines):
+        self.count = 0
+        for engine in set(engines):
+            sqlalchemy.event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    @contextmanager
+    def measure(self):
+        result = {"queries": 0, "seconds": 0.0}
+        start_count = self.count
+        started = perf_counter()
+        yield result
+        result["seconds"] = perf_counter() - started
+        result["queries"] = self.count - start_count
@@ -0,0 +1,67 @@
+# Пропускная способность смешанной нагрузки (чтение списков + мелкие записи)
+# на прежнем профиле движка и на production-профиле (WAL, pragmas, групповые коммиты).
+# Запуск: python -m bench.db_profiles [клиентов] [операций на клиента]
+import asyncio
+import os
+import random
+import sys
+import tempfile
+from datetime import date, datetime
+from time import perf_counter
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from bench.common import seed_tasks
+from data.database import make_engine, Writer
+from data.migrations import upgrade
+from data.models import TaskModel
+from data.tasks import fetch_task_rows
+
+USERS = 10
+
+
+async def client(session_maker, writer, operations, stats):
+    for _ in range(operations):
+        user_id = random.randint(1, USERS)
+        try:
+            if random.random() < 0.2:
+                await writer.add(TaskModel(
+                    user_id=user_id, title="новая", due_date=date.today(), notify_time=datetime.now()
+                ))
+                stats["writes"] += 1
+            else:
+                async with session_maker() as session:
+                    await fetch_task_rows(session, user_id, False)
+                stats["reads"] += 1
+        except Exception as error:
+            stats["errors"] += 1
+            stats["last_error"] = str(error).splitlines()[0]
+
+
+async def run_profile(profile, clients, operations):
+    path = os.path.join(tempfile.mkdtemp(prefix="taskbot-bench-"), "taskbot.db")
+    engine = make_engine(f"sqlite+aiosqlite:///{path}", profile, echo=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(upgrade)
+    for user_id in range(1, USERS + 1):
+        await seed_tasks(engine, user_id, 200, tags=3)
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    writer = Writer(session_maker, group=profile == "production")
+    stats = {"reads": 0, "writes": 0, "errors": 0, "last_error": ""}
+    started = perf_counter()
+    await asyncio.gather(*[client(session_maker, writer, operations, stats) for _ in range(clients)])
+    elapsed = perf_counter() - started
+    await engine.dispose()
+    total = stats["reads"] + stats["writes"]
+    print(f"{profile:<10} | {total / elapsed:>9.1f} оп/с | чтений {stats['reads']:>5} | "
+          f"записей {stats['writes']:>5} | ошибок {stats['errors']} {stats['last_error']}")
+
+
+async def run(clients, operations):
+    for profile in ("default", "production"):
+        await run_profile(profile, clients, operations)
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    asyncio.run(run(*(args or [50, 40])))
@@ -0,0 +1,58 @@
+# Задержка обработки обновления: long polling против webhook на локальном фейковом Bot API.
+# Запуск: python -m bench.delivery [обновлений]
+import asyncio
+import statistics
+import sys
+
+from bench.fake_api import FakeBotAPI, free_port, prepare_environment
+
+api = FakeBotAPI()
+prepare_environment(api)
+
+from aiohttp import web  # noqa: E402
+
+import main  # noqa: E402
+from data.database import setup_database  # noqa: E402
+from data.webhook import make_app  # noqa: E402
+
+
+def report(name, latencies):
+    latencies = sorted(latency * 1000 for latency in latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name:<8} | p50 {statistics.median(latencies):>7.2f} мс | p95 {p95:>7.2f} мс | "
+          f"max {latencies[-1]:>7.2f} мс")
+
+
+async def measure(count):
+    latencies = list()
+    for number in range(count):
+        user_id = 1000 + number % 50
+        latencies.append(await api.send(api.message_update(user_id, "/tasks"), user_id))
+    return latencies
+
+
+async def run(count):
+    await api.start()
+    await setup_database()
+    bot = main.make_bot()
+
+    polling = asyncio.create_task(main.dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+    await asyncio.sleep(0.5)
+    report("polling", await measure(count))
+    await main.dp.stop_polling()
+    await polling
+
+    port = free_port()
+    runner = web.AppRunner(make_app(main.dp, bot))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    api.webhook = f"http://127.0.0.1:{port}/webhook"
+    report("webhook", await measure(count))
+    await runner.cleanup()
+
+    await bot.session.close()
+    await api.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 300))
@@ -0,0 +1,64 @@
+# Исходящие сообщения и запросы к БД: напоминания по одному против ежедневного дайджеста.
+# Запуск: python -m bench.digest [пользователей] [задач на пользователя]
+import asyncio
+import sys
+from datetime import date, datetime, time, timedelta
+
+from bench.fake_api import FakeBotAPI, prepare_environment
+
+prepare_environment(FakeBotAPI())
+
+import sqlalchemy  # noqa: E402
+
+import main  # noqa: E402
+from bench.common import QueryCounter, seed_tasks  # noqa: E402
+from data.database import engine, write_engine, new_session, setup_database  # noqa: E402
+from data.digest import send_digests  # noqa: E402
+from data.models import OutboxModel, TaskModel, UserModel  # noqa: E402
+
+
+async def outbox_size():
+    async with new_session() as session:
+        return (await session.execute(sqlalchemy.select(sqlalchemy.func.count(OutboxModel.id)))).scalar()
+
+
+async def reset(digest):
+    tomorrow = date.today() + timedelta(days=1)
+    async with engine.begin() as conn:
+        await conn.execute(sqlalchemy.delete(OutboxModel))
+        await conn.execute(sqlalchemy.update(TaskModel).values(
+            due_date=tomorrow, notify_time=datetime.now(), send_remind=False,
+        ))
+        await conn.execute(sqlalchemy.update(UserModel).values(
+            digest_time=time(9, 0) if digest else None, digest_sent_on=None,
+        ))
+
+
+async def run(users, tasks):
+    await setup_database()
+    for user_id in range(users):
+        await seed_tasks(engine, 1000 + user_id, tasks, tags=3)
+    async with new_session() as session:
+        task_ids = (await session.execute(sqlalchemy.select(TaskModel.id))).scalars().all()
+    counter = QueryCounter(engine, write_engine)
+
+    await reset(digest=False)
+    with counter.measure() as single:
+        await main.send_reminders(task_ids)
+    single_messages = await outbox_size()
+
+    await reset(digest=True)
+    with counter.measure() as digest:
+        await main.send_reminders(task_ids)  # задачи только отмечаются
+        await send_digests(datetime.combine(date.today(), time(9, 0)))
+    digest_messages = await outbox_size()
+
+    print(f"{users} пользователей x {tasks} задач")
+    print(f"по одному | сообщений {single_messages:>6} | запросов {single['queries']:>4} | {single['seconds']:.2f} c")
+    print(f"дайджест  | сообщений {digest_messages:>6} | запросов {digest['queries']:>4} | {digest['seconds']:.2f} c")
+    return single_messages == users * tasks and digest_messages == users
+
+
+if __name__ == "__main__":
+    arguments = [int(value) for value in sys.argv[1:3]]
+    sys.exit(0 if asyncio.run(run(*(arguments or [200, 20]))) else 1)
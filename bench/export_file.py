@@ -0,0 +1,47 @@
+# Выгрузка задач в CSV и .ics: время и прирост пиковой памяти (VmHWM) при большом числе задач.
+# Запуск: python -m bench.export_file [задач]
+import asyncio
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+from bench.common import temp_database, seed_tasks
+from data.exporter import export_tasks, EXPORT_FORMATS
+
+USER = 1
+
+
+def reset_peak():  # сброс VmHWM до текущего RSS (Linux 4.0+)
+    with open("/proc/self/clear_refs", "w") as clear_refs:
+        clear_refs.write("5")
+
+
+def memory(field):  # VmRSS или VmHWM процесса, МиБ (Linux)
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+
+
+async def run(count):
+    engine, session_maker = await temp_database()
+    await seed_tasks(engine, USER, count)
+    directory = tempfile.mkdtemp(prefix="taskbot-export-")
+    ok = True
+    for fmt in EXPORT_FORMATS:
+        reset_peak()
+        baseline = memory("VmRSS")
+        path = os.path.join(directory, f"tasks.{fmt}")
+        started = perf_counter()
+        exported = await export_tasks(path, fmt, USER, False, session_maker=session_maker)
+        elapsed = perf_counter() - started
+        print(f"{fmt:<4} | {exported} задач за {elapsed:.2f} c | файл {os.path.getsize(path) / 2 ** 20:.1f} МиБ | "
+              f"пик памяти +{memory('VmHWM') - baseline:.1f} МиБ")
+        ok = ok and exported == count
+    await engine.dispose()
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)) else 1)
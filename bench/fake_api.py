@@ -0,0 +1,211 @@
+# Локальная замена Bot API для бенчмарков: getUpdates/sendMessage/answerCallbackQuery и др.
+# Сеть не нужна: бот подключается через BOT_API_URL=http://127.0.0.1:<порт>.
+import asyncio
+import itertools
+import json
+import os
+import socket
+import sys
+import tempfile
+import types
+from time import perf_counter, time
+
+from aiohttp import web, ClientSession
+
+FAKE_TOKEN = "123456:fake-token"
+
+
+def use_fake_token():  # data/config.py с настоящим токеном в репозиторий не входит
+    try:
+        import data.config  # noqa: F401
+    except ImportError:
+        sys.modules["data.config"] = types.SimpleNamespace(BOT_TOKEN=FAKE_TOKEN)
+
+
+def prepare_environment(api, **settings):  # вызывается до импорта main и data.*
+    os.environ["BOT_API_URL"] = api.url
+    os.environ["DB_URL"] = "sqlite+aiosqlite:///" + os.path.join(
+        tempfile.mkdtemp(prefix="taskbot-bench-"), "taskbot.db"
+    )
+    for name, value in settings.items():
+        os.environ[name] = str(value)
+    use_fake_token()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class FakeBotAPI:
+    def __init__(self, port=None):
+        self.port = port or free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.updates = list()
+        self.calls = list()  # (метод, параметры, время)
+        self.webhook = None  # адрес, на который доставляются обновления вместо getUpdates
+        self.files = dict()  # file_id -> содержимое, для getFile и скачивания
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._new_updates = asyncio.Event()
+        self._waiters = dict()  # chat_id -> список futures, ждущих ответа бота
+        self._runner = None
+        self._client = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._dispatch)
+        app.router.add_get("/file/bot{token}/{file_id}", self._download)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+        self._client = ClientSession()
+
+    async def stop(self):
+        await self._client.close()
+        await self._runner.cleanup()
+
+    # обновления от "пользователей"
+
+    def message_update(self, user_id, text):
+        return {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}",
+                         "username": f"user{user_id}"},
+                "text": text,
+                **({"entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]}
+                   if text.startswith("/") else {}),
+            },
+        }
+
+    def callback_update(self, user_id, data, message_id=1, reply_markup=None):  # reply_markup - клавиатура сообщения
+        user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._message_ids)),
+                "from": user,
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": {"id": 1, "is_bot": True, "first_name": "TaskBot"},
+                    "text": "...",
+                    **({"reply_markup": reply_markup} if reply_markup else dict()),
+                },
+            },
+        }
+
+    def document_update(self, user_id, file_name, content):  # сообщение с файлом
+        update = self.message_update(user_id, "")
+        message = update["message"]
+        del message["text"]
+        file_id = f"file{len(self.files) + 1}"
+        self.files[file_id] = content
+        message["document"] = {"file_id": file_id, "file_unique_id": file_id, "file_name": file_name,
+                               "file_size": len(content)}
+        return update
+
+    async def deliver(self, update):  # через webhook, если он задан, иначе в очередь getUpdates
+        if self.webhook:
+            async with self._client.post(self.webhook, json=update) as response:
+                response.raise_for_status()
+        else:
+            self.updates.append(update)
+            self._new_updates.set()
+
+    def reply(self, chat_id):  # future со временем следующего ответа бота в чат
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(chat_id, list()).append(future)
+        return future
+
+    async def send(self, update, chat_id, timeout=10):  # доставить обновление и дождаться ответа; задержка в секундах
+        waiter = self.reply(chat_id)
+        started = perf_counter()
+        await self.deliver(update)
+        answered = await asyncio.wait_for(waiter, timeout)
+        return answered - started
+
+    def count(self, method):
+        return sum(1 for name, _, _ in self.calls if name == method)
+
+    # методы Bot API
+
+    async def _dispatch(self, request):
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls.append((method, params, perf_counter()))
+        handler = getattr(self, f"_{method}", None)
+        if handler is None:
+            return web.json_response({"ok": True, "result": True})
+        if asyncio.iscoroutinefunction(handler):
+            result = await handler(params)
+        else:
+            result = handler(params)
+        return web.json_response({"ok": True, "result": result})
+
+    def _getMe(self, params):
+        return {"id": 1, "is_bot": True, "first_name": "TaskBot", "username": "taskbot"}
+
+    async def _getUpdates(self, params):
+        offset = int(params.get("offset", 0))
+        timeout = min(float(params.get("timeout", 0)), 1.0)
+        self.updates = [update for update in self.updates if update["update_id"] >= offset]
+        if not self.updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:100]
+
+    def _answered(self, chat_id):
+        now = perf_counter()
+        for future in self._waiters.pop(chat_id, list()):
+            if not future.done():
+                future.set_result(now)
+
+    def _message(self, params):
+        chat_id = int(params["chat_id"])
+        self._answered(chat_id)
+        return {
+            "message_id": int(params.get("message_id") or next(self._message_ids)),
+            "date": int(time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": 1, "is_bot": True, "first_name": "TaskBot"},
+            "text": params.get("text", ""),
+        }
+
+    _sendMessage = _message
+    _editMessageText = _message
+    _editMessageReplyMarkup = _message
+
+    def _sendDocument(self, params):
+        result = self._message(params)
+        result["document"] = {"file_id": "file", "file_unique_id": "file"}
+        return result
+
+    def _getFile(self, params):
+        file_id = params["file_id"]
+        return {"file_id": file_id, "file_unique_id": file_id, "file_size": len(self.files[file_id]),
+                "file_path": file_id}
+
+    async def _download(self, request):
+        return web.Response(body=self.files[request.match_info["file_id"]])
+
+    def _setWebhook(self, params):
+        return True
+
+    def _answerCallbackQuery(self, params):
+        return True
+
+    @staticmethod
+    def markup(params):  # клавиатура из ответа бота
+        return json.loads(params["reply_markup"]) if params.get("reply_markup") else None
@@ -0,0 +1,81 @@
+# Память процесса (RSS) при 50k пользователей, бросивших диалог редактирования:
+# прежняя схема (MemoryStorage с TaskModel и AsyncSession в данных) против SQLiteStorage с id.
+# Запуск: python -m bench.fsm_memory [пользователей]
+import asyncio
+import gc
+import os
+import sys
+import tempfile
+from datetime import date, datetime
+
+import sqlalchemy
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from data.database import make_engine, Writer
+from data.fsm_storage import SQLiteStorage
+from data.migrations import upgrade
+from data.models import FSMStateModel, TaskModel
+
+STATE = "TaskStates:change_title"
+
+
+async def abandon(storage, users, payload):
+    for start in range(0, users, 1000):
+        await asyncio.gather(*[
+            storage.set_state(StorageKey(1, user_id, user_id), STATE)
+            for user_id in range(start, min(start + 1000, users))
+        ])
+        await asyncio.gather(*[
+            storage.set_data(StorageKey(1, user_id, user_id), payload(user_id))
+            for user_id in range(start, min(start + 1000, users))
+        ])
+
+
+def rss():  # резидентная память процесса, МиБ (Linux)
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+async def measure(name, storage, users, payload):
+    gc.collect()
+    before = rss()
+    await abandon(storage, users, payload)
+    gc.collect()
+    print(f"{name:<14} | {users:>6} диалогов | +{rss() - before:>7.1f} МиБ RSS")
+
+
+async def run(users):
+    path = os.path.join(tempfile.mkdtemp(prefix="taskbot-bench-"), "taskbot.db")
+    engine = make_engine(f"sqlite+aiosqlite:///{path}", "production", echo=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(upgrade)
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    nums = {str(number): number for number in range(1, 21)}
+
+    def legacy_payload(user_id):
+        task = TaskModel(id=user_id, user_id=user_id, title="Задача", due_date=date.today(),
+                         notify_time=datetime.now())
+        return {"nums": nums, "task": task, "session": session_maker(), "answer": "№1"}
+
+    await measure("MemoryStorage", MemoryStorage(), users, legacy_payload)
+
+    storage = SQLiteStorage(engine, Writer(session_maker), purge_interval=0)
+    await measure("SQLiteStorage", storage, users, lambda user_id: {"nums": nums, "task_id": user_id, "answer": "№1"})
+
+    # имитируем истечение TTL: следующая запись удаляет все брошенные диалоги
+    async with engine.begin() as conn:
+        await conn.execute(sqlalchemy.update(FSMStateModel).values(expires_at=datetime(2000, 1, 1)))
+    await storage.set_state(StorageKey(1, -1, -1), None)
+    async with engine.connect() as conn:
+        left = (await conn.execute(sqlalchemy.select(sqlalchemy.func.count()).select_from(FSMStateModel))).scalar()
+    print(f"после истечения TTL в fsm_states осталось строк: {left}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 50000))
@@ -0,0 +1,70 @@
+# Импорт большого файла через /import: время, число запросов и пиковая память (VmHWM).
+# Запуск: python -m bench.import_file [строк]
+import asyncio
+import sys
+from datetime import date, timedelta
+from time import perf_counter
+
+from bench.fake_api import FakeBotAPI, prepare_environment
+
+api = FakeBotAPI()
+prepare_environment(api)
+
+import main  # noqa: E402
+from bench.common import QueryCounter  # noqa: E402
+from data.database import engine, write_engine, setup_database  # noqa: E402
+
+USER = 500
+
+
+def memory(field):  # VmRSS или VmHWM процесса, МиБ (Linux)
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+
+
+def make_file(lines):  # каждая десятая строка с ошибкой: через одну неверная дата и неизвестный тег
+    due = (date.today() + timedelta(days=30)).strftime("%d-%m-%Y")
+    rows = list()
+    for number in range(lines):
+        if number % 20 == 5:
+            rows.append(f"Задача {number} #работа 31-02-2020")
+        elif number % 20 == 15:
+            rows.append(f"Задача {number} #нет_такого {due}")
+        else:
+            rows.append(f"Задача {number} #работа {due}")
+    return ("\n".join(rows) + "\n").encode()
+
+
+async def run(lines):
+    await api.start()
+    await setup_database()
+    bot = main.make_bot()
+    polling = asyncio.create_task(main.dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+    await asyncio.sleep(0.5)
+    for text in ("/start", "/add_tag", "работа", "/import"):
+        await api.send(api.message_update(USER, text), USER)
+
+    content = make_file(lines)
+    before = memory("VmRSS")
+    counter = QueryCounter(engine, write_engine)
+    started = perf_counter()
+    with counter.measure() as measured:
+        await api.send(api.document_update(USER, "backlog.txt", content), USER, timeout=600)
+    elapsed = perf_counter() - started
+    summary = [params["text"] for method, params, _ in api.calls if method == "sendMessage"][-1]
+    print(summary.split("\n\n")[0])
+    print(f"{lines} строк ({len(content) / 2 ** 20:.1f} МиБ) за {elapsed:.2f} c, {lines / elapsed:.0f} строк/с, "
+          f"запросов к БД: {measured['queries']}")
+    print(f"RSS до импорта {before:.0f} МиБ, пик процесса {memory('VmHWM'):.0f} МиБ")
+
+    await main.dp.stop_polling()
+    await polling
+    await bot.session.close()
+    await api.stop()
+    return f"Добавлено задач: {lines - lines // 10}" in summary
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)) else 1)
@@ -0,0 +1,50 @@
+# Сравнение старого (N+1) и нового (один JOIN) пути для /tasks
+# Запуск: python -m bench.listing [количество задач ...]
+import asyncio
+import sys
+
+import sqlalchemy
+
+from bench.common import temp_database, seed_tasks, QueryCounter
+from data.models import TaskModel, TagModel
+from data.tasks import fetch_task_rows, render_tasks
+
+
+async def legacy_get_tasks(session, user_id, status):  # прежняя реализация get_tasks
+    result = await session.execute(sqlalchemy.select(TaskModel).where(
+        TaskModel.user_id == user_id,
+        TaskModel.is_done == status,
+    ))
+    data = dict()
+    for el in result.scalars().all():
+        tag = await session.execute(sqlalchemy.select(TagModel).where(TagModel.id == el.tag_id))
+        tag = tag.scalars().first()
+        text = f"\nЗадача №{el.id} \n{el.title}\nДедлайн: {el.due_date.strftime('%d-%m-%Y')}\n"
+        if not el.is_done:
+            text += f"Напоминание: {el.notify_time.strftime('%d-%m-%Y %H:%M')}\n"
+        if tag:
+            text += f"Тег: #{tag.title}\n"
+        data.setdefault(el.due_date, list()).append(text)
+    return [text for _, texts in sorted(data.items()) for text in texts]
+
+
+async def joined_get_tasks(session, user_id, status):
+    return render_tasks(await fetch_task_rows(session, user_id, status))
+
+
+async def run(sizes):
+    print(f"{'задач':>8} | {'путь':<8} | {'запросов':>8} | {'время, с':>9}")
+    for size in sizes:
+        engine, session_maker = await temp_database()
+        counter = QueryCounter(engine)
+        await seed_tasks(engine, 1, size)
+        for name, func in (("N+1", legacy_get_tasks), ("JOIN", joined_get_tasks)):
+            async with session_maker() as session:
+                with counter.measure() as result:
+                    await func(session, 1, False)
+            print(f"{size:>8} | {name:<8} | {result['queries']:>8} | {result['seconds']:>9.3f}")
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(run([int(arg) for arg in sys.argv[1:]] or [100, 10000, 100000]))
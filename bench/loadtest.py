@@ -0,0 +1,129 @@
+# Нагрузочный тест: N синтетических пользователей проходят реальные сценарии dp
+# через локальный фейковый Bot API на временной базе SQLite.
+# Запуск: python -m bench.loadtest --users 50 --tasks 5 [--max-p95 мс]
+import argparse
+import asyncio
+import sys
+from datetime import date, datetime, timedelta
+from time import perf_counter
+
+from bench.fake_api import FakeBotAPI, prepare_environment
+
+api = FakeBotAPI()
+prepare_environment(api, REMINDER_GLOBAL_RATE=100000, REMINDER_CHAT_INTERVAL=0)
+
+import sqlalchemy  # noqa: E402
+
+import main  # noqa: E402
+from bench.common import PoolCounter, QueryCounter  # noqa: E402
+from data.database import engine, write_engine, new_session, setup_database  # noqa: E402
+from data.models import TaskModel  # noqa: E402
+from data.outbox import outbox  # noqa: E402
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = dict()  # шаг сценария -> задержки
+        self.errors = 0
+
+    def add(self, step, latency):
+        self.latencies.setdefault(step, list()).append(latency)
+
+    @property
+    def updates(self):
+        return sum(len(values) for values in self.latencies.values())
+
+
+async def step(stats, name, update, user_id):
+    try:
+        stats.add(name, await api.send(update, user_id))
+    except asyncio.TimeoutError:
+        stats.errors += 1
+        print(f"нет ответа: пользователь {user_id}, шаг {name}")
+
+
+async def user_flow(stats, user_id, tasks):
+    due = (date.today() + timedelta(days=3)).strftime("%d-%m-%Y")
+    await step(stats, "/start", api.message_update(user_id, "/start"), user_id)
+    await step(stats, "/add_tag", api.message_update(user_id, "/add_tag"), user_id)
+    await step(stats, "тег", api.message_update(user_id, f"tag{user_id}"), user_id)
+    for number in range(tasks):
+        await step(stats, "/add_task", api.message_update(user_id, "/add_task"), user_id)
+        await step(stats, "название", api.message_update(user_id, f"Задача {number} #tag{user_id}"), user_id)
+        await step(stats, "дата", api.message_update(user_id, due), user_id)
+    await step(stats, "/tasks", api.message_update(user_id, "/tasks"), user_id)
+    await step(stats, "active", api.callback_update(user_id, "active"), user_id)
+    await step(stats, "/edit_task", api.message_update(user_id, "/edit_task"), user_id)
+    await step(stats, "edit_active", api.callback_update(user_id, "edit_active"), user_id)
+    await step(stats, "номер", api.message_update(user_id, "1"), user_id)
+    await step(stats, "change_text", api.callback_update(user_id, "change_text"), user_id)
+    await step(stats, "новое название", api.message_update(user_id, "Переименована"), user_id)
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[max(int(len(values) * share) - 1, 0)] * 1000
+
+
+def report(stats, elapsed, queries, pool):
+    everything = [latency for values in stats.latencies.values() for latency in values]
+    print(f"{'шаг':<16} | {'n':>5} | {'p50, мс':>8} | {'p95, мс':>8} | {'p99, мс':>8}")
+    for name, values in list(stats.latencies.items()) + [("всего", everything)]:
+        print(f"{name:<16} | {len(values):>5} | {percentile(values, 0.5):>8.2f} | "
+              f"{percentile(values, 0.95):>8.2f} | {percentile(values, 0.99):>8.2f}")
+    print(f"обновлений: {stats.updates}, {stats.updates / elapsed:.1f} в секунду, ошибок: {stats.errors}")
+    print(f"запросов к БД на обновление: {queries / max(stats.updates, 1):.2f}")
+    print(f"соединений читателей на обновление: {pool.checkouts / max(stats.updates, 1):.2f}, "
+          f"занято одновременно до {pool.peak}")
+    return percentile(everything, 0.95)
+
+
+async def reminder_throughput(bot):  # все задачи становятся просроченными, ставятся в outbox и рассылаются
+    async with new_session() as session:
+        await session.execute(sqlalchemy.update(TaskModel).values(notify_time=datetime.now()))
+        await session.commit()
+        task_ids = (await session.execute(sqlalchemy.select(TaskModel.id))).scalars().all()
+    sent = api.count("sendMessage")
+    started = perf_counter()
+    await main.send_reminders(task_ids)
+    await outbox.drain(bot)
+    elapsed = perf_counter() - started
+    sent = api.count("sendMessage") - sent
+    print(f"send_reminders: {sent} напоминаний за {elapsed:.2f} c, {sent / elapsed:.1f} в секунду")
+    return sent == len(task_ids)
+
+
+async def run(users, tasks, max_p95):
+    await api.start()
+    await setup_database()
+    bot = main.make_bot()
+    polling = asyncio.create_task(main.dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+    await asyncio.sleep(0.5)
+
+    counter = QueryCounter(engine, write_engine)
+    pool = PoolCounter(engine)
+    stats = Stats()
+    started = perf_counter()
+    with counter.measure() as measured:
+        await asyncio.gather(*[user_flow(stats, 10000 + user, tasks) for user in range(users)])
+    elapsed = perf_counter() - started
+    p95 = report(stats, elapsed, measured["queries"], pool)
+
+    await main.dp.stop_polling()
+    await polling
+    reminders_ok = await reminder_throughput(bot)
+    await bot.session.close()
+    await api.stop()
+
+    ok = not stats.errors and reminders_ok and (max_p95 is None or p95 <= max_p95)
+    print("OK" if ok else "FAIL")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--tasks", type=int, default=5)
+    parser.add_argument("--max-p95", type=float, default=None, help="порог p95 в мс для CI")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args.users, args.tasks, args.max_p95)) else 1)
@@ -0,0 +1,47 @@
+# Микро-бенчмарк нумерации списка: прежний разбор текста регулярками против render_tasks
+# Запуск: python -m bench.numbering [количество задач ...]
+import re
+import sys
+from datetime import date, datetime, timedelta
+from timeit import timeit
+
+from data.tasks import TaskRow, render_tasks
+
+
+def legacy_render(rows):  # прежняя схема: текст с id задачи, затем замена номера и сбор nums регуляркой
+    data = list()
+    for row in rows:
+        text = f"\nЗадача №{row.id} \n{row.title}\nДедлайн: {row.due_date.strftime('%d-%m-%Y')}\n"
+        text += f"Напоминание: {row.notify_time.strftime('%d-%m-%Y %H:%M')}\n"
+        if row.tag_title:
+            text += f"Тег: #{row.tag_title}\n"
+        data.append(text)
+    ans = list()
+    for count, i in enumerate(data, 1):
+        ans.append(i.replace(re.search(r"(№\d+)[^\n]*", i).group(1).strip(), f"<b>№{count}</b> ", 1))
+    ids = list(map(int, [re.search(r"(№\d+)[^\n]*", el).group(1).strip().strip("№") for el in data]))
+    nums = {count: task_id for count, task_id in enumerate(ids, 1)}
+    return "".join(ans), nums
+
+
+def make_rows(count):
+    today = date.today()
+    return [
+        TaskRow(i + 1000, f"Задача {i}", today + timedelta(days=i % 30),
+                datetime.now(), False, "tag" if i % 2 else None)
+        for i in range(count)
+    ]
+
+
+def run(sizes):
+    print(f"{'задач':>8} | {'регулярки, мс':>14} | {'render_tasks, мс':>17}")
+    for size in sizes:
+        rows = make_rows(size)
+        repeat = max(1, 10000 // size)
+        legacy = timeit(lambda: legacy_render(rows), number=repeat) / repeat * 1000
+        current = timeit(lambda: render_tasks(rows), number=repeat) / repeat * 1000
+        print(f"{size:>8} | {legacy:>14.3f} | {current:>17.3f}")
+
+
+if __name__ == "__main__":
+    run([int(arg) for arg in sys.argv[1:]] or [10, 100, 1000, 10000])
@@ -0,0 +1,62 @@
+# Проверка планов горячих запросов: завершается с ошибкой, если запрос
+# к tasks/tags выполняется полным сканированием таблицы.
+# Запуск: python -m bench.query_plans
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import date, datetime
+
+import sqlalchemy
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from data.archive import archive_candidates
+from data.digest import due_users_query, digest_rows_query
+from data.migrations import upgrade
+from data.models import TagModel, TaskCounterModel
+from data.outbox import due_messages_query
+from data.reminders import pending_reminders_query
+from data.stats import rollover_statement
+from data.tasks import task_rows_query
+
+
+def hot_queries():
+    return {
+        "список задач": task_rows_query(1, False),
+        "список задач по тегу": task_rows_query(1, False, 1),
+        "завершенные с архивом": task_rows_query(1, True, after=(date(2030, 1, 1), 5), limit=11),
+        "кандидаты в архив": archive_candidates(datetime(2030, 1, 1), 1000),
+        "очередь напоминаний": pending_reminders_query(),
+        "теги пользователя": sqlalchemy.select(TagModel).where(TagModel.user_id == 1),
+        "очередь outbox": due_messages_query(datetime(2030, 1, 1), 100),
+        "получатели дайджеста": due_users_query(datetime(2030, 1, 1, 9)),
+        "задачи дайджеста": digest_rows_query([1, 2, 3], date(2030, 1, 1)),
+        "счетчики /stats": sqlalchemy.select(TaskCounterModel).where(TaskCounterModel.user_id == 1),
+        "сдвиг просроченных": rollover_statement(date(2030, 1, 1), 1000),
+    }
+
+
+def full_scans(plan):  # SCAN anon_N - чтение уже ограниченного подзапроса (ветки UNION), не таблицы
+    return [detail for detail in plan
+            if detail.startswith("SCAN ") and " INDEX " not in detail and not detail.startswith("SCAN anon_")]
+
+
+async def check():
+    path = os.path.join(tempfile.mkdtemp(prefix="taskbot-plans-"), "taskbot.db")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(upgrade)
+    failed = False
+    async with engine.connect() as conn:
+        for name, query in hot_queries().items():
+            sql = str(query.compile(conn.engine, compile_kwargs={"literal_binds": True}))
+            plan = [row[-1] for row in (await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")).all()]
+            scans = full_scans(plan)
+            failed = failed or bool(scans)
+            print(f"{'FAIL' if scans else 'ok':<4} {name}: {'; '.join(plan)}")
+    await engine.dispose()
+    return not failed
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(check()) else 1)
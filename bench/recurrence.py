@@ -0,0 +1,43 @@
+# Проверка правил повторения: серия от 31-го через февраль и короткие месяцы,
+# разбор "каждые N дней" во всех падежах. Выход с кодом 1 при расхождении.
+# Запуск: python -m bench.recurrence
+import sys
+from datetime import date
+
+from data.recurrence import next_due, parse_rule
+
+
+def chain(rule, due_date, count):  # count следующих экземпляров, каждый от предыдущего, как в materialise
+    dates = list()
+    for _ in range(count):
+        due_date = next_due(rule, due_date, today=due_date)
+        dates.append(due_date)
+    return dates
+
+
+def check(name, actual, expected):
+    ok = actual == expected
+    shown = ", ".join(map(str, actual)) if isinstance(actual, list) else actual
+    print(f"{'OK  ' if ok else 'FAIL'} {name}: {shown}" + ("" if ok else f", ожидалось {expected}"))
+    return ok
+
+
+def run():
+    start = date(2027, 1, 31)
+    rule = parse_rule("ежемесячно", start)
+    ok = check("правило", rule, "monthly:31")
+    ok &= check("от 31 января", chain(rule, start, 5), [
+        date(2027, 2, 28), date(2027, 3, 31), date(2027, 4, 30), date(2027, 5, 31), date(2027, 6, 30),
+    ])
+    ok &= check("от 30 января в високосный год", chain(parse_rule("ежемесячно", date(2028, 1, 30)), date(2028, 1, 30), 3),
+                [date(2028, 2, 29), date(2028, 3, 30), date(2028, 4, 30)])
+    ok &= check("пропущенные месяцы", next_due(rule, start, today=date(2027, 4, 15)), date(2027, 4, 30))
+    ok &= check("старое правило без числа", next_due("monthly", date(2027, 1, 15)), date(2027, 2, 15))
+    for text, expected in [("каждые 3 дня", "every:3"), ("каждые 5 дней", "every:5"), ("каждый 1 день", "every:1"),
+                           ("каждые 21 день", "every:21"), ("каждые 0 дней", None), ("каждые 400 дней", None)]:
+        ok &= check(text, parse_rule(text, start), expected)
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run() else 1)
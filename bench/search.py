@@ -0,0 +1,111 @@
+# Поиск задачи пользователя: FTS5 (/search) против LIKE по названию, на большом числе задач.
+# Запуск: python -m bench.search [задач] [пользователей]
+import asyncio
+import itertools
+import os
+import random
+import statistics
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+from time import perf_counter
+
+import sqlalchemy
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from data.migrations import upgrade
+from data.models import TaskModel, TagModel, UserModel
+from data.search import search_query
+
+WORDS = ("купить позвонить отчет встреча молоко проект оплатить счет врач записаться ремонт машина "
+         "подарок билеты дизайн код ревью релиз бэкап сервер договор налоги уборка спорт книга курс "
+         "письмо банк квартира отпуск презентация бюджет клиент поставщик склад доставка").split()
+
+
+def vocabulary(rng, size=20000):  # частые слова плюс синтетические, частоты по закону Ципфа
+    syllables = "ка ло ми ре ту са не по ви да ро ла ко ту бе ма зи ну".split()
+    words = list(WORDS)
+    while len(words) < size:
+        words.append("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return words, list(itertools.accumulate(1 / rank for rank in range(1, len(words) + 1)))
+
+
+async def seed(engine, tasks, users):
+    rng = random.Random(1)
+    words, cumulative = vocabulary(rng)
+    today = date.today()
+    async with engine.begin() as conn:
+        await conn.execute(sqlalchemy.insert(UserModel), [{"tg_id": user, "username": None} for user in range(users)])
+        await conn.execute(sqlalchemy.insert(TagModel), [
+            {"user_id": user, "title": f"{rng.choice(WORDS)}_{user}"} for user in range(users)
+        ])
+        rows = list()
+        for number in range(tasks):
+            user = number % users
+            due_date = today + timedelta(days=number % 365)
+            rows.append({
+                "user_id": user,
+                "title": " ".join(rng.choices(words, cum_weights=cumulative, k=3)) + f" {number}",
+                "tag_id": user + 1 if number % 2 else None,
+                "due_date": due_date,
+                "is_done": number % 5 == 0,
+                "notify_time": datetime.combine(due_date, datetime.min.time()),
+                "send_remind": False,
+            })
+            if len(rows) == 20000:
+                await conn.execute(sqlalchemy.insert(TaskModel), rows)
+                rows = list()
+        if rows:
+            await conn.execute(sqlalchemy.insert(TaskModel), rows)
+
+
+def like_query(user_id, text):
+    return (
+        sqlalchemy.select(TaskModel.id, TaskModel.title)
+        .where(TaskModel.user_id == user_id, TaskModel.title.like(f"%{text}%"))
+        .limit(20)
+    )
+
+
+def like_all_query(text):  # поиск без индекса пользователя, как если бы нужен был любой владелец
+    return sqlalchemy.select(TaskModel.id).where(TaskModel.title.like(f"%{text}%")).limit(20)
+
+
+async def timed(conn, query, repeats):
+    times = list()
+    for _ in range(repeats):
+        started = perf_counter()
+        rows = (await conn.execute(query)).all()
+        times.append((perf_counter() - started) * 1000)
+    return statistics.median(times), len(rows)
+
+
+async def run(tasks, users):
+    path = os.path.join(tempfile.mkdtemp(prefix="taskbot-search-"), "taskbot.db")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(upgrade)
+    started = perf_counter()
+    await seed(engine, tasks, users)
+    print(f"{tasks} задач, {users} пользователей, вставка с триггерами FTS: {perf_counter() - started:.1f} c")
+
+    async with engine.connect() as conn:
+        cases = [
+            ("FTS5 слово", search_query(7, "молоко")),
+            ("FTS5 префикс", search_query(7, "молок")),
+            ("FTS5 два слова", search_query(7, "оплатить сч")),
+            ("FTS5 по тегу", search_query(7, WORDS[0][:3])),
+            ("LIKE пользователя", like_query(7, "молоко")),
+            ("LIKE по всей таблице", like_all_query("молоко 99")),
+        ]
+        for name, query in cases:
+            median, found = await timed(conn, query, 20)
+            print(f"{name:<22} | {median:>8.2f} мс | найдено {found}")
+        fts, _ = await timed(conn, cases[0][1], 20)
+    await engine.dispose()
+    return fts < 50
+
+
+if __name__ == "__main__":
+    arguments = [int(value) for value in sys.argv[1:3]]
+    sys.exit(0 if asyncio.run(run(*(arguments or [1000000, 2000]))) else 1)
@@ -0,0 +1,59 @@
+# /stats: чтение счетчиков против COUNT(*) по tasks для пользователей с разным числом задач.
+# Запуск: python -m bench.stats [задач у самого крупного пользователя]
+import asyncio
+import statistics
+import sys
+from datetime import date
+from time import perf_counter
+
+from bench.fake_api import FakeBotAPI, prepare_environment
+
+prepare_environment(FakeBotAPI())
+
+import sqlalchemy  # noqa: E402
+
+from bench.common import seed_tasks  # noqa: E402
+from data.database import engine, new_session, setup_database, writer  # noqa: E402
+from data.models import TaskModel  # noqa: E402
+from data.stats import reconcile_users, stats_maintenance, truth_query, user_counters  # noqa: E402
+
+
+async def timed(read, repeats=30):
+    times = list()
+    async with new_session() as session:
+        for _ in range(repeats):
+            started = perf_counter()
+            await read(session)
+            times.append((perf_counter() - started) * 1000)
+    return statistics.median(times)
+
+
+async def run(largest):
+    await setup_database()
+    sizes = [size for size in (1000, 10000, 100000, 1000000) if size <= largest]
+    for user_id, size in enumerate(sizes, 1):
+        await seed_tasks(engine, user_id, size, tags=10)
+    async with engine.begin() as conn:  # каждая третья задача завершена
+        await conn.execute(sqlalchemy.update(TaskModel).where(TaskModel.id % 3 == 0).values(is_done=True))
+    # счетчики по засеянным напрямую задачам заполняет сверка, как после миграции
+    started = perf_counter()
+    await stats_maintenance.reconcile()
+    print(f"сверка всех счетчиков: {perf_counter() - started:.2f} c")
+
+    print(f"{'задач':>8} | {'счетчики, мс':>12} | {'COUNT(*), мс':>12}")
+    ok = True
+    for user_id, size in enumerate(sizes, 1):
+        counters = await timed(lambda session: user_counters(session, user_id))
+        counts = await timed(lambda session: session.execute(truth_query([user_id], date.today())), repeats=5)
+        print(f"{size:>8} | {counters:>12.2f} | {counts:>12.2f}")
+        ok = ok and counters < 5
+
+    async def work(session):
+        return await reconcile_users(session, list(range(1, len(sizes) + 1)))
+    drift = await writer.submit(work)
+    print(f"расхождений после сверки: {drift}")
+    return ok and not drift
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)) else 1)
@@ -0,0 +1,115 @@
+# Ограничитель частоты: задержка обычных пользователей, пока один пользователь засыпает бота
+# командами и листанием страниц, без ограничителя и с ним; отсев повторов и двойных нажатий;
+# память ограничителя при большом числе пользователей.
+# Запуск: python -m bench.throttling [обновлений от нарушителя]
+import asyncio
+import statistics
+import sys
+from datetime import date
+from time import perf_counter
+
+from bench.fake_api import FakeBotAPI, prepare_environment
+
+api = FakeBotAPI()
+prepare_environment(api)
+
+from aiogram.types import Update  # noqa: E402
+
+import main  # noqa: E402
+from bench.common import seed_tasks  # noqa: E402
+from data.database import engine, setup_database  # noqa: E402
+from data.tasks import Page  # noqa: E402
+from data.throttling import ThrottlingMiddleware, setup_throttling  # noqa: E402
+
+ABUSER = 1
+USERS = range(1000, 1020)
+
+
+async def normal_user(user_id, latencies, requests=10):
+    for _ in range(requests):
+        latencies.append(await api.send(api.message_update(user_id, "/tasks"), user_id))
+
+
+async def flood(count):  # обновления без ожидания ответа; листание - с разными message_id, чтобы не слиться
+    page = Page(0, False, None, "n", date(2000, 1, 1), 0, 1).pack()
+    for number in range(count):
+        if number % 2:
+            await api.deliver(api.message_update(ABUSER, "/tasks"))
+        else:
+            await api.deliver(api.callback_update(ABUSER, page, message_id=number))
+
+
+async def settle():  # ждать, пока бот перестанет отвечать
+    while True:
+        calls = len(api.calls)
+        await asyncio.sleep(0.5)
+        if len(api.calls) == calls:
+            return
+
+
+def abuser_answers():
+    return sum(1 for method, params, _ in api.calls
+               if method in ("sendMessage", "editMessageText") and params.get("chat_id") == str(ABUSER))
+
+
+async def phase(name, count):
+    latencies = list()
+    answered = abuser_answers()
+    started = perf_counter()
+    await asyncio.gather(flood(count), *[normal_user(user_id, latencies) for user_id in USERS])
+    await settle()
+    elapsed = perf_counter() - started - 0.5
+    latencies = sorted(latency * 1000 for latency in latencies)
+    print(f"{name:<16} | p50 {statistics.median(latencies):>7.2f} мс | "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1]:>7.2f} мс | "
+          f"ответов нарушителю {abuser_answers() - answered:>5} | до затишья {elapsed:.2f} c")
+
+
+def memory_check(users=200000):
+    throttling = ThrottlingMiddleware(max_users=50000, idle=30)
+    for number in range(users):  # 1000 новых пользователей в секунду
+        update = api.message_update(10 ** 6 + number, "/tasks")
+        throttling.check(Update.model_validate(update), number / 1000)
+    print(f"пользователей в ограничителе после {users} разных за {users / 1000:.0f} c: {len(throttling)}")
+    return len(throttling) <= 30 * 1000 + 1
+
+
+async def run(count):
+    await api.start()
+    await setup_database()
+    await seed_tasks(engine, ABUSER, 1000)
+    for user_id in [*USERS, 2000]:
+        await seed_tasks(engine, user_id, 20)
+    bot = main.make_bot()
+    polling = asyncio.create_task(main.dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+    await asyncio.sleep(0.5)
+
+    await phase("без ограничителя", count)
+    throttling = setup_throttling(main.dp)
+    await phase("с ограничителем", count)
+    print(f"отброшено: {throttling.dropped}")
+
+    # повторная доставка того же update_id и двойное нажатие одной кнопки
+    before = api.count("sendMessage")
+    update = api.message_update(2000, "/tasks")
+    await api.send(update, 2000)
+    await api.deliver(update)
+    await settle()
+    duplicates = api.count("sendMessage") - before
+    page = Page(0, False, None, "n", date(2000, 1, 1), 0, 1).pack()
+    before = api.count("editMessageText")
+    for _ in range(2):
+        await api.deliver(api.callback_update(2000, page, message_id=77))
+    await settle()
+    taps = api.count("editMessageText") - before
+    print(f"ответов на повтор update_id: {duplicates}, обработано двойных нажатий: {taps}")
+
+    await main.dp.stop_polling()
+    await polling
+    await bot.session.close()
+    await api.stop()
+    return memory_check() and duplicates == 1 and taps == 1 and throttling.dropped.get("messages", 0) > 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)) else 1)
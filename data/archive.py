@@ -0,0 +1,107 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import sqlalchemy
+
+from data.database import writer
+from data.models import TaskModel, ArchivedTaskModel
+from data.periodic import PeriodicJob
+from data.settings import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH, ARCHIVE_INTERVAL
+
+# Архив завершенных задач. Задачи, завершенные больше ARCHIVE_AFTER_DAYS дней назад, переносятся
+# из tasks в tasks_archive пачками, каждая пачка - отдельная транзакция писателя. Так в tasks
+# остаются активные и недавно завершенные задачи: индексы списков и напоминаний маленькие и
+# не вытесняются из кэша страниц. Список "Завершенные" читает обе таблицы (task_rows_query),
+# "Сделать активной" возвращает задачу в tasks с тем же id. Триггеры поиска срабатывают
+# на удаление и вставку в tasks: архивная задача выпадает из /search, восстановленная - возвращается.
+
+COLUMNS = [column.name for column in TaskModel.__table__.columns]
+
+
+def backfill_done_at(conn):  # шаг миграции: у задач, завершенных до появления done_at, время завершения - дедлайн
+    conn.exec_driver_sql(
+        "UPDATE tasks SET done_at = coalesce(due_date, date('now')) || ' 00:00:00.000000' "
+        "WHERE is_done = 1 AND done_at IS NULL"
+    )
+
+
+def archive_candidates(cutoff, limit):
+    return (
+        sqlalchemy.select(*(TaskModel.__table__.c[name] for name in COLUMNS))
+        .where(
+            TaskModel.is_done == True,
+            TaskModel.done_at < cutoff,
+        )
+        .order_by(TaskModel.done_at)
+        .limit(limit)
+    )
+
+
+async def restore_task(session, task_id):  # в транзакции вызывающего: архивная задача возвращается в tasks
+    return bool(await restore_tasks(session, [task_id]))
+
+
+async def restore_tasks(session, task_ids, user_id=None):  # то же для набора задач; возвращает число возвращенных
+    archived = ArchivedTaskModel.__table__
+    condition = [archived.c.id.in_(task_ids)]
+    if user_id is not None:
+        condition.append(archived.c.user_id == user_id)
+    result = await session.execute(
+        sqlalchemy.insert(TaskModel).from_select(
+            COLUMNS, sqlalchemy.select(*(archived.c[name] for name in COLUMNS)).where(*condition)
+        )
+    )
+    if result.rowcount:
+        await session.execute(sqlalchemy.delete(ArchivedTaskModel).where(*condition))
+    return result.rowcount
+
+
+async def get_archived_task(session, user_id, task_id):
+    return (await session.execute(sqlalchemy.select(ArchivedTaskModel).where(
+        ArchivedTaskModel.user_id == user_id,
+        ArchivedTaskModel.id == task_id,
+    ))).scalars().first()
+
+
+class Archiver(PeriodicJob):
+    def __init__(self, after=ARCHIVE_AFTER_DAYS, batch=ARCHIVE_BATCH, interval=ARCHIVE_INTERVAL):
+        super().__init__()
+        self.after = timedelta(days=after)
+        self.batch = batch
+        self.interval = interval
+        self.archived = 0
+
+    async def archive_batch(self, now=None):  # одна пачка; возвращает число перенесенных задач
+        cutoff = (now or datetime.now()) - self.after
+
+        async def work(session):
+            # INSERT ... SELECT первым оператором: выборка видит последние коммиты всех процессов
+            result = await session.execute(
+                sqlalchemy.insert(ArchivedTaskModel)
+                .from_select(COLUMNS, archive_candidates(cutoff, self.batch))
+                .returning(ArchivedTaskModel.id)
+            )
+            task_ids = result.scalars().all()
+            if task_ids:
+                await session.execute(sqlalchemy.delete(TaskModel).where(TaskModel.id.in_(task_ids)))
+            return len(task_ids)
+        count = await writer.submit(work)
+        self.archived += count
+        return count
+
+    async def archive(self, now=None):  # все накопившиеся задачи, пачка за пачкой
+        total = 0
+        while True:
+            count = await self.archive_batch(now)
+            total += count
+            if count < self.batch:
+                return total
+            await asyncio.sleep(0)  # между пачками писатель успевает обслужить обработчики
+
+    async def tick(self):
+        count = await self.archive()
+        if count:
+            print(f"Архив: перенесено {count} завершенных задач")
+
+
+archiver = Archiver()
@@ -6,7 +6,12 @@ MESSAGES = {
                      "/start  -  запустить бота\n"
                      "/tasks  -  просмотр задач\n"
                      "/add_task  -  добавить задачу\n"
+                     "/import  -  импорт задач из файла\n"
+                     "/export  -  выгрузка задач в CSV или календарь\n"
+                     "/digest  -  ежедневная сводка вместо отдельных напоминаний\n"
                      "/edit_task  -  отредактировать задачу\n"
+                     "/search  -  поиск задач по названию и тегу\n"
+                     "/stats  -  сколько задач активно, просрочено и завершено\n"
                      "/add_tag  -  добавить тег\n"
                      "/delete_tag  -  удалить тег\n"
                      "/stop  -  сброс действий"
@@ -0,0 +1,68 @@
+from datetime import datetime
+
+import sqlalchemy
+
+from data.archive import restore_tasks
+from data.models import TaskModel, ArchivedTaskModel
+from data.recurrence import materialise
+from data.stats import count_tasks, task_delta
+from data.tasks import default_notify_time
+
+# Массовое редактирование из /edit_task: действие над отмеченными задачами - один оператор
+# UPDATE/DELETE по набору id в одной транзакции писателя вместе со счетчиками /stats
+# и следующими повторами. Каждый оператор ограничен задачами пользователя, поэтому
+# подставленный в callback_data чужой id ничего не меняет. Все функции выполняются
+# в транзакции вызывающего (writer.submit) и возвращают строки измененных задач.
+
+CHANGED = (
+    TaskModel.id, TaskModel.user_id, TaskModel.title, TaskModel.tag_id, TaskModel.due_date,
+    TaskModel.notify_time, TaskModel.repeat, TaskModel.is_done, TaskModel.send_remind, TaskModel.custom_remind,
+)
+
+
+async def change_tasks(session, user_id, task_ids, done, **values):  # done - текущий статус задач
+    # счетчикам нужны значения до изменения, а RETURNING отдает новые: они читаются
+    # отдельным запросом, параллельной записи между ними нет - транзакция писателя одна
+    condition = (TaskModel.user_id == user_id, TaskModel.id.in_(task_ids), TaskModel.is_done == done)
+    before = (await session.execute(
+        sqlalchemy.select(TaskModel.user_id, TaskModel.tag_id, TaskModel.due_date, TaskModel.is_done).where(*condition)
+    )).all()
+    if not before:
+        return list()
+    after = (await session.execute(
+        sqlalchemy.update(TaskModel).where(*condition).values(**values).returning(*CHANGED)
+    )).all()
+    await count_tasks(session, [task_delta(row, -1) for row in before] + [task_delta(row) for row in after])
+    return after
+
+
+async def complete_tasks(session, user_id, task_ids):  # (завершенные, [(id, notify_time, due_date)] повторов)
+    done = await change_tasks(session, user_id, task_ids, False, is_done=True, done_at=datetime.now())
+    return done, await materialise(session, done)
+
+
+async def reopen_tasks(session, user_id, task_ids):  # задачи из архива сначала возвращаются в tasks
+    await restore_tasks(session, task_ids, user_id)
+    return await change_tasks(session, user_id, task_ids, True, is_done=False, done_at=None)
+
+
+async def retag_tasks(session, user_id, task_ids, tag_id):
+    return await change_tasks(session, user_id, task_ids, False, tag_id=tag_id)
+
+
+async def reschedule_tasks(session, user_id, task_ids, due_date):
+    return await change_tasks(session, user_id, task_ids, False, due_date=due_date,
+                              notify_time=default_notify_time(due_date), send_remind=False, custom_remind=False)
+
+
+async def delete_tasks(session, user_id, task_ids):  # задачи могут лежать и в tasks, и в архиве; возвращает id
+    deleted = list()
+    for model in (TaskModel, ArchivedTaskModel):
+        rows = (await session.execute(
+            sqlalchemy.delete(model)
+            .where(model.user_id == user_id, model.id.in_(task_ids))
+            .returning(model.id, model.user_id, model.tag_id, model.due_date, model.is_done)
+        )).all()
+        await count_tasks(session, [task_delta(row, -1) for row in rows])
+        deleted += [row.id for row in rows]
+    return deleted
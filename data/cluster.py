@@ -0,0 +1,151 @@
+import asyncio
+import json
+import os
+import sys
+
+from aiogram import Bot, Dispatcher
+from aiogram.utils.backoff import Backoff, BackoffConfig
+
+from data.settings import (
+    WORKERS, WORKER_QUEUE, WORKER_MAX_IN_FLIGHT, WORKER_RESTART_DELAY, DELIVERY_MODE, METRICS_ENABLED, METRICS_PORT
+)
+from data.webhook import run_webhook
+
+# Несколько процессов на одной машине. Супервизор получает обновления (polling или webhook)
+# и передает их рабочим процессам построчно в JSON через stdin. Рабочий выбирается по tg_id:
+# все обновления пользователя обрабатывает один процесс, поэтому SimpleEventIsolation и кэш
+# тегов остаются верными без межпроцессных блокировок. Фоновые задачи (напоминания, дайджест,
+# outbox) выполняет только ведущий - рабочий, держащий аренду в таблице leases (data/lease.py).
+
+
+def shard_key(update):  # tg_id автора сырого обновления; 0 - обновление без пользователя
+    for name, event in update.items():
+        if isinstance(event, dict):
+            user = event.get("from") or event.get("user") or event.get("chat") or dict()
+            return user.get("id", 0)
+    return 0
+
+
+class Worker:  # рабочий процесс и очередь обновлений к нему; упавший процесс перезапускается
+    def __init__(self, index, command, queue_size=WORKER_QUEUE):
+        self.index = index
+        self.command = command
+        # полная очередь задерживает получение обновлений - Telegram придерживает остальные сам
+        self.queue = asyncio.Queue(queue_size)
+        self.process = None
+        self.restarts = 0
+        self.stopping = False
+
+    def environment(self):
+        environment = dict(os.environ, WORKER_INDEX=str(self.index))
+        if METRICS_ENABLED:  # у каждого рабочего свой порт метрик, супервизор порт не занимает
+            environment["METRICS_PORT"] = str(METRICS_PORT + self.index)
+        return environment
+
+    async def run(self):
+        while not self.stopping:
+            self.process = await asyncio.create_subprocess_exec(
+                *self.command, stdin=asyncio.subprocess.PIPE, env=self.environment()
+            )
+            feeding = asyncio.create_task(self._feed(self.process))
+            code = await self.process.wait()
+            feeding.cancel()
+            await asyncio.gather(feeding, return_exceptions=True)
+            if self.stopping:
+                break
+            # обновления, уже записанные в stdin упавшего процесса, теряются; очередь переходит к новому
+            self.restarts += 1
+            print(f"Рабочий {self.index} завершился с кодом {code}, перезапуск")
+            await asyncio.sleep(WORKER_RESTART_DELAY)
+
+    async def _feed(self, process):
+        while True:
+            update = await self.queue.get()
+            process.stdin.write(json.dumps(update, ensure_ascii=False).encode() + b"\n")
+            await process.stdin.drain()
+
+    async def stop(self, timeout=30):  # закрытый stdin - сигнал рабочему доработать принятое и выйти
+        self.stopping = True
+        if self.process is None or self.process.returncode is not None:
+            return
+        while not self.queue.empty() and self.process.returncode is None:
+            await asyncio.sleep(0.05)
+        self.process.stdin.close()
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.process.kill()
+
+
+class Supervisor:
+    def __init__(self, command, workers=WORKERS):
+        self.workers = [Worker(index, command) for index in range(workers)]
+        self._runners = list()
+
+    def start(self):
+        self._runners = [asyncio.create_task(worker.run()) for worker in self.workers]
+
+    async def feed_raw_update(self, bot: Bot, update: dict):  # интерфейс Dispatcher: подходит для WebhookHandler
+        await self.workers[shard_key(update) % len(self.workers)].queue.put(update)
+
+    async def poll(self, bot: Bot, allowed_updates=None, timeout=10):
+        # long polling getUpdates с отсрочкой при ошибках сети, как у dp.start_polling;
+        # обновление подтверждается следующим запросом (offset), когда оно уже в очереди рабочего
+        backoff = Backoff(BackoffConfig(min_delay=1.0, max_delay=5.0, factor=1.3, jitter=0.1))
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=timeout, allowed_updates=allowed_updates,
+                                                request_timeout=timeout + 10)
+            except Exception as error:
+                print(f"Супервизор: getUpdates не удался: {error!r}")
+                await backoff.asleep()
+                continue
+            backoff.reset()
+            for update in updates:
+                await self.feed_raw_update(bot, update.model_dump(mode="json", exclude_none=True, by_alias=True))
+                offset = update.update_id + 1
+
+    async def stop(self):
+        await asyncio.gather(*(worker.stop() for worker in self.workers))
+        await asyncio.gather(*self._runners, return_exceptions=True)
+
+
+async def run_supervisor(bot: Bot, command, allowed_updates=None):
+    supervisor = Supervisor(command)
+    supervisor.start()
+    print(f"Супервизор: {len(supervisor.workers)} рабочих процессов")
+    try:
+        if DELIVERY_MODE == "webhook":
+            await run_webhook(supervisor, bot)
+        else:
+            await bot.delete_webhook()
+            await supervisor.poll(bot, allowed_updates)
+    finally:
+        await supervisor.stop()
+        await bot.session.close()
+
+
+async def serve_stdin(dp: Dispatcher, bot: Bot, max_in_flight=WORKER_MAX_IN_FLIGHT):
+    # рабочий процесс: обновления от супервизора до закрытия stdin, затем ожидание начатых
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=2 ** 24)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    semaphore = asyncio.Semaphore(max_in_flight)  # пока все заняты, stdin не читается и очередь копится у супервизора
+    in_flight = set()
+
+    async def process(update):
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception as error:
+            print(error)
+        finally:
+            semaphore.release()
+
+    while line := await reader.readline():
+        await semaphore.acquire()
+        task = asyncio.create_task(process(json.loads(line)))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+    if in_flight:
+        await asyncio.gather(*in_flight, return_exceptions=True)
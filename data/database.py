@@ -1,18 +1,142 @@
+import asyncio
+import contextvars
+
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 
+from data.settings import (
+    DB_URL, DB_PROFILE, DB_ECHO, DB_SYNCHRONOUS, DB_CACHE_SIZE, DB_MMAP_SIZE, DB_BUSY_TIMEOUT,
+    DB_READ_POOL_SIZE, DB_WRITE_BATCH, DB_WRITE_DELAY
+)
+
+
+def make_engine(url=DB_URL, profile=DB_PROFILE, echo=DB_ECHO, pool_size=DB_READ_POOL_SIZE):
+    # движок с выбранным профилем SQLite
+    if profile != "production":
+        return create_async_engine(url, echo=echo)
+    engine = create_async_engine(
+        url,
+        echo=echo,
+        pool_size=pool_size,
+        max_overflow=0,
+    )
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA cache_size={DB_CACHE_SIZE}")
+        cursor.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    return engine
+
+
+class Writer:  # единственный писатель: мелкие записи обработчиков объединяются в групповые транзакции
+    def __init__(self, session_maker, batch=DB_WRITE_BATCH, delay=DB_WRITE_DELAY, group=DB_PROFILE == "production"):
+        self.session_maker = session_maker
+        self.batch = batch
+        self.delay = delay
+        self.group = group
+        self._queue = None
+        self._runner = None
+
+    async def submit(self, work):  # work(session) выполняется в общей транзакции, результат возвращается вызывающему
+        if not self.group:
+            async with self.session_maker() as session:
+                result = await work(session)
+                await session.commit()
+                return result
+        if self._runner is None or self._runner.done():
+            if self._queue is None or self._queue.empty():  # записи из очереди упавшего писателя не теряются
+                self._queue = asyncio.Queue()
+            self._runner = asyncio.create_task(self.run(), context=contextvars.Context())
+        future = asyncio.get_running_loop().create_future()
+        context = contextvars.copy_context()  # запросы записи относятся к обновлению, которое их отправило
+
+        def bound(session):
+            return asyncio.create_task(work(session), context=context)
+
+        await self._queue.put((bound, future))
+        return await future
+
+    async def add(self, instance):  # вставка одного объекта, после коммита доступен его id
+        async def work(session):
+            session.add(instance)
+            await session.flush()
+            return instance
+        return await self.submit(work)
+
+    async def execute(self, statement):  # одиночный UPDATE/DELETE в групповой транзакции
+        async def work(session):
+            return (await session.execute(statement)).rowcount
+        return await self.submit(work)
+
+    async def _collect(self):
+        items = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.delay
+        while len(items) < self.batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    async def _commit(self, items):
+        async with self.session_maker() as session:
+            results = [await work(session) for work, _ in items]
+            await session.commit()
+        return results
+
+    @staticmethod
+    def _resolve(future, result=None, error=None):
+        if future.done():  # вызывающий перестал ждать (таймаут, отмена) - результат никому не нужен
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    async def run(self):
+        while True:
+            items = await self._collect()
+            try:
+                results = await self._commit(items)
+            except Exception:
+                # группа откатилась целиком - повторяем по одной записи, чтобы ошибка досталась только виновнику
+                for item in items:
+                    try:
+                        self._resolve(item[1], (await self._commit([item]))[0])
+                    except Exception as error:
+                        self._resolve(item[1], error=error)
+                continue
+            for (work, future), result in zip(items, results):
+                self._resolve(future, result)
+
+
 # асинхронный движок
-engine = create_async_engine("sqlite+aiosqlite:///data/taskbot.db", echo=True)
+engine = make_engine()
 # Создание фабрики асинхронных сессий
 new_session = async_sessionmaker(engine, expire_on_commit=False)
+# Очередь записей; у писателя свое соединение, чтобы читатели, ждущие записи, не занимали его в пуле
+write_engine = make_engine(pool_size=1) if DB_PROFILE == "production" else engine
+writer = Writer(async_sessionmaker(write_engine, expire_on_commit=False))
 
 
 class Base(DeclarativeBase): pass
 
 
 async def setup_database(): # настройка баз данных
+    from data.migrations import upgrade
     engine.echo = False
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all) # удаляем существующие таблицы
-        await conn.run_sync(Base.metadata.create_all) # создаем таблицы заново
-    engine.echo = True
\ No newline at end of file
+        await conn.run_sync(upgrade) # применяем недостающие миграции, данные сохраняются
+    engine.echo = DB_ECHO
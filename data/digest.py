@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta
+from itertools import groupby
+
+import sqlalchemy
+
+from data.database import new_session, writer
+from data.models import TaskModel, TagModel, UserModel
+from data.outbox import outbox
+from data.periodic import PeriodicJob
+from data.settings import DIGEST_USERS_BATCH, DIGEST_MAX_TASKS
+
+# Ежедневный дайджест: пользователь с заданным digest_time получает одно сообщение с задачами
+# на завтра и просроченными вместо отдельного напоминания на каждую задачу. Задачи всех
+# пользователей пачки читаются одним запросом, упорядоченным по пользователю.
+
+
+def due_users_query(now):  # пользователи, которым пора отправить сегодняшний дайджест
+    return sqlalchemy.select(UserModel.tg_id).where(
+        UserModel.digest_time <= now.time(),
+        sqlalchemy.or_(UserModel.digest_sent_on.is_(None), UserModel.digest_sent_on < now.date()),
+    )
+
+
+def digest_rows_query(user_ids, today):  # задачи на завтра и просроченные, сгруппированные по пользователю
+    return (
+        sqlalchemy.select(TaskModel.user_id, TaskModel.title, TaskModel.due_date, TagModel.title)
+        .outerjoin(TagModel, TagModel.id == TaskModel.tag_id)
+        .where(
+            TaskModel.user_id.in_(user_ids),
+            TaskModel.is_done == False,
+            sqlalchemy.or_(TaskModel.due_date == today + timedelta(days=1), TaskModel.due_date < today),
+        )
+        .order_by(TaskModel.user_id, TaskModel.due_date, TaskModel.id)
+    )
+
+
+def task_line(title, due_date, tag_title, overdue):
+    line = f"• {title}"
+    if tag_title:
+        line += f" #{tag_title}"
+    if overdue:
+        line += f" (дедлайн {due_date.strftime('%d-%m-%Y')})"
+    return line
+
+
+def render_digest(rows, today):  # rows: (title, due_date, tag_title) одного пользователя
+    tomorrow = [row for row in rows if row[1] > today]
+    overdue = [row for row in rows if row[1] < today]
+    parts = list()
+    shown = 0
+    for header, group, is_overdue in (("Завтра", tomorrow, False), ("Просрочено", overdue, True)):
+        if not group:
+            continue
+        visible = group[:max(DIGEST_MAX_TASKS - shown, 0)]
+        shown += len(visible)
+        lines = [task_line(*row, is_overdue) for row in visible]
+        if len(group) > len(visible):
+            lines.append(f"... и еще {len(group) - len(visible)}")
+        parts.append(f"{header} ({len(group)}):\n" + "\n".join(lines))
+    return f"Дайджест на {(today + timedelta(days=1)).strftime('%d-%m-%Y')}\n\n" + "\n\n".join(parts) + \
+        "\n\nПерейдите в /edit_task, чтобы отметить выполненные"
+
+
+async def send_digests(now=None):  # ставит дайджесты в outbox, возвращает число пользователей
+    now = now or datetime.now()
+    today = now.date()
+    async with new_session() as session:
+        user_ids = (await session.execute(due_users_query(now))).scalars().all()
+    for start in range(0, len(user_ids), DIGEST_USERS_BATCH):
+        batch = user_ids[start:start + DIGEST_USERS_BATCH]
+        async with new_session() as session:
+            rows = (await session.execute(digest_rows_query(batch, today))).all()
+        messages = [
+            (f"digest:{user_id}:{today:%Y%m%d}", user_id,
+             render_digest([row[1:] for row in user_rows], today))
+            for user_id, user_rows in groupby(rows, key=lambda row: row[0])
+        ]
+
+        async def work(session, messages=messages, batch=batch):
+            await outbox.enqueue(session, messages)
+            await session.execute(
+                sqlalchemy.update(UserModel).where(UserModel.tg_id.in_(batch)).values(digest_sent_on=today)
+            )
+        await writer.submit(work)
+    if user_ids:
+        outbox.notify()
+    return len(user_ids)
+
+
+async def set_digest_time(user_id, digest_time):
+    # digest_time None отключает дайджест; возвращает дату первого дайджеста, None - пользователя нет в users
+    now = datetime.now()
+    # время уже прошло - первый дайджест завтра, чтобы не прислать его сразу после настройки
+    sent_on = now.date() if digest_time is not None and digest_time <= now.time() else None
+    updated = await writer.execute(
+        sqlalchemy.update(UserModel)
+        .where(UserModel.tg_id == user_id)
+        .values(digest_time=digest_time, digest_sent_on=sent_on)
+    )
+    if not updated:
+        return None
+    return now.date() + timedelta(days=1) if sent_on else now.date()
+
+
+class DigestScheduler(PeriodicJob):  # проверка в начале каждой минуты
+    async def tick(self):
+        count = await send_digests()
+        if count:
+            print(f"Дайджест: {count} пользователей")
+
+    def delay(self):
+        now = datetime.now()
+        next_minute = (now + timedelta(minutes=1)).replace(second=0, microsecond=0)
+        return (next_minute - now).total_seconds()
+
+
+digests = DigestScheduler()
+
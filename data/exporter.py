@@ -0,0 +1,107 @@
+import csv
+from datetime import datetime, timedelta, timezone
+
+from data.database import new_session
+from data.settings import EXPORT_CHUNK
+from data.tasks import task_rows_query, TaskRow
+
+# Выгрузка задач в CSV и iCalendar. Строки читаются курсором пачками по EXPORT_CHUNK
+# и сразу пишутся в файл - память не зависит от числа задач.
+
+CSV_HEADER = ["название", "тег", "дедлайн", "напоминание", "выполнена"]  # порядок колонок понимает /import
+
+
+async def stream_rows(user_id, is_done, tag_id=None, session_maker=new_session):
+    query = task_rows_query(user_id, is_done, tag_id).execution_options(yield_per=EXPORT_CHUNK)
+    async with session_maker() as session:
+        result = await session.stream(query)
+        async for partition in result.partitions():
+            for row in partition:
+                yield TaskRow._make(row)
+
+
+async def write_csv(stream, rows):
+    writer = csv.writer(stream)
+    writer.writerow(CSV_HEADER)
+    count = 0
+    async for row in rows:
+        writer.writerow([
+            row.title,
+            row.tag_title or "",
+            row.due_date.strftime("%d-%m-%Y"),
+            row.notify_time.strftime("%d-%m-%Y %H:%M"),
+            "да" if row.is_done else "нет",
+        ])
+        count += 1
+    return count
+
+
+def ics_text(value):  # экранирование TEXT по RFC 5545
+    return (value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+
+def ics_line(line):  # строки длиннее 75 октетов переносятся с пробелом в начале продолжения
+    encoded = line.encode()
+    if len(encoded) <= 75:
+        return line + "\r\n"
+    parts = list()
+    limit = 75
+    while encoded:
+        cut = min(limit, len(encoded))
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:  # не разрывать символ UTF-8
+            cut -= 1
+        parts.append(encoded[:cut].decode())
+        encoded = encoded[cut:]
+        limit = 74
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def ics_event(row: TaskRow, stamp):
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:task-{row.id}@taskbot",
+        f"DTSTAMP:{stamp}",
+        f"DTSTART;VALUE=DATE:{row.due_date:%Y%m%d}",
+        f"DTEND;VALUE=DATE:{row.due_date + timedelta(days=1):%Y%m%d}",
+        f"SUMMARY:{ics_text(('✓ ' if row.is_done else '') + row.title)}",
+    ]
+    if row.tag_title:
+        lines.append(f"CATEGORIES:{ics_text(row.tag_title)}")
+    if not row.is_done:
+        # notify_time хранится в локальном времени сервера, в календаре - абсолютный момент в UTC
+        alarm = row.notify_time.astimezone(timezone.utc)
+        lines += [
+            "BEGIN:VALARM",
+            "ACTION:DISPLAY",
+            f"DESCRIPTION:{ics_text(row.title)}",
+            f"TRIGGER;VALUE=DATE-TIME:{alarm:%Y%m%dT%H%M%SZ}",
+            "END:VALARM",
+        ]
+    lines.append("END:VEVENT")
+    return "".join(ics_line(line) for line in lines)
+
+
+async def write_ics(stream, rows):
+    stamp = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}"
+    stream.write("BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//TaskBot//RU\r\nCALSCALE:GREGORIAN\r\n")
+    count = 0
+    async for row in rows:
+        stream.write(ics_event(row, stamp))
+        count += 1
+    stream.write("END:VCALENDAR\r\n")
+    return count
+
+
+EXPORT_FORMATS = {  # формат -> (функция записи, расширение файла)
+    "csv": (write_csv, "csv"),
+    "ics": (write_ics, "ics"),
+}
+
+
+async def export_tasks(path, fmt, user_id, is_done, tag_id=None, session_maker=new_session):
+    # записывает задачи в файл path, возвращает их количество
+    write, _ = EXPORT_FORMATS[fmt]
+    encoding = "utf-8-sig" if fmt == "csv" else "utf-8"  # BOM нужен Excel, календарям - нет
+    with open(path, "w", encoding=encoding, newline="") as stream:
+        return await write(stream, stream_rows(user_id, is_done, tag_id, session_maker))
@@ -0,0 +1,85 @@
+import asyncio
+from time import monotonic
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from data.settings import (
+    REMINDER_CONCURRENCY, REMINDER_GLOBAL_RATE, REMINDER_CHAT_INTERVAL, REMINDER_MAX_RETRIES
+)
+
+
+class RateLimiter:  # token bucket с общей паузой на время flood-wait
+    def __init__(self, rate):
+        self.rate = rate
+        self._tokens = rate
+        self._updated = monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class FanOut:  # параллельная рассылка с учетом общего лимита и лимита на чат
+    def __init__(self, concurrency=REMINDER_CONCURRENCY, rate=REMINDER_GLOBAL_RATE,
+                 chat_interval=REMINDER_CHAT_INTERVAL, max_retries=REMINDER_MAX_RETRIES):
+        self.limiter = RateLimiter(rate)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+
+    async def send_all(self, bot: Bot, messages):
+        # messages: список (ключ, chat_id, текст); возвращает ключи отправленных и {ключ: ошибка} неотправленных
+        chats = dict()
+        for key, chat_id, text in messages:
+            chats.setdefault(chat_id, list()).append((key, text))
+        results = await asyncio.gather(
+            *[self._send_chat(bot, chat_id, items) for chat_id, items in chats.items()]
+        )
+        sent = list()
+        failed = dict()
+        for chat_results in results:
+            for key, error in chat_results:
+                if error is None:
+                    sent.append(key)
+                else:
+                    failed[key] = error
+        return sent, failed
+
+    async def _send_chat(self, bot, chat_id, items):
+        results = list()
+        async with self.semaphore:
+            for number, (key, text) in enumerate(items):
+                if number:
+                    await asyncio.sleep(self.chat_interval)
+                results.append((key, await self._send(bot, chat_id, text)))
+        return results
+
+    async def _send(self, bot, chat_id, text):  # None при успехе, иначе последняя ошибка
+        error = None
+        for _ in range(self.max_retries + 1):
+            await self.limiter.acquire()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+                return None
+            except TelegramRetryAfter as retry:
+                self.limiter.pause(retry.retry_after)
+                error = retry
+            except Exception as failure:
+                return failure
+        return error
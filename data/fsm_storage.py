@@ -0,0 +1,78 @@
+import json
+from datetime import datetime, timedelta
+from time import monotonic
+
+import sqlalchemy
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StorageKey
+from sqlalchemy.dialects.sqlite import insert
+
+from data.database import engine as default_engine, writer as default_writer
+from data.models import FSMStateModel
+from data.settings import FSM_TTL, FSM_PURGE_INTERVAL
+from data.unit_of_work import current_session
+
+
+class SQLiteStorage(BaseStorage):  # состояния FSM в файле SQLite с TTL для брошенных диалогов
+    def __init__(self, engine=default_engine, writer=default_writer, ttl=FSM_TTL,
+                 purge_interval=FSM_PURGE_INTERVAL):
+        self.engine = engine
+        self.writer = writer
+        self.ttl = timedelta(seconds=ttl)
+        self.purge_interval = purge_interval
+        self.key_builder = DefaultKeyBuilder(with_destiny=True)
+        self._next_purge = monotonic() + purge_interval
+
+    async def _upsert(self, key, empty=False, **values):
+        now = datetime.now()
+        expires_at = now + self.ttl
+        row_key = self.key_builder.build(key)
+        statement = insert(FSMStateModel).values(key=row_key, expires_at=expires_at, **values)
+        statement = statement.on_conflict_do_update(
+            index_elements=[FSMStateModel.key],
+            set_=dict(expires_at=expires_at, **values),
+        )
+
+        async def work(session):
+            await session.execute(statement)
+            if empty:  # пустой диалог не храним
+                await session.execute(sqlalchemy.delete(FSMStateModel).where(
+                    FSMStateModel.key == row_key,
+                    FSMStateModel.state.is_(None),
+                    FSMStateModel.data == "{}",
+                ))
+            if monotonic() >= self._next_purge:
+                self._next_purge = monotonic() + self.purge_interval
+                await session.execute(sqlalchemy.delete(FSMStateModel).where(
+                    FSMStateModel.expires_at <= now,
+                ))
+
+        await self.writer.submit(work)
+
+    async def _get(self, key, column):
+        query = sqlalchemy.select(column).where(
+            FSMStateModel.key == self.key_builder.build(key),
+            FSMStateModel.expires_at > datetime.now(),
+        )
+        session = current_session.get()
+        if session is not None:  # из обработчика - через сессию обновления, без второго соединения
+            return (await session.execute(query)).scalar()
+        async with self.engine.connect() as conn:
+            return (await conn.execute(query)).scalar()
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        state = state.state if isinstance(state, State) else state
+        await self._upsert(key, empty=state is None, state=state)
+
+    async def get_state(self, key: StorageKey):
+        return await self._get(key, FSMStateModel.state)
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        await self._upsert(key, empty=not data, data=json.dumps(data, ensure_ascii=False))
+
+    async def get_data(self, key: StorageKey):
+        data = await self._get(key, FSMStateModel.data)
+        return json.loads(data) if data else dict()
+
+    async def close(self) -> None:
+        pass
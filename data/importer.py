@@ -0,0 +1,138 @@
+import csv
+import itertools
+
+from sqlalchemy import insert
+
+from data.database import writer
+from data.models import TaskModel
+from data.reminders import reminders
+from data.settings import IMPORT_BATCH_SIZE, IMPORT_MAX_LINES, IMPORT_MAX_ERRORS
+from data.stats import count_tasks
+from data.tasks import parse_due_date, default_notify_time
+
+# Импорт задач из файла. Строка текстового файла: "название #тег ДД-ММ-ГГГГ" (тег необязателен).
+# CSV: "название #тег";"ДД-ММ-ГГГГ" или название;тег;дата. Файл читается построчно, задачи
+# вставляются пачками по IMPORT_BATCH_SIZE - память не зависит от размера файла.
+
+TITLE_LENGTH = TaskModel.title.type.length
+
+
+class ImportResult:
+    def __init__(self):
+        self.accepted = 0
+        self.rejected = 0
+        self.errors = list()  # первые IMPORT_MAX_ERRORS ошибок (номер строки, текст)
+        self.truncated = False  # строки после IMPORT_MAX_LINES не читались
+
+    def reject(self, line_number, error):
+        self.rejected += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append((line_number, error))
+
+    def summary(self):
+        text = f"Импорт завершен.\nДобавлено задач: {self.accepted}\nОтклонено строк: {self.rejected}"
+        if self.truncated:
+            text += f"\nФайл обрезан: обработаны первые {IMPORT_MAX_LINES} строк"
+        if self.errors:
+            text += "\n\n" + "\n".join(f"Строка {number}: {error}" for number, error in self.errors)
+            if self.rejected > len(self.errors):
+                text += f"\n... и еще {self.rejected - len(self.errors)}"
+        return text
+
+
+def split_title_tag(text):  # как в диалоге /add_task: тег - всё после последнего #
+    if "#" in text:
+        title, tag = text.rsplit("#", 1)
+        return title.strip(), tag.strip() or None
+    return text.strip(), None
+
+
+def read_text(stream):  # (номер строки, название, тег, дата) из текстового файла
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        parts = line.rsplit(None, 1)
+        if len(parts) < 2:
+            yield number, line, None, ""
+            continue
+        title, tag = split_title_tag(parts[0])
+        yield number, title, tag, parts[1]
+
+
+def read_csv(stream):  # (номер строки, название, тег, дата) из CSV; разделитель определяется по началу файла
+    sample = stream.read(4096)
+    stream.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(stream, dialect)
+    for row in reader:
+        fields = [field.strip() for field in row]
+        if not any(fields):
+            continue
+        if reader.line_num == 1 and not any(char.isdigit() for char in fields[-1]):
+            continue  # строка заголовков
+        if len(fields) == 2:
+            title, tag = split_title_tag(fields[0])
+            yield reader.line_num, title, tag, fields[1]
+        elif len(fields) >= 3:
+            yield reader.line_num, fields[0], fields[1].lstrip("#") or None, fields[2]
+        else:
+            yield reader.line_num, fields[0], None, ""
+
+
+def validate(line, tags, result):  # строка файла -> параметры вставки или None с записью ошибки
+    number, title, tag, due_text = line
+    if not title:
+        result.reject(number, "Пустое название задачи")
+        return None
+    if len(title) > TITLE_LENGTH:
+        result.reject(number, f"Название длиннее {TITLE_LENGTH} символов")
+        return None
+    due_date, error = parse_due_date(due_text)
+    if error:
+        result.reject(number, error)
+        return None
+    tag_id = None
+    if tag:
+        tag_id = tags.get(tag)
+        if tag_id is None:
+            result.reject(number, f"Тег #{tag} не найден")
+            return None
+    return {"title": title, "tag_id": tag_id, "due_date": due_date, "notify_time": default_notify_time(due_date)}
+
+
+async def insert_batch(user_id, batch):  # один executemany в транзакции писателя, id нужны для напоминаний
+    for values in batch:
+        values["user_id"] = user_id
+
+    async def work(session):
+        result = await session.execute(insert(TaskModel).returning(TaskModel.id, TaskModel.notify_time), batch)
+        await count_tasks(session, [(user_id, values["tag_id"] or 0, values["due_date"], False, 1)
+                                    for values in batch])
+        return result.all()
+    for task_id, notify_time in await writer.submit(work):
+        reminders.schedule(task_id, notify_time)
+
+
+async def import_tasks(stream, user_id, tags, is_csv=False, batch_size=IMPORT_BATCH_SIZE):
+    # stream - текстовый файл, tags - {название: id} тегов пользователя (один запрос через кэш тегов)
+    result = ImportResult()
+    lines = read_csv(stream) if is_csv else read_text(stream)
+    batch = list()
+    for line in itertools.islice(lines, IMPORT_MAX_LINES):
+        values = validate(line, tags, result)
+        if values is None:
+            continue
+        batch.append(values)
+        if len(batch) >= batch_size:
+            await insert_batch(user_id, batch)
+            result.accepted += len(batch)
+            batch = list()
+    if batch:
+        await insert_batch(user_id, batch)
+        result.accepted += len(batch)
+    result.truncated = next(lines, None) is not None
+    return result
@@ -0,0 +1,95 @@
+import asyncio
+import os
+import socket
+from datetime import datetime, timedelta
+from time import monotonic
+
+import sqlalchemy
+from sqlalchemy.dialects.sqlite import insert
+
+from data.database import writer
+from data.models import LeaseModel
+from data.settings import LEASE_TTL, LEASE_RENEW
+
+# Аренда роли через строку в таблице leases: роль у того, кто последним продлил её до истечения.
+# Захват и продление - один UPSERT, который меняет строку, только если она наша или просрочена,
+# поэтому двух владельцев одновременно быть не может. Упавший владелец перестает продлевать,
+# и через LEASE_TTL роль забирает другой процесс.
+
+
+class Lease:
+    def __init__(self, name, ttl=LEASE_TTL, renew=LEASE_RENEW, holder=None):
+        self.name = name
+        self.ttl = timedelta(seconds=ttl)
+        self.renew = renew  # должен быть заметно меньше ttl: пропуск продления не должен терять роль
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}"
+        self.held = False
+        self._on_acquire = None
+        self._on_release = None
+        self._runner = None
+        self._attempt = None  # незавершенная попытка захвата: её запись у писателя не отменяется
+        self._attempt_started = 0.0
+
+    async def try_acquire(self):  # захват или продление; True - роль наша ещё на ttl
+        now = datetime.now()
+        values = {"holder": self.holder, "expires_at": now + self.ttl}
+        statement = insert(LeaseModel).values(name=self.name, **values).on_conflict_do_update(
+            index_elements=[LeaseModel.name],
+            set_=values,
+            where=sqlalchemy.or_(LeaseModel.holder == self.holder, LeaseModel.expires_at < now),
+        )
+        return await writer.execute(statement) == 1
+
+    async def release(self):  # при штатной остановке роль освобождается сразу, без ожидания ttl
+        await writer.execute(
+            sqlalchemy.delete(LeaseModel).where(LeaseModel.name == self.name, LeaseModel.holder == self.holder)
+        )
+
+    def start(self, on_acquire, on_release):  # on_acquire/on_release - корутины, запускающие и останавливающие роль
+        self._on_acquire = on_acquire
+        self._on_release = on_release
+        self._runner = asyncio.create_task(self.run())
+        return self._runner
+
+    async def _set_held(self, held):
+        if held == self.held:
+            return
+        self.held = held
+        print(f"Аренда {self.name}: {'получена' if held else 'потеряна'} ({self.holder})")
+        try:
+            await (self._on_acquire if held else self._on_release)()
+        except Exception as error:
+            print(error)
+
+    async def _renew(self):
+        # продление, не уложившееся в период, считается неудачным: роль отдается до истечения ttl.
+        # Ожидание ограничено, но сама запись не отменяется (shield) - отмена вызывающего writer.submit
+        # оставила бы писателю результат, который некому отдать
+        if self._attempt is None or self._attempt.done():
+            self._attempt = asyncio.create_task(self.try_acquire())
+            self._attempt_started = monotonic()
+        try:
+            held = await asyncio.wait_for(asyncio.shield(self._attempt), self.renew)
+        except asyncio.TimeoutError:
+            print(f"Аренда {self.name}: продление не уложилось в {self.renew} c")
+            return False
+        # запись, сделанная слишком поздно, истечет раньше следующего продления
+        return held and monotonic() - self._attempt_started < self.ttl.total_seconds() - self.renew
+
+    async def run(self):
+        while True:
+            try:
+                held = await self._renew()
+            except Exception as error:
+                print(f"Аренда {self.name}: {error!r}")
+                held = False
+            await self._set_held(held)
+            await asyncio.sleep(self.renew)
+
+    async def stop(self):
+        if self._runner is not None:
+            self._runner.cancel()
+            self._runner = None
+        if self.held:
+            await self._set_held(False)
+            await self.release()
@@ -0,0 +1,234 @@
+import contextvars
+from datetime import datetime
+from time import perf_counter
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiohttp import web
+from sqlalchemy import event
+
+from data.settings import METRICS_ENABLED, METRICS_HOST, METRICS_PORT
+
+# Метрики в формате Prometheus. При METRICS_ENABLED=0 middleware и обработчики событий
+# SQLAlchemy не подключаются, а функции observe_* сразу возвращаются.
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def label_text(key):
+    if not key:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in key) + "}"
+
+
+class Counter:
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.values = dict()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for key, value in self.values.items():
+            lines.append(f"{self.name}{label_text(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, description, buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.values = dict()  # ключ меток -> [счетчики по корзинам, сумма, количество]
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for number, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][number] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                lines.append(f"{self.name}_bucket{label_text(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{label_text(key + (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.name}_sum{label_text(key)} {total}")
+            lines.append(f"{self.name}_count{label_text(key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = list()
+
+    def counter(self, name, description):
+        self.metrics.append(Counter(name, description))
+        return self.metrics[-1]
+
+    def histogram(self, name, description, buckets=BUCKETS):
+        self.metrics.append(Histogram(name, description, buckets))
+        return self.metrics[-1]
+
+    def render(self):
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+handler_seconds = registry.histogram("taskbot_handler_seconds", "Время обработчика по обработчику и состоянию FSM")
+handler_errors = registry.counter("taskbot_handler_errors_total", "Исключения в обработчиках")
+db_queries = registry.counter("taskbot_db_queries_total", "Запросы к БД")
+db_query_seconds = registry.histogram("taskbot_db_query_seconds", "Время одного запроса к БД")
+update_queries = registry.histogram("taskbot_update_db_queries", "Запросов к БД на одно обновление",
+                                    (0, 1, 2, 3, 5, 8, 13, 21, 50, 100))
+update_db_seconds = registry.histogram("taskbot_update_db_seconds", "Время в БД на одно обновление")
+update_session_seconds = registry.histogram("taskbot_update_session_seconds",
+                                            "Время от первого запроса сессии обновления до её закрытия")
+update_session_statements = registry.histogram("taskbot_update_session_statements",
+                                               "Запросов через сессию обновления", (0, 1, 2, 3, 5, 8, 13, 21, 50))
+reminder_lag = registry.histogram("taskbot_reminder_lag_seconds", "Задержка между notify_time и постановкой в outbox",
+                                  (0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600))
+reminders_sent = registry.counter("taskbot_reminders_sent_total", "Напоминания, поставленные в outbox")
+throttled_updates = registry.counter("taskbot_throttled_updates_total",
+                                    "Отброшенные обновления по причине: duplicate, coalesced, messages, callbacks")
+reminder_run_size = registry.histogram("taskbot_reminder_run_size", "Напоминаний за один запуск рассылки",
+                                       (1, 10, 100, 1000, 10000))
+reminder_run_seconds = registry.histogram("taskbot_reminder_run_seconds", "Длительность запуска рассылки")
+outbox_messages = registry.counter("taskbot_outbox_messages_total",
+                                   "Сообщения outbox по исходу: enqueued, sent, retry, dead")
+outbox_delivery_seconds = registry.histogram("taskbot_outbox_delivery_seconds",
+                                             "Время от постановки в outbox до отправки",
+                                             (0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600))
+outbox_batch_seconds = registry.histogram("taskbot_outbox_batch_seconds", "Длительность одного прохода отправителя")
+
+
+class UpdateUsage:  # счетчики БД текущего обновления
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+current_update = contextvars.ContextVar("current_update", default=None)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        labels = {
+            "handler": handler_object.callback.__name__ if handler_object else "-",
+            "state": data.get("raw_state") or "-",
+        }
+        usage = UpdateUsage()
+        token = current_update.set(usage)
+        started = perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(**labels)
+            raise
+        finally:
+            handler_seconds.observe(perf_counter() - started, **labels)
+            update_queries.observe(usage.queries, handler=labels["handler"])
+            update_db_seconds.observe(usage.seconds, handler=labels["handler"])
+            current_update.reset(token)
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        # время начала - на контексте выполнения: он живет один запрос, и упавший запрос
+        # не оставляет записей в conn.info
+        context.query_started = perf_counter()
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = perf_counter() - context.query_started
+        db_queries.inc()
+        db_query_seconds.observe(elapsed)
+        usage = current_update.get()
+        if usage is not None:
+            usage.queries += 1
+            usage.seconds += elapsed
+
+
+def setup_metrics(dp: Dispatcher, *engines):
+    if not METRICS_ENABLED:
+        return
+    for observer in (dp.message, dp.callback_query):
+        observer.middleware(HandlerMetricsMiddleware())
+    for engine in set(engines):
+        instrument_engine(engine)
+
+
+def observe_reminder_batch(notify_times):  # задержка отправленных напоминаний относительно notify_time
+    if not METRICS_ENABLED:
+        return
+    now = datetime.now()
+    for notify_time in notify_times:
+        reminder_lag.observe(max((now - notify_time).total_seconds(), 0))
+    reminders_sent.inc(len(notify_times))
+
+
+def observe_reminder_run(started, count):  # итог одного запуска рассылки
+    if not METRICS_ENABLED:
+        return
+    reminder_run_size.observe(count)
+    reminder_run_seconds.observe(perf_counter() - started)
+
+
+def observe_update_session(handler, seconds, statements):  # seconds - None, если соединение не понадобилось
+    if not METRICS_ENABLED:
+        return
+    update_session_statements.observe(statements, handler=handler)
+    if seconds is not None:
+        update_session_seconds.observe(seconds, handler=handler)
+
+
+def observe_throttled(reason):
+    if not METRICS_ENABLED:
+        return
+    throttled_updates.inc(reason=reason)
+
+
+def observe_outbox(outcome, count=1):  # outcome: enqueued, sent, retry или dead
+    if not METRICS_ENABLED or not count:
+        return
+    outbox_messages.inc(count, outcome=outcome)
+
+
+def observe_outbox_batch(started, created_times):  # проход отправителя и задержка доставленных сообщений
+    if not METRICS_ENABLED:
+        return
+    now = datetime.now()
+    for created_at in created_times:
+        outbox_delivery_seconds.observe(max((now - created_at).total_seconds(), 0))
+    outbox_batch_seconds.observe(perf_counter() - started)
+
+
+async def metrics_view(request):
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    if not METRICS_ENABLED:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_view)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
@@ -0,0 +1,126 @@
+import sqlalchemy
+from sqlalchemy.schema import CreateTable
+
+import data.models  # регистрирует таблицы в Base.metadata
+from data.archive import backfill_done_at
+from data.database import Base
+from data.search import create_search_index, FTS_TRIGGERS
+from data.stats import backfill_counters
+
+# Версионированные миграции схемы. Каждая миграция идемпотентна: на новой базе
+# таблицы создаются по текущим моделям, на существующей taskbot.db догоняются
+# недостающие таблицы, колонки и индексы. Новые миграции добавляются в конец MIGRATIONS.
+
+
+def create_tables(*names):
+    def migrate(conn):
+        for name in names:
+            Base.metadata.tables[name].create(conn, checkfirst=True)
+    return migrate
+
+
+def add_column(table, name):  # ALTER TABLE ADD COLUMN по описанию колонки в модели
+    def migrate(conn):
+        existing = {column["name"] for column in sqlalchemy.inspect(conn).get_columns(table)}
+        if name in existing:
+            return
+        column = Base.metadata.tables[table].columns[name]
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {name} {column.type.compile(conn.dialect)}")
+    return migrate
+
+
+def create_indexes(table, *names):
+    def migrate(conn):
+        for index in Base.metadata.tables[table].indexes:
+            if index.name in names:
+                index.create(conn, checkfirst=True)
+    return migrate
+
+
+def clear_deleted_tags(conn):  # задачи удаленных тегов становятся задачами без тега, как после /delete_tag
+    for table in ("tasks", "tasks_archive"):
+        conn.exec_driver_sql(
+            f"UPDATE {table} SET tag_id = NULL WHERE tag_id IS NOT NULL AND tag_id NOT IN (SELECT id FROM tags)"
+        )
+
+
+def monotonic_task_ids(conn):
+    # tasks пересоздается с AUTOINCREMENT: без него SQLite выдает новой задаче max(id) + 1,
+    # и после удаления последней задачи id совпадал бы с архивной. Счетчик заводится выше
+    # всех id в tasks и в архиве. Триггеры поиска ссылаются на tasks и пересоздаются
+    table = Base.metadata.tables["tasks"]
+    ddl = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'tasks'").scalar()
+    if "AUTOINCREMENT" not in ddl.upper():
+        # колонки более поздних миграций добавит add_column
+        columns = ", ".join(column["name"] for column in sqlalchemy.inspect(conn).get_columns("tasks"))
+        for name in conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE '%fts%'"
+        ).scalars().all():
+            conn.exec_driver_sql(f"DROP TRIGGER {name}")
+        create = str(CreateTable(table).compile(conn)).strip()
+        conn.exec_driver_sql(create.replace("CREATE TABLE tasks ", "CREATE TABLE tasks_new ", 1))
+        conn.exec_driver_sql(f"INSERT INTO tasks_new ({columns}) SELECT {columns} FROM tasks")
+        conn.exec_driver_sql("DROP TABLE tasks")
+        conn.exec_driver_sql("ALTER TABLE tasks_new RENAME TO tasks")
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+        for trigger in FTS_TRIGGERS:
+            conn.exec_driver_sql(trigger)
+    top = conn.exec_driver_sql(
+        "SELECT max(coalesce((SELECT max(id) FROM tasks), 0), coalesce((SELECT max(id) FROM tasks_archive), 0))"
+    ).scalar()
+    conn.exec_driver_sql("DELETE FROM sqlite_sequence WHERE name = 'tasks'")
+    conn.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES ('tasks', ?)", (top,))
+
+
+MIGRATIONS = [
+    (1, "начальная схема", [create_tables("users", "tags", "tasks")]),
+    (2, "индексы горячих запросов", [
+        create_indexes("tasks", "ix_tasks_user_done_due", "ix_tasks_remind"),
+        create_indexes("tags", "ix_tags_user"),
+    ]),
+    (3, "хранилище состояний FSM", [create_tables("fsm_states")]),
+    (4, "очередь исходящих сообщений", [create_tables("outbox")]),
+    (5, "повторяющиеся задачи", [add_column("tasks", "repeat")]),
+    (6, "ежедневный дайджест", [
+        add_column("users", "digest_time"),
+        add_column("users", "digest_sent_on"),
+        create_indexes("users", "ix_users_digest"),
+    ]),
+    (7, "полнотекстовый поиск", [create_search_index]),
+    (8, "аренда ведущего процесса", [create_tables("leases")]),
+    (9, "архив завершенных задач", [
+        add_column("tasks", "done_at"),
+        backfill_done_at,
+        create_indexes("tasks", "ix_tasks_done_at"),
+        create_tables("tasks_archive"),
+    ]),
+    (10, "счетчики /stats", [
+        clear_deleted_tags,
+        create_tables("task_counters"),
+        create_indexes("task_counters", "ix_task_counters_as_of"),
+        backfill_counters,
+    ]),
+    (11, "id задач без повторного использования", [monotonic_task_ids]),
+    (12, "свое время напоминания", [
+        add_column("tasks", "custom_remind"),
+        add_column("tasks_archive", "custom_remind"),
+    ]),
+]
+
+
+def current_version(conn):
+    conn.exec_driver_sql("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    version = conn.exec_driver_sql("SELECT MAX(version) FROM schema_version").scalar()
+    return version or 0
+
+
+def upgrade(conn):  # синхронная часть, вызывается через conn.run_sync
+    version = current_version(conn)
+    for number, description, steps in MIGRATIONS:
+        if number <= version:
+            continue
+        for step in steps:
+            step(conn)
+        conn.exec_driver_sql("INSERT INTO schema_version (version) VALUES (?)", (number,))
+        print(f"Миграция {number}: {description}")
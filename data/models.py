@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Date, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, Date, DateTime, Time, Boolean, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from data.database import Base
@@ -6,10 +6,15 @@ from data.database import Base
 
 class UserModel(Base):  # модель пользователя
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_digest", "digest_time"),  # пользователи, которым пора отправить дайджест
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     tg_id = Column(Integer, nullable=False, unique=True)
     username = Column(String(50), nullable=True)
+    digest_time = Column(Time, nullable=True)  # время ежедневного дайджеста; None - напоминания по одному
+    digest_sent_on = Column(Date, nullable=True)  # дата последнего дайджеста
 
     tasks = relationship(
         "TaskModel",
@@ -20,6 +25,13 @@ class UserModel(Base):  # модель пользователя
 
 class TaskModel(Base):  # модель задачи
     __tablename__ = "tasks"
+    __table_args__ = (
+        Index("ix_tasks_user_done_due", "user_id", "is_done", "due_date"),  # списки задач
+        Index("ix_tasks_remind", "is_done", "send_remind", "notify_time"),  # очередь напоминаний
+        Index("ix_tasks_done_at", "is_done", "done_at"),  # кандидаты в архив
+        # id не переиспользуются: иначе новая задача получила бы id задачи, уже лежащей в архиве
+        {"sqlite_autoincrement": True},
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.tg_id"), nullable=False)  # ссылка на пользователя
@@ -29,6 +41,9 @@ class TaskModel(Base):  # модель задачи
     is_done = Column(Boolean, default=False)
     notify_time = Column(DateTime, nullable=False)
     send_remind = Column(Boolean, default=False)
+    repeat = Column(String(40), nullable=True)  # правило повторения, только у последнего экземпляра серии
+    done_at = Column(DateTime, nullable=True)  # время завершения, по нему задача уходит в архив
+    custom_remind = Column(Boolean, default=False)  # время напоминания задано через "Напомнить"
 
     tag = relationship(
         "TagModel",
@@ -40,8 +55,30 @@ class TaskModel(Base):  # модель задачи
     )  # связь многие к одному
 
 
+class ArchivedTaskModel(Base):  # завершенная задача, перенесенная из tasks; id сохраняется
+    __tablename__ = "tasks_archive"
+    __table_args__ = (
+        Index("ix_tasks_archive_user_due", "user_id", "due_date"),  # "Завершенные" вместе с tasks
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, ForeignKey("users.tg_id"), nullable=False)
+    title = Column(String(50), nullable=False)
+    tag_id = Column(Integer, ForeignKey("tags.id"), nullable=True)
+    due_date = Column(Date, nullable=True)
+    is_done = Column(Boolean, default=True)
+    notify_time = Column(DateTime, nullable=False)
+    send_remind = Column(Boolean, default=False)
+    repeat = Column(String(40), nullable=True)
+    done_at = Column(DateTime, nullable=True)
+    custom_remind = Column(Boolean, default=False)
+
+
 class TagModel(Base):  # модель тега
     __tablename__ = "tags"
+    __table_args__ = (
+        Index("ix_tags_user", "user_id"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.tg_id"), nullable=False)
@@ -51,3 +88,55 @@ class TagModel(Base):  # модель тега
         "TaskModel",
         back_populates="tag"
     )  # связь один ко многим
+
+
+class FSMStateModel(Base):  # состояние незавершенного диалога пользователя
+    __tablename__ = "fsm_states"
+    __table_args__ = (
+        Index("ix_fsm_states_expires", "expires_at"),
+    )
+
+    key = Column(String(100), primary_key=True)
+    state = Column(String(50), nullable=True)
+    data = Column(Text, nullable=False, default="{}")  # JSON только из примитивов: id, номера, строки
+    expires_at = Column(DateTime, nullable=False)
+
+
+class OutboxModel(Base):  # исходящее сообщение: переживает перезапуск, повторяется с отсрочкой
+    __tablename__ = "outbox"
+    __table_args__ = (
+        Index("ix_outbox_due", "status", "next_attempt_at"),  # выборка сообщений к отправке
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    key = Column(String(100), nullable=False, unique=True)  # ключ идемпотентности, повторная постановка игнорируется
+    chat_id = Column(Integer, nullable=False)
+    text = Column(Text, nullable=False)
+    status = Column(String(10), nullable=False, default="pending")  # pending, sent или dead
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    sent_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+
+
+class TaskCounterModel(Base):  # счетчики задач пользователя по тегу для /stats, поддерживаются при записи
+    __tablename__ = "task_counters"
+    __table_args__ = (
+        Index("ix_task_counters_as_of", "as_of"),  # строки, которым нужен ежедневный сдвиг
+    )
+
+    user_id = Column(Integer, ForeignKey("users.tg_id"), primary_key=True)
+    tag_id = Column(Integer, primary_key=True)  # 0 - задачи без тега
+    active = Column(Integer, nullable=False, default=0)
+    done = Column(Integer, nullable=False, default=0)  # включая архив
+    overdue = Column(Integer, nullable=False, default=0)  # активные с дедлайном раньше as_of
+    as_of = Column(Date, nullable=False)  # день, по который учтены просроченные
+
+
+class LeaseModel(Base):  # аренда роли в кластере: кто держит, до какого времени
+    __tablename__ = "leases"
+
+    name = Column(String(50), primary_key=True)
+    holder = Column(String(100), nullable=False)  # "хост:pid" процесса-владельца
+    expires_at = Column(DateTime, nullable=False)
@@ -0,0 +1,213 @@
+import asyncio
+from datetime import datetime, timedelta
+from time import perf_counter
+
+import sqlalchemy
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from sqlalchemy.dialects.sqlite import insert
+
+from data.database import new_session, writer
+from data.fanout import FanOut
+from data.metrics import observe_outbox, observe_outbox_batch
+from data.models import OutboxModel
+from data.settings import (
+    OUTBOX_BATCH_SIZE, OUTBOX_MAX_ATTEMPTS, OUTBOX_BACKOFF, OUTBOX_BACKOFF_MAX, OUTBOX_POLL_INTERVAL, OUTBOX_RETENTION
+)
+
+# Очередь исходящих сообщений в БД. Производители (напоминания, дайджесты) ставят сообщения
+# в своей транзакции, отправитель вычитывает их пачками. Доставка "хотя бы один раз": при падении
+# между отправкой и отметкой sent повторно уходит только эта пачка. За проход в один чат уходит
+# не больше одного сообщения, остальные откладываются на REMINDER_CHAT_INTERVAL за каждое
+# предыдущее: чат с сотней напоминаний не задерживает пачку для остальных.
+
+PENDING = "pending"
+SENT = "sent"
+DEAD = "dead"
+
+PERMANENT_ERRORS = (TelegramForbiddenError, TelegramBadRequest)  # бот заблокирован, чат не найден
+
+
+# отложенное из-за интервала чата сообщение только сдвигается вперед: attempts, last_error и уже
+# назначенная более поздняя отсрочка не меняются
+DEFER_STATEMENT = (
+    sqlalchemy.update(OutboxModel)
+    .where(OutboxModel.id == sqlalchemy.bindparam("message_id"),
+           OutboxModel.next_attempt_at < sqlalchemy.bindparam("ready"))
+    .values(next_attempt_at=sqlalchemy.bindparam("ready"))
+)
+
+
+def due_messages_query(now, limit):  # сообщения, время отправки которых наступило
+    return (
+        sqlalchemy.select(OutboxModel.id, OutboxModel.chat_id, OutboxModel.text,
+                          OutboxModel.attempts, OutboxModel.created_at, OutboxModel.next_attempt_at)
+        .where(OutboxModel.status == PENDING, OutboxModel.next_attempt_at <= now)
+        .order_by(OutboxModel.next_attempt_at, OutboxModel.id)
+        .limit(limit)
+    )
+
+
+class Outbox:
+    def __init__(self, fan_out=None, batch=OUTBOX_BATCH_SIZE, max_attempts=OUTBOX_MAX_ATTEMPTS,
+                 backoff=OUTBOX_BACKOFF, backoff_max=OUTBOX_BACKOFF_MAX, poll_interval=OUTBOX_POLL_INTERVAL,
+                 retention=OUTBOX_RETENTION):
+        self.fan_out = fan_out or FanOut()
+        self.batch = batch
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self.retention = timedelta(seconds=retention)
+        self.counters = {"enqueued": 0, "sent": 0, "retry": 0, "dead": 0}
+        self._wakeup = asyncio.Event()
+        self._runner = None
+        self._purged_at = datetime.min
+        self._chat_ready = dict()  # chat_id -> когда в чат можно отправить следующее сообщение
+
+    def _count(self, outcome, count):
+        self.counters[outcome] += count
+        observe_outbox(outcome, count)
+
+    async def enqueue(self, session, messages):
+        # messages: список (ключ идемпотентности, chat_id, текст); выполняется в транзакции производителя
+        if not messages:
+            return
+        now = datetime.now()
+        statement = insert(OutboxModel).on_conflict_do_nothing(index_elements=["key"])
+        connection = await session.connection()  # Core executemany: rowcount - число реально вставленных строк
+        result = await connection.execute(statement, [
+            {"key": key, "chat_id": chat_id, "text": text, "status": PENDING, "attempts": 0,
+             "next_attempt_at": now, "created_at": now}
+            for key, chat_id, text in messages
+        ])
+        self._count("enqueued", max(result.rowcount, 0))
+
+    def notify(self):  # вызывается после коммита производителя
+        self._wakeup.set()
+
+    def _delay(self, attempts, error):  # экспоненциальная отсрочка, не меньше flood-wait от Telegram
+        delay = min(self.backoff * 2 ** (attempts - 1), self.backoff_max)
+        if isinstance(error, TelegramRetryAfter):
+            delay = max(delay, error.retry_after)
+        return timedelta(seconds=delay)
+
+    async def send_batch(self, bot: Bot):  # одна пачка сообщений, время которых наступило; возвращает её размер
+        started = perf_counter()
+        async with new_session() as session:
+            rows = (await session.execute(due_messages_query(datetime.now(), self.batch))).all()
+        if not rows:
+            return 0
+
+        now = datetime.now()
+        interval = timedelta(seconds=self.fan_out.chat_interval)
+        floor = now - interval  # слот не раньше: иначе накопившиеся сообщения чата уходили бы чаще интервала
+        self._chat_ready = {chat_id: ready for chat_id, ready in self._chat_ready.items() if ready > floor}
+        free = dict(self._chat_ready)  # chat_id -> следующий свободный слот с учетом отложенных в этом проходе
+        ready_rows = list()
+        chats = set()  # чаты, сообщение в которые уже уходит в этом проходе
+        deferred = list()  # не считаются попыткой
+        for row in rows:
+            ready = free.get(row.chat_id, floor)
+            if ready <= now and row.chat_id not in chats:
+                ready_rows.append(row)
+                chats.add(row.chat_id)
+                # слот считается по расписанию, а не по моменту прохода: отложенное сообщение чата
+                # приходится ровно на следующий слот и не переставляется при каждом проходе
+                ready = max(ready, row.next_attempt_at, floor)
+                self._chat_ready[row.chat_id] = ready + interval
+            elif row.next_attempt_at < ready:
+                deferred.append({"message_id": row.id, "ready": ready})
+            free[row.chat_id] = ready + interval
+
+        sent, failed = await self.fan_out.send_all(bot, [(row.id, row.chat_id, row.text) for row in ready_rows])
+        now = datetime.now()
+        changes = [{"id": message_id, "status": SENT, "sent_at": now} for message_id in sent]
+        dead = 0
+        for row in ready_rows:
+            error = failed.get(row.id)
+            if error is None:
+                continue
+            attempts = row.attempts + 1
+            change = {"id": row.id, "attempts": attempts, "last_error": str(error)[:500]}
+            if isinstance(error, PERMANENT_ERRORS) or attempts >= self.max_attempts:
+                change["status"] = DEAD
+                dead += 1
+                print(f"Outbox: сообщение {row.id} в dead после {attempts} попыток: {error}")
+            else:
+                change["next_attempt_at"] = now + self._delay(attempts, error)
+            changes.append(change)
+
+        async def work(session):
+            # у строк разный набор колонок - группируем, чтобы каждый UPDATE шел одним executemany
+            groups = dict()
+            for change in changes:
+                groups.setdefault(tuple(change), list()).append(change)
+            for group in groups.values():
+                await session.execute(sqlalchemy.update(OutboxModel), group)
+            if deferred:
+                await (await session.connection()).execute(DEFER_STATEMENT, deferred)
+        await writer.submit(work)
+
+        self._count("sent", len(sent))
+        self._count("retry", len(failed) - dead)
+        self._count("dead", dead)
+        created = {row.id: row.created_at for row in rows}
+        observe_outbox_batch(started, [created[message_id] for message_id in sent])
+        return len(rows)
+
+    async def drain(self, bot: Bot):  # отправить всё, что уже пора; возвращает число обработанных сообщений
+        total = 0
+        while count := await self.send_batch(bot):
+            total += count
+        return total
+
+    async def purge(self):  # отправленные сообщения хранятся OUTBOX_RETENTION для проверки идемпотентности
+        await writer.execute(
+            sqlalchemy.delete(OutboxModel)
+            .where(OutboxModel.status == SENT, OutboxModel.sent_at < datetime.now() - self.retention)
+        )
+        self._purged_at = datetime.now()
+
+    async def _next_time(self):
+        async with new_session() as session:
+            return (await session.execute(
+                sqlalchemy.select(sqlalchemy.func.min(OutboxModel.next_attempt_at))
+                .where(OutboxModel.status == PENDING)
+            )).scalar()
+
+    def start(self, bot: Bot):  # запуск фоновой задачи, ссылка хранится, чтобы её не собрал GC
+        self._runner = asyncio.create_task(self.run(bot))
+        return self._runner
+
+    def stop(self):  # прерванная пачка будет отправлена повторно тем, кто запустит outbox следующим
+        if self._runner is not None:
+            self._runner.cancel()
+            self._runner = None
+
+    async def run(self, bot: Bot):
+        while True:
+            self._wakeup.clear()
+            try:
+                started = perf_counter()
+                count = await self.drain(bot)
+                if count:
+                    elapsed = perf_counter() - started
+                    print(f"Outbox: обработано {count} сообщений за {elapsed:.2f} c, "
+                          f"всего отправлено {self.counters['sent']}, в dead {self.counters['dead']}")
+                if datetime.now() - self._purged_at > timedelta(hours=1):
+                    await self.purge()
+                next_time = await self._next_time()
+            except Exception as error:
+                print(error)
+                next_time = None
+            timeout = self.poll_interval
+            if next_time is not None:
+                timeout = min(max((next_time - datetime.now()).total_seconds(), 0), timeout)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+outbox = Outbox()
@@ -0,0 +1,37 @@
+import abc
+import asyncio
+
+# Фоновые задачи ведущего процесса, которые работают по таймеру (архив, счетчики /stats, дайджест):
+# run вызывает tick каждые delay() секунд, ошибка шага печатается и не останавливает цикл.
+# Ссылка на задачу хранится в _runner, чтобы её не собрал GC.
+
+
+class PeriodicJob(abc.ABC):
+    interval = 60  # секунд между шагами
+
+    def __init__(self):
+        self._runner = None
+
+    @abc.abstractmethod
+    async def tick(self):
+        ...
+
+    def delay(self):  # пауза после шага
+        return self.interval
+
+    def start(self):
+        self._runner = asyncio.create_task(self.run())
+        return self._runner
+
+    def stop(self):
+        if self._runner is not None:
+            self._runner.cancel()
+            self._runner = None
+
+    async def run(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception as error:
+                print(error)
+            await asyncio.sleep(self.delay())
@@ -0,0 +1,136 @@
+import contextvars
+import heapq
+import itertools
+import random
+from collections import deque
+from datetime import datetime
+from time import perf_counter
+
+from aiogram import BaseMiddleware, Dispatcher
+from sqlalchemy import event
+
+from data.settings import (
+    PROFILER_ENABLED, PROFILER_SLOWEST, PROFILER_SLOW_MS, PROFILER_SAMPLE_RATE, PROFILER_SAMPLES
+)
+
+# Профилировщик запросов, выключен по умолчанию. Каждый запрос помечается обновлением
+# и обработчиком, из которых он выполнен; хранятся самые медленные запросы и выборка таймингов.
+
+origin = contextvars.ContextVar("query_origin", default=None)  # [update_id, имя обработчика]
+
+
+class QueryRecord:
+    __slots__ = ("seconds", "statement", "parameters", "update_id", "handler", "at")
+
+    def __init__(self, seconds, statement, parameters, update_id, handler):
+        self.seconds = seconds
+        self.statement = statement
+        self.parameters = parameters
+        self.update_id = update_id
+        self.handler = handler
+        self.at = datetime.now()
+
+
+class QueryProfiler:
+    def __init__(self, slowest=PROFILER_SLOWEST, slow_ms=PROFILER_SLOW_MS,
+                 sample_rate=PROFILER_SAMPLE_RATE, samples=PROFILER_SAMPLES):
+        self.slowest = slowest
+        self.slow_seconds = slow_ms / 1000
+        self.sample_rate = sample_rate
+        self.samples = deque(maxlen=samples)  # кольцевой буфер выборки (обработчик, секунды, SQL)
+        self.queries = 0
+        self._top = list()  # min-куча (секунды, номер, запись): в корне самый быстрый из сохраненных
+        self._numbers = itertools.count()
+
+    def record(self, seconds, statement, parameters):
+        self.queries += 1
+        update_id, handler = origin.get() or (None, "-")
+        if len(self._top) < self.slowest or seconds > self._top[0][0]:
+            entry = (seconds, next(self._numbers), QueryRecord(seconds, statement, parameters, update_id, handler))
+            if len(self._top) < self.slowest:
+                heapq.heappush(self._top, entry)
+            else:
+                heapq.heapreplace(self._top, entry)
+        if random.random() < self.sample_rate:
+            self.samples.append((handler, seconds, statement))
+        if seconds >= self.slow_seconds:
+            print(f"Медленный запрос {seconds * 1000:.1f} мс [update {update_id}, {handler}]: "
+                  f"{' '.join(statement.split())[:300]}")
+
+    def slowest_queries(self):
+        return [record for _, _, record in sorted(self._top, reverse=True)]
+
+    def reset(self):
+        self._top = list()
+        self.samples.clear()
+        self.queries = 0
+
+    async def dump(self, engine, limit=10):  # текстовый отчет, планы запросов строятся в момент выгрузки
+        lines = [f"Запросов: {self.queries}, в выборке: {len(self.samples)}"]
+        by_handler = dict()
+        for handler, seconds, _ in self.samples:
+            count, total = by_handler.get(handler, (0, 0.0))
+            by_handler[handler] = (count + 1, total + seconds)
+        for handler, (count, total) in sorted(by_handler.items(), key=lambda item: -item[1][1]):
+            lines.append(f"  {handler}: {count} запр., в среднем {total / count * 1000:.2f} мс")
+        lines.append("Самые медленные:")
+        async with engine.connect() as conn:
+            for record in self.slowest_queries()[:limit]:
+                lines.append(f"{record.seconds * 1000:.1f} мс | update {record.update_id} | {record.handler} | "
+                             f"{record.at:%H:%M:%S}")
+                lines.append(f"  {' '.join(record.statement.split())[:500]}")
+                lines.append(f"  параметры: {record.parameters!r}"[:300])
+                try:
+                    plan = await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {record.statement}", record.parameters)
+                    lines.extend(f"  план: {row[-1]}" for row in plan.all())
+                except Exception as error:
+                    lines.append(f"  план недоступен: {error}")
+        return "\n".join(lines)
+
+
+profiler = QueryProfiler()
+
+
+class UpdateOriginMiddleware(BaseMiddleware):  # внешний: запросы FSM и фильтров тоже относятся к обновлению
+    async def __call__(self, handler, event, data):
+        token = origin.set([event.update_id, "-"])
+        try:
+            return await handler(event, data)
+        finally:
+            origin.reset(token)
+
+
+class HandlerOriginMiddleware(BaseMiddleware):  # внутренний: обработчик известен после фильтров
+    async def __call__(self, handler, event, data):
+        current = origin.get()
+        if current is not None:
+            current[1] = data["handler"].callback.__name__
+        return await handler(event, data)
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine.sync_engine, "before_cursor_execute", retval=True)
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        context.profile_started = perf_counter()  # на контексте: упавший запрос ничего не оставляет
+        current = origin.get()
+        if current:  # метка обработчика видна в любом журнале SQL
+            statement = f"{statement} /* {current[1]} */"
+        return statement, parameters
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = perf_counter() - context.profile_started
+        profiler.record(elapsed, statement.rsplit(" /* ", 1)[0], parameters)
+
+
+def setup_profiler(dp: Dispatcher, *engines):
+    if not PROFILER_ENABLED:
+        return
+    # перед FSMContextMiddleware, чтобы чтение состояния тоже относилось к обновлению
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(UpdateOriginMiddleware())
+    dp.update.outer_middleware(dp.fsm)
+    for observer in (dp.message, dp.callback_query):
+        observer.middleware(HandlerOriginMiddleware())
+    for engine in set(engines):
+        instrument_engine(engine)
@@ -0,0 +1,127 @@
+import calendar
+import re
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import insert, update
+
+from data.models import TaskModel
+from data.stats import count_tasks
+
+# Повторяющиеся задачи. Правило хранится в TaskModel.repeat только у последнего экземпляра серии,
+# следующий экземпляр создается при завершении текущего или при срабатывании его напоминания,
+# и правило переходит к нему. Так в таблице одна активная строка на серию, а запросы
+# напоминаний и списков работают с сериями как с обычными задачами.
+#
+# Формат правила: daily, weekly:0,2,4 (дни недели, 0 - понедельник), monthly:D (число месяца,
+# от которого считаются все экземпляры; старое monthly без числа - по дате экземпляра), every:N.
+
+WEEKDAYS = ["пн", "вт", "ср", "чт", "пт", "сб", "вс"]
+
+
+def parse_rule(text, due_date):  # правило из ввода пользователя; None - некорректный ввод, "" - без повтора
+    text = text.strip().lower()
+    if text in ("нет", "не повторять", "-"):
+        return ""
+    if text in ("ежедневно", "каждый день"):
+        return "daily"
+    if text in ("ежемесячно", "каждый месяц"):
+        return f"monthly:{due_date.day}"
+    if text == "по будням":
+        return "weekly:0,1,2,3,4"
+    match = re.fullmatch(r"кажд(?:ые|ый) (\d+) (?:день|дня|дней)", text)  # каждые 3 дня, каждый 21 день
+    if match and 1 <= int(match.group(1)) <= 365:
+        return f"every:{int(match.group(1))}"
+    if text.startswith("еженедельно"):
+        days = re.findall(r"[а-я]+", text[len("еженедельно"):])
+        if not days:
+            return f"weekly:{due_date.weekday()}"
+        if any(day not in WEEKDAYS for day in days):
+            return None
+        return "weekly:" + ",".join(str(number) for number in sorted({WEEKDAYS.index(day) for day in days}))
+    return None
+
+
+def describe_rule(rule):
+    if rule == "daily":
+        return "ежедневно"
+    kind, _, value = rule.partition(":")
+    if kind == "monthly":
+        return "ежемесячно"
+    if kind == "every":
+        return f"каждые {value} дн."
+    if kind == "weekly":
+        return "еженедельно: " + " ".join(WEEKDAYS[int(day)] for day in value.split(","))
+    return rule
+
+
+def add_months(day, months, anchor=None):
+    # число anchor (по умолчанию число day) через months месяцев, 31-е - последний день короткого месяца
+    year, month = divmod(day.month - 1 + months, 12)
+    year, month = day.year + year, month + 1
+    return date(year, month, min(anchor or day.day, calendar.monthrange(year, month)[1]))
+
+
+def next_due(rule, due_date, today=None):  # ближайшая дата серии после due_date, не раньше сегодняшней
+    today = today or date.today()
+    kind, _, value = rule.partition(":")
+    if kind in ("daily", "every"):
+        step = int(value) if kind == "every" else 1
+        if step < 1:
+            raise ValueError(f"Некорректный шаг повторения: {rule}")
+        if due_date >= today:
+            return due_date + timedelta(days=step)
+        # пропущенные экземпляры не создаются - сразу первый, не раньше сегодняшнего дня
+        return due_date + timedelta(days=step * -(-(today - due_date).days // step))
+    if kind == "weekly":
+        days = {int(day) for day in value.split(",")}
+        candidate = max(due_date + timedelta(days=1), today)
+        while candidate.weekday() not in days:
+            candidate += timedelta(days=1)
+        return candidate
+    if kind == "monthly":
+        # число берется из правила, а не из due_date: после 28 февраля серия от 31-го возвращается к 31-му
+        anchor = int(value) if value else None
+        months = 1
+        while add_months(due_date, months, anchor) < today:
+            months += 1
+        return add_months(due_date, months, anchor)
+    raise ValueError(f"Неизвестное правило повторения: {rule}")
+
+
+def next_notify_time(next_date, notify_time, due_date):
+    # напоминание сохраняет смещение относительно дедлайна, заданное пользователем
+    return datetime.combine(next_date, notify_time.time()) + (notify_time.date() - due_date)
+
+
+async def materialise(session, tasks):
+    # tasks: объекты или строки с user_id, title, tag_id, due_date, notify_time, repeat, custom_remind и id;
+    # создает следующие экземпляры в транзакции вызывающего, возвращает [(id, notify_time, due_date)]
+    tasks = [task for task in tasks if task.repeat and task.due_date]
+    if not tasks:
+        return list()
+    values = list()
+    for task in tasks:
+        due_date = next_due(task.repeat, task.due_date)
+        values.append({
+            "user_id": task.user_id,
+            "title": task.title,
+            "tag_id": task.tag_id,
+            "due_date": due_date,
+            "notify_time": next_notify_time(due_date, task.notify_time, task.due_date),
+            "repeat": task.repeat,
+            "is_done": False,
+            "send_remind": False,
+            "custom_remind": task.custom_remind,
+        })
+    await session.execute(
+        update(TaskModel)
+        .where(TaskModel.id.in_([task.id for task in tasks]))
+        .values(repeat=None)
+    )
+    result = await session.execute(
+        insert(TaskModel).returning(TaskModel.id, TaskModel.notify_time, TaskModel.due_date), values
+    )
+    created = result.all()
+    await count_tasks(session, [(task.user_id, task.tag_id or 0, value["due_date"], False, 1)
+                                for task, value in zip(tasks, values)])
+    return created
@@ -0,0 +1,136 @@
+import asyncio
+import heapq
+from datetime import datetime, timedelta
+from time import monotonic
+
+import sqlalchemy
+
+from data.database import new_session
+from data.models import TaskModel
+from data.settings import REMINDER_RETRY_BACKOFF, REMINDER_RETRY_BACKOFF_MAX
+
+
+def pending_reminders_query():  # все неотправленные напоминания по активным задачам
+    return sqlalchemy.select(TaskModel.id, TaskModel.notify_time).where(
+        TaskModel.is_done == False,
+        TaskModel.send_remind == False,
+    )
+
+
+class ReminderQueue:  # очередь напоминаний, упорядоченная по времени срабатывания
+    def __init__(self):
+        self._heap = list()  # (notify_time, task_id)
+        self._pending = dict()  # task_id -> актуальное время напоминания
+        self._wakeup = asyncio.Event()
+        self._runner = None
+        self._refresh = None  # период перечитывания из БД, когда задачи создают и другие процессы
+        self._next_refresh = 0
+        self._failures = 0  # ошибок send подряд, задает задержку повтора
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def load(self, horizon=None):  # загрузка неотправленных напоминаний, включая пропущенные во время простоя
+        # horizon - только наступающие в ближайшие horizon секунд; очередь заменяется содержимым БД
+        query = pending_reminders_query()
+        if horizon is not None:
+            query = query.where(TaskModel.notify_time <= datetime.now() + timedelta(seconds=horizon))
+        async with new_session() as session:
+            self._pending = dict((await session.execute(query)).all())
+        self._heap = [(notify_time, task_id) for task_id, notify_time in self._pending.items()]
+        heapq.heapify(self._heap)
+        self._wakeup.set()
+
+    def schedule(self, task_id, notify_time):  # добавить или перенести напоминание
+        if self._runner is None:  # очередь не запущена (не ведущий процесс) - напоминание прочитает load()
+            return
+        self._pending[task_id] = notify_time
+        heapq.heappush(self._heap, (notify_time, task_id))
+        if len(self._heap) > 2 * len(self._pending) + 64:
+            self._compact()
+        self._wakeup.set()
+
+    def cancel(self, task_id):  # устаревшая запись в куче пропускается при извлечении
+        self._pending.pop(task_id, None)
+
+    def _compact(self):  # удаление устаревших записей из кучи
+        self._heap = [(notify_time, task_id) for task_id, notify_time in self._pending.items()]
+        heapq.heapify(self._heap)
+
+    def _is_actual(self, item):
+        notify_time, task_id = item
+        return self._pending.get(task_id) == notify_time
+
+    def _pop_due(self, now):
+        due = list()
+        while self._heap and self._heap[0][0] <= now:
+            item = heapq.heappop(self._heap)
+            if self._is_actual(item):
+                del self._pending[item[1]]
+                due.append(item[1])
+        return due
+
+    def _retry(self, task_ids):  # после ошибки send напоминания возвращаются в очередь с растущей задержкой
+        delay = min(REMINDER_RETRY_BACKOFF * 2 ** self._failures, REMINDER_RETRY_BACKOFF_MAX)
+        self._failures += 1
+        retry_at = datetime.now() + timedelta(seconds=delay)
+        for task_id in task_ids:
+            if task_id not in self._pending:  # перенесенное во время отправки уже стоит в очереди
+                self.schedule(task_id, retry_at)
+
+    def _next_time(self):
+        while self._heap and not self._is_actual(self._heap[0]):
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def start(self, send, refresh=None):  # запуск фоновой задачи, ссылка хранится, чтобы её не собрал GC
+        self._refresh = refresh
+        self._next_refresh = monotonic() + refresh if refresh else 0
+        self._runner = asyncio.create_task(self.run(send))
+        return self._runner
+
+    def stop(self):
+        if self._runner is not None:
+            self._runner.cancel()
+            self._runner = None
+        self._pending.clear()
+        self._heap.clear()
+
+    async def _refresh_due(self):
+        # в кластере задачи создают все рабочие процессы: ведущий перечитывает ближайшие напоминания,
+        # отмененные и перенесенные отсекает проверка notify_time в send_reminders
+        if self._refresh and monotonic() >= self._next_refresh:
+            self._next_refresh = monotonic() + self._refresh
+            try:
+                await self.load(horizon=2 * self._refresh)
+            except Exception as error:
+                print(error)
+
+    async def run(self, send):  # send получает список id задач, время которых наступило
+        while True:
+            self._wakeup.clear()
+            await self._refresh_due()
+            due = self._pop_due(datetime.now())
+            if due:
+                try:
+                    await send(due)
+                    self._failures = 0
+                except Exception as error:
+                    print(error)
+                    # уже отправленные повтор не задублирует: send_reminders пропускает задачи с send_remind
+                    self._retry(due)
+                continue
+            next_time = self._next_time()
+            timeout = None
+            if next_time is not None:
+                timeout = max((next_time - datetime.now()).total_seconds(), 0)
+            if self._refresh:
+                timeout = min(timeout if timeout is not None else self._refresh,
+                              max(self._next_refresh - monotonic(), 0))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+reminders = ReminderQueue()
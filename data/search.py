@@ -0,0 +1,106 @@
+import re
+
+import sqlalchemy
+
+from data.models import TaskModel, TagModel
+from data.settings import SEARCH_LIMIT
+from data.tasks import TaskRow
+
+# Полнотекстовый поиск по названиям задач и тегов. Индекс tasks_fts (FTS5) поддерживается
+# триггерами, поэтому в нем оказываются и массовые вставки (импорт, повторяющиеся задачи).
+# rowid строки индекса - id задачи, колонка owner - токен владельца "u<tg_id>": поиск
+# пересекает списки документов владельца и слов запроса, а не фильтрует совпадения всех пользователей.
+
+FTS_TABLE = """
+CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+    owner, title, tag, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+)
+"""
+
+TAG_TITLE = "coalesce((SELECT title FROM tags WHERE id = new.tag_id), '')"
+
+FTS_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN
+        INSERT INTO tasks_fts (rowid, owner, title, tag) VALUES (new.id, 'u' || new.user_id, new.title, {TAG_TITLE});
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN
+        DELETE FROM tasks_fts WHERE rowid = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF title, tag_id, user_id ON tasks BEGIN
+        UPDATE tasks_fts SET owner = 'u' || new.user_id, title = new.title, tag = {TAG_TITLE}
+        WHERE rowid = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tags_fts_update AFTER UPDATE OF title ON tags BEGIN
+        UPDATE tasks_fts SET tag = new.title WHERE rowid IN (SELECT id FROM tasks WHERE tag_id = new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tags_fts_delete AFTER DELETE ON tags BEGIN
+        UPDATE tasks_fts SET tag = '' WHERE rowid IN (SELECT id FROM tasks WHERE tag_id = old.id);
+    END
+    """,
+]
+
+FTS_BACKFILL = """
+INSERT INTO tasks_fts (rowid, owner, title, tag)
+SELECT tasks.id, 'u' || tasks.user_id, tasks.title, coalesce(tags.title, '')
+FROM tasks LEFT JOIN tags ON tags.id = tasks.tag_id
+WHERE tasks.id NOT IN (SELECT rowid FROM tasks_fts)
+"""
+
+
+def create_search_index(conn):  # шаг миграции: таблица, триггеры и заполнение по существующим задачам
+    conn.exec_driver_sql(FTS_TABLE)
+    for trigger in FTS_TRIGGERS:
+        conn.exec_driver_sql(trigger)
+    conn.exec_driver_sql(FTS_BACKFILL)
+
+
+tasks_fts = sqlalchemy.table("tasks_fts", sqlalchemy.column("rowid"), sqlalchemy.column("owner"))
+
+
+def match_expression(user_id, text):
+    # слова запроса как префиксы в кавычках: спецсимволы FTS5 из ввода пользователя не интерпретируются
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        return None
+    terms = " AND ".join(f'"{word}"*' for word in words)
+    return f"owner : u{user_id} AND {{title tag}} : ({terms})"
+
+
+def search_query(user_id, text, limit=SEARCH_LIMIT):
+    expression = match_expression(user_id, text)
+    if expression is None:
+        return None
+    return (
+        sqlalchemy.select(
+            TaskModel.id,
+            TaskModel.title,
+            TaskModel.due_date,
+            TaskModel.notify_time,
+            TaskModel.is_done,
+            TagModel.title,
+            TaskModel.repeat,
+        )
+        .select_from(tasks_fts)
+        .join(TaskModel, TaskModel.id == tasks_fts.c.rowid)
+        .outerjoin(TagModel, TagModel.id == TaskModel.tag_id)
+        .where(sqlalchemy.text("tasks_fts MATCH :expression").bindparams(expression=expression))
+        # активные выше завершенных, внутри - по релевантности; совпадение в названии весит больше тега
+        .order_by(TaskModel.is_done, sqlalchemy.text("bm25(tasks_fts, 0.0, 10.0, 4.0)"))
+        .limit(limit)
+    )
+
+
+async def search_tasks(session, user_id, text):
+    query = search_query(user_id, text)
+    if query is None:
+        return list()
+    return [TaskRow._make(row) for row in (await session.execute(query)).all()]
@@ -0,0 +1,112 @@
+import os
+
+# рассылка напоминаний
+REMINDER_CONCURRENCY = int(os.getenv("REMINDER_CONCURRENCY", 20))  # чатов, обслуживаемых одновременно
+REMINDER_GLOBAL_RATE = float(os.getenv("REMINDER_GLOBAL_RATE", 25))  # сообщений в секунду (лимит Telegram ~30)
+REMINDER_CHAT_INTERVAL = float(os.getenv("REMINDER_CHAT_INTERVAL", 1))  # секунд между сообщениями в один чат
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", 500))  # задач на один UPDATE send_remind
+REMINDER_MAX_RETRIES = int(os.getenv("REMINDER_MAX_RETRIES", 3))
+REMINDER_RETRY_BACKOFF = float(os.getenv("REMINDER_RETRY_BACKOFF", 5))  # секунд до повтора после ошибки, далее удваивается
+REMINDER_RETRY_BACKOFF_MAX = float(os.getenv("REMINDER_RETRY_BACKOFF_MAX", 300))
+
+# ежедневный дайджест
+DIGEST_USERS_BATCH = int(os.getenv("DIGEST_USERS_BATCH", 500))  # пользователей в одном сгруппированном запросе
+DIGEST_MAX_TASKS = int(os.getenv("DIGEST_MAX_TASKS", 50))  # задач в одном сообщении дайджеста
+
+# очередь исходящих сообщений
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 200))  # сообщений за один проход отправителя
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 8))  # после стольких ошибок сообщение уходит в dead
+OUTBOX_BACKOFF = float(os.getenv("OUTBOX_BACKOFF", 5))  # секунд до первого повтора, далее удваивается
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", 3600))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", 30))  # проверка очереди без явного сигнала
+OUTBOX_RETENTION = int(os.getenv("OUTBOX_RETENTION", 7 * 86400))  # секунд хранения отправленных сообщений
+
+# база данных
+DB_URL = os.getenv("DB_URL", "sqlite+aiosqlite:///data/taskbot.db")
+DB_PROFILE = os.getenv("DB_PROFILE", "production")  # production: WAL, pragmas, групповые коммиты; default: как раньше
+DB_ECHO = os.getenv("DB_ECHO", "0") == "1"
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", -65536))  # отрицательное значение - размер в КиБ
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", 268435456))
+DB_BUSY_TIMEOUT = int(os.getenv("DB_BUSY_TIMEOUT", 5000))  # мс
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", 5))
+DB_WRITE_BATCH = int(os.getenv("DB_WRITE_BATCH", 100))  # записей в одной групповой транзакции
+DB_WRITE_DELAY = float(os.getenv("DB_WRITE_DELAY", 0.005))  # секунд ожидания попутных записей
+
+# состояния диалогов
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")  # sqlite или memory
+FSM_TTL = int(os.getenv("FSM_TTL", 86400))  # секунд до удаления брошенного диалога
+FSM_PURGE_INTERVAL = int(os.getenv("FSM_PURGE_INTERVAL", 600))
+
+# списки задач
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", 10))  # задач на странице /tasks и /edit_task
+
+# импорт задач из файла
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 1000))  # задач в одном INSERT
+IMPORT_MAX_LINES = int(os.getenv("IMPORT_MAX_LINES", 200000))
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", 20 * 2 ** 20))  # предел скачивания файлов Bot API
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", 20))  # ошибок в итоговом сообщении
+
+# архив завершенных задач
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", 30))  # через сколько дней после завершения
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", 1000))  # задач в одной транзакции переноса
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", 3600))  # секунд между запусками
+
+# статистика /stats
+STATS_INTERVAL = float(os.getenv("STATS_INTERVAL", 600))  # секунд между проверками сдвига просроченных
+STATS_RECONCILE_INTERVAL = float(os.getenv("STATS_RECONCILE_INTERVAL", 6 * 3600))  # сверка счетчиков с задачами
+STATS_RECONCILE_BATCH = int(os.getenv("STATS_RECONCILE_BATCH", 200))  # пользователей в одной транзакции сверки
+
+# поиск
+SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", 20))  # задач в ответе /search
+
+# выгрузка задач
+EXPORT_CHUNK = int(os.getenv("EXPORT_CHUNK", 500))  # строк, читаемых курсором за раз
+
+# кэш тегов
+TAG_CACHE_USERS = int(os.getenv("TAG_CACHE_USERS", 10000))  # пользователей в кэше
+TAG_CACHE_BYTES = int(os.getenv("TAG_CACHE_BYTES", 16 * 2 ** 20))  # приблизительный предел памяти
+
+# получение обновлений
+DELIVERY_MODE = os.getenv("DELIVERY_MODE", "polling")  # polling или webhook
+BOT_API_URL = os.getenv("BOT_API_URL", "")  # свой сервер Bot API (локальный или тестовый), по умолчанию api.telegram.org
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # публичный адрес; пусто - setWebhook не вызывается (локальная отладка)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_IN_FLIGHT = int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", 100))  # обновлений в обработке одновременно
+
+# несколько процессов
+WORKERS = int(os.getenv("WORKERS", 1))  # больше 1 - супервизор и рабочие процессы, шардированные по tg_id
+WORKER_INDEX = os.getenv("WORKER_INDEX")  # задается супервизором рабочему процессу
+WORKER_QUEUE = int(os.getenv("WORKER_QUEUE", 1000))  # обновлений в очереди к одному рабочему
+WORKER_MAX_IN_FLIGHT = int(os.getenv("WORKER_MAX_IN_FLIGHT", 100))  # обновлений в обработке в одном рабочем
+WORKER_RESTART_DELAY = float(os.getenv("WORKER_RESTART_DELAY", 1))  # секунд до перезапуска упавшего рабочего
+LEASE_TTL = float(os.getenv("LEASE_TTL", 30))  # секунд, через которые аренда ведущего считается брошенной
+LEASE_RENEW = float(os.getenv("LEASE_RENEW", 10))  # период продления и попыток захвата
+REMINDER_REFRESH = float(os.getenv("REMINDER_REFRESH", 10))  # перечитывание напоминаний ведущим из БД
+
+# ограничение частоты запросов одного пользователя
+THROTTLE_ENABLED = os.getenv("THROTTLE_ENABLED", "1") == "1"
+THROTTLE_MESSAGE_RATE = float(os.getenv("THROTTLE_MESSAGE_RATE", 1))  # сообщений в секунду в среднем
+THROTTLE_MESSAGE_BURST = int(os.getenv("THROTTLE_MESSAGE_BURST", 20))  # сообщений подряд без ожидания
+THROTTLE_CALLBACK_RATE = float(os.getenv("THROTTLE_CALLBACK_RATE", 2))  # нажатий кнопок в секунду в среднем
+THROTTLE_CALLBACK_BURST = int(os.getenv("THROTTLE_CALLBACK_BURST", 10))
+THROTTLE_CALLBACK_WINDOW = float(os.getenv("THROTTLE_CALLBACK_WINDOW", 1))  # секунд, повтор той же кнопки - дубль
+THROTTLE_USERS = int(os.getenv("THROTTLE_USERS", 100000))  # пользователей в памяти ограничителя
+THROTTLE_IDLE = float(os.getenv("THROTTLE_IDLE", 600))  # секунд без обновлений до вытеснения пользователя
+THROTTLE_SEEN_UPDATES = int(os.getenv("THROTTLE_SEEN_UPDATES", 10000))  # последних update_id для отсева повторов
+
+# метрики
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))
+
+# профилировщик запросов
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0") == "1"
+PROFILER_SLOWEST = int(os.getenv("PROFILER_SLOWEST", 50))  # сколько самых медленных запросов хранить
+PROFILER_SLOW_MS = float(os.getenv("PROFILER_SLOW_MS", 100))  # порог записи в журнал медленных запросов
+PROFILER_SAMPLE_RATE = float(os.getenv("PROFILER_SAMPLE_RATE", 0.01))  # доля запросов в выборке таймингов
+PROFILER_SAMPLES = int(os.getenv("PROFILER_SAMPLES", 1000))
+ADMIN_IDS = [int(tg_id) for tg_id in os.getenv("ADMIN_IDS", "").split(",") if tg_id.strip()]
@@ -0,0 +1,238 @@
+from datetime import date
+from time import monotonic
+
+import sqlalchemy
+from sqlalchemy.dialects.sqlite import insert
+
+from data.database import new_session, writer
+from data.models import TaskModel, ArchivedTaskModel, TaskCounterModel, UserModel
+from data.periodic import PeriodicJob
+from data.settings import STATS_INTERVAL, STATS_RECONCILE_INTERVAL, STATS_RECONCILE_BATCH
+
+# Счетчики для /stats: строка на пары (пользователь, тег) с числом активных, завершенных и
+# просроченных задач. Каждый путь записи меняет счетчики в той же транзакции, что и задачи,
+# поэтому /stats читает несколько строк по первичному ключу вместо COUNT по tasks.
+# Просроченность зависит от даты, а не только от записей: overdue учитывает дедлайны раньше
+# as_of, раз в день as_of сдвигается на сегодня с досчетом задач, ставших просроченными.
+# Сверка с tasks и архивом находит и исправляет расхождения, если какой-то путь их допустил.
+
+
+def task_delta(task, sign=1):  # task: объект или строка с user_id, tag_id, due_date, is_done
+    return task.user_id, task.tag_id or 0, task.due_date, bool(task.is_done), sign
+
+
+def counters_upsert():
+    bind = sqlalchemy.bindparam
+    due_date = bind("due", type_=sqlalchemy.Date)
+    statement = insert(TaskCounterModel).values(
+        user_id=bind("user"), tag_id=bind("tag"), active=bind("d_active"), done=bind("d_done"),
+        overdue=sqlalchemy.case((due_date < bind("today", type_=sqlalchemy.Date), bind("d_active")), else_=0),
+        as_of=bind("today", type_=sqlalchemy.Date),
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[TaskCounterModel.user_id, TaskCounterModel.tag_id],
+        set_={
+            "active": TaskCounterModel.active + statement.excluded.active,
+            "done": TaskCounterModel.done + statement.excluded.done,
+            "overdue": TaskCounterModel.overdue + sqlalchemy.case(
+                (due_date < TaskCounterModel.as_of, statement.excluded.active), else_=0
+            ),
+        },
+    )
+
+
+async def count_tasks(session, deltas):
+    # deltas: (user_id, tag_id, due_date, is_done, знак) из task_delta; выполняется в транзакции писателя
+    # вместе с изменением задач, одинаковые ключи складываются в один UPSERT
+    totals = dict()
+    for user_id, tag_id, due_date, is_done, sign in deltas:
+        active, done = totals.get((user_id, tag_id, due_date), (0, 0))
+        totals[(user_id, tag_id, due_date)] = (active + (0 if is_done else sign), done + (sign if is_done else 0))
+    today = date.today()
+    values = [
+        {"user": user_id, "tag": tag_id, "due": due_date, "d_active": active, "d_done": done, "today": today}
+        for (user_id, tag_id, due_date), (active, done) in totals.items() if active or done
+    ]
+    if values:
+        connection = await session.connection()
+        await connection.execute(counters_upsert(), values)
+
+
+def truth_query(user_ids, today):  # настоящие значения счетчиков по tasks и архиву
+    tag_id = sqlalchemy.func.coalesce(TaskModel.tag_id, 0)
+    is_active = TaskModel.is_done == False
+    live = sqlalchemy.select(
+        TaskModel.user_id.label("user_id"),
+        tag_id.label("tag_id"),
+        sqlalchemy.func.sum(sqlalchemy.case((is_active, 1), else_=0)).label("active"),
+        sqlalchemy.func.sum(sqlalchemy.case((is_active, 0), else_=1)).label("done"),
+        sqlalchemy.func.sum(sqlalchemy.case((is_active & (TaskModel.due_date < today), 1), else_=0)).label("overdue"),
+    ).where(TaskModel.user_id.in_(user_ids)).group_by(TaskModel.user_id, tag_id)
+    archived = sqlalchemy.select(
+        ArchivedTaskModel.user_id,
+        sqlalchemy.func.coalesce(ArchivedTaskModel.tag_id, 0),
+        sqlalchemy.literal(0),
+        sqlalchemy.func.count(),
+        sqlalchemy.literal(0),
+    ).where(ArchivedTaskModel.user_id.in_(user_ids)).group_by(
+        ArchivedTaskModel.user_id, sqlalchemy.func.coalesce(ArchivedTaskModel.tag_id, 0)
+    )
+    merged = sqlalchemy.union_all(live, archived).subquery()
+    return sqlalchemy.select(
+        merged.c.user_id, merged.c.tag_id, sqlalchemy.func.sum(merged.c.active),
+        sqlalchemy.func.sum(merged.c.done), sqlalchemy.func.sum(merged.c.overdue),
+    ).group_by(merged.c.user_id, merged.c.tag_id)
+
+
+async def reconcile_users(session, user_ids):  # в транзакции писателя; возвращает число исправленных строк
+    today = date.today()
+    truth = {
+        (user_id, tag_id): (active, done, overdue)
+        for user_id, tag_id, active, done, overdue in (await session.execute(truth_query(user_ids, today))).all()
+    }
+    stored = {
+        (row.user_id, row.tag_id): row
+        for row in (await session.execute(
+            sqlalchemy.select(TaskCounterModel).where(TaskCounterModel.user_id.in_(user_ids))
+        )).scalars()
+    }
+    fixed = 0
+    for key, row in stored.items():
+        if key not in truth:
+            await session.delete(row)
+            fixed += bool(row.active or row.done)
+    for (user_id, tag_id), (active, done, overdue) in truth.items():
+        row = stored.get((user_id, tag_id))
+        if row is None:
+            row = TaskCounterModel(user_id=user_id, tag_id=tag_id, active=0, done=0, overdue=0, as_of=today)
+            session.add(row)
+        # устаревший as_of - не расхождение, а еще не выполненный сдвиг
+        fixed += (row.active, row.done) != (active, done) or (row.as_of == today and row.overdue != overdue)
+        row.active, row.done, row.overdue, row.as_of = active, done, overdue, today
+    await session.flush()
+    return fixed
+
+
+def backfill_counters(conn):  # шаг миграции: счетчики по уже существующим задачам
+    user_ids = conn.execute(sqlalchemy.select(UserModel.tg_id)).scalars().all()
+    today = date.today()
+    for start in range(0, len(user_ids), STATS_RECONCILE_BATCH):
+        rows = conn.execute(truth_query(user_ids[start:start + STATS_RECONCILE_BATCH], today)).all()
+        if rows:
+            conn.execute(sqlalchemy.insert(TaskCounterModel), [
+                {"user_id": user_id, "tag_id": tag_id, "active": active, "done": done, "overdue": overdue,
+                 "as_of": today}
+                for user_id, tag_id, active, done, overdue in rows
+            ])
+
+
+def rollover_statement(today, batch):  # строки со старым as_of: досчитать ставшие просроченными задачи
+    gap = sqlalchemy.select(sqlalchemy.func.count()).where(
+        TaskModel.user_id == TaskCounterModel.user_id,
+        sqlalchemy.func.coalesce(TaskModel.tag_id, 0) == TaskCounterModel.tag_id,
+        TaskModel.is_done == False,
+        TaskModel.due_date >= TaskCounterModel.as_of,
+        TaskModel.due_date < today,
+    ).scalar_subquery()
+    stale = (
+        sqlalchemy.select(TaskCounterModel.user_id, TaskCounterModel.tag_id)
+        .where(TaskCounterModel.as_of < today)
+        .limit(batch)
+    )
+    return (
+        sqlalchemy.update(TaskCounterModel)
+        .where(sqlalchemy.tuple_(TaskCounterModel.user_id, TaskCounterModel.tag_id).in_(stale))
+        .values(overdue=TaskCounterModel.overdue + gap, as_of=today)
+    )
+
+
+async def user_counters(session, user_id):
+    # [(tag_id, активные, завершенные, просроченные)]; если сдвиг as_of еще не прошел,
+    # недостающие просроченные досчитываются по дням между as_of и сегодня
+    today = date.today()
+    rows = (await session.execute(
+        sqlalchemy.select(TaskCounterModel).where(TaskCounterModel.user_id == user_id)
+    )).scalars().all()
+    stale = [row.as_of for row in rows if row.as_of < today]
+    gap = dict()
+    if stale:
+        tag_id = sqlalchemy.func.coalesce(TaskModel.tag_id, 0)
+        for tag, due_date, count in (await session.execute(
+            sqlalchemy.select(tag_id, TaskModel.due_date, sqlalchemy.func.count())
+            .where(
+                TaskModel.user_id == user_id,
+                TaskModel.is_done == False,
+                TaskModel.due_date >= min(stale),
+                TaskModel.due_date < today,
+            )
+            .group_by(tag_id, TaskModel.due_date)
+        )).all():
+            gap.setdefault(tag, list()).append((due_date, count))
+    return [
+        (row.tag_id, row.active, row.done,
+         row.overdue + sum(count for due_date, count in gap.get(row.tag_id, ()) if due_date >= row.as_of))
+        for row in rows
+    ]
+
+
+def render_stats(counters, tags):  # tags: {id: название} из кэша тегов
+    by_tag = dict()  # название -> [активные, завершенные, просроченные]; задачи удаленных тегов - без тега
+    for tag_id, active, done, overdue in counters:
+        total = by_tag.setdefault(tags.get(tag_id), [0, 0, 0])
+        total[0], total[1], total[2] = total[0] + active, total[1] + done, total[2] + overdue
+    active, done, overdue = (sum(total[i] for total in by_tag.values()) for i in range(3))
+    lines = [f"Активные: {active}", f"Просроченные: {overdue}", f"Завершенные: {done}"]
+    if any(title for title, total in by_tag.items() if any(total)):
+        lines += ["", "По тегам:"]
+        for title, (active, done, overdue) in sorted(by_tag.items(), key=lambda item: (item[0] is None, item[0] or "")):
+            if active or done:
+                lines.append(f"{'#' + title if title else 'без тега'} - активных {active}, "
+                             f"просрочено {overdue}, завершено {done}")
+    return "\n".join(lines)
+
+
+class StatsMaintenance(PeriodicJob):  # сдвиг as_of раз в STATS_INTERVAL и полная сверка раз в STATS_RECONCILE_INTERVAL
+    def __init__(self, interval=STATS_INTERVAL, reconcile_interval=STATS_RECONCILE_INTERVAL,
+                 batch=STATS_RECONCILE_BATCH):
+        super().__init__()
+        self.interval = interval
+        self.reconcile_interval = reconcile_interval
+        self.batch = batch
+        self._reconciled_at = None
+
+    async def rollover(self, today=None):  # возвращает число сдвинутых строк
+        today = today or date.today()
+        total = 0
+        while True:
+            count = await writer.execute(rollover_statement(today, self.batch))
+            total += count
+            if count < self.batch:
+                return total
+
+    async def reconcile(self):  # сверка пачками пользователей; возвращает число исправленных строк
+        fixed = 0
+        after = None
+        while True:
+            query = sqlalchemy.select(UserModel.tg_id).order_by(UserModel.tg_id).limit(self.batch)
+            if after is not None:
+                query = query.where(UserModel.tg_id > after)
+            async with new_session() as session:
+                user_ids = (await session.execute(query)).scalars().all()
+            if not user_ids:
+                return fixed
+
+            async def work(session, user_ids=user_ids):
+                return await reconcile_users(session, user_ids)
+            fixed += await writer.submit(work)
+            after = user_ids[-1]
+
+    async def tick(self):
+        await self.rollover()
+        if self._reconciled_at is None or monotonic() - self._reconciled_at >= self.reconcile_interval:
+            self._reconciled_at = monotonic()
+            fixed = await self.reconcile()
+            if fixed:
+                print(f"Статистика: исправлено {fixed} расходящихся счетчиков")
+
+
+stats_maintenance = StatsMaintenance()
@@ -0,0 +1,78 @@
+import sys
+from collections import OrderedDict
+
+import sqlalchemy
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from data.database import new_session
+from data.models import TagModel
+from data.settings import TAG_CACHE_USERS, TAG_CACHE_BYTES
+from data.unit_of_work import current_session
+
+TAG_OVERHEAD = 200  # байт на тег сверх строки: элемент словаря, кнопка клавиатуры
+
+
+class UserTags:  # теги одного пользователя и готовая клавиатура фильтра
+    __slots__ = ("tags", "keyboard", "size")
+
+    def __init__(self, tags):
+        self.tags = tags  # id -> title, в порядке id
+        self.keyboard = None
+        self.size = sum(sys.getsizeof(title) + TAG_OVERHEAD for title in tags.values()) + TAG_OVERHEAD
+
+
+class TagCache:  # кэш тегов по пользователям с вытеснением LRU и ограничением памяти
+    def __init__(self, max_users=TAG_CACHE_USERS, max_bytes=TAG_CACHE_BYTES, session_maker=new_session):
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self.session_maker = session_maker
+        self.size = 0
+        self._entries = OrderedDict()
+
+    async def _load(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            self._entries.move_to_end(user_id)
+            return entry
+        query = sqlalchemy.select(TagModel.id, TagModel.title).where(TagModel.user_id == user_id).order_by(TagModel.id)
+        session = current_session.get()
+        if session is not None:  # промах из обработчика - через сессию обновления
+            entry = UserTags(dict((await session.execute(query)).all()))
+        else:
+            async with self.session_maker() as session:
+                entry = UserTags(dict((await session.execute(query)).all()))
+        self._entries[user_id] = entry
+        self.size += entry.size
+        while self._entries and (len(self._entries) > self.max_users or self.size > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= evicted.size
+        return entry
+
+    async def get(self, user_id):  # {id: title}
+        return (await self._load(user_id)).tags
+
+    async def find(self, user_id, title):  # id тега пользователя по названию или None
+        for tag_id, tag_title in (await self.get(user_id)).items():
+            if tag_title == title:
+                return tag_id
+        return None
+
+    async def keyboard(self, user_id):  # клавиатура фильтра по тегам, None если тегов нет
+        entry = await self._load(user_id)
+        if entry.keyboard is None and entry.tags:
+            buttons = [
+                InlineKeyboardButton(text=title, callback_data=f"tag_{tag_id}")
+                for tag_id, title in entry.tags.items()
+            ]
+            entry.keyboard = InlineKeyboardMarkup(
+                inline_keyboard=[buttons[i:i + 3] for i in range(0, len(buttons), 3)]
+            )
+        return entry.keyboard
+
+    def invalidate(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self.size -= entry.size
+
+
+tag_cache = TagCache()
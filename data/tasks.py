@@ -0,0 +1,220 @@
+from datetime import date, datetime, time, timedelta
+from html import escape
+from typing import NamedTuple, Optional
+
+import sqlalchemy
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from data.models import TaskModel, TagModel, ArchivedTaskModel
+from data.recurrence import describe_rule
+from data.settings import PAGE_SIZE
+
+
+def parse_due_date(text):  # (дата, None) или (None, текст ошибки); общие правила для диалога и импорта
+    try:
+        due_date = datetime.strptime(text.strip(), "%d-%m-%Y").date()
+    except ValueError:
+        return None, "Неверный формат даты! Используйте ДД-ММ-ГГГГ"
+    if due_date < date.today():
+        return None, "Дата в прошлом!!"
+    return due_date, None
+
+
+def default_notify_time(due_date):  # напоминание накануне дедлайна в 18:00
+    now = datetime.now()
+    if now.time().hour >= 18 and due_date == now.date() + timedelta(days=1):
+        notify_hour = min(now.time().hour + 2, 23)  # после 22:00 - в 23:00, а не в несуществующий час 24
+    else:
+        notify_hour = 18
+    notify_date = due_date - timedelta(days=1)
+    return datetime.combine(notify_date, time(notify_hour, 00))
+
+
+class TaskRow(NamedTuple):  # компактная строка списка задач
+    id: int
+    title: str
+    due_date: date
+    notify_time: datetime
+    is_done: bool
+    tag_title: Optional[str]
+    repeat: Optional[str] = None
+
+
+def task_rows_select(model, user_id, is_done, tag_id=None, after=None, before=None, limit=None):
+    # один запрос с тегом вместо N+1; after/before - ключ (due_date, id) для постраничного вывода
+    key = sqlalchemy.tuple_(model.due_date, model.id)
+    query = (
+        sqlalchemy.select(
+            model.id,
+            model.title,
+            model.due_date,
+            model.notify_time,
+            model.is_done,
+            TagModel.title.label("tag_title"),
+            model.repeat,
+        )
+        .outerjoin(TagModel, TagModel.id == model.tag_id)
+        .where(
+            model.user_id == user_id,
+            model.is_done == is_done,
+        )
+    )
+    if tag_id is not None:
+        query = query.where(model.tag_id == tag_id)
+    if before is not None:
+        query = query.where(key < tuple(before)).order_by(model.due_date.desc(), model.id.desc())
+    else:
+        if after is not None:
+            query = query.where(key > tuple(after))
+        query = query.order_by(model.due_date, model.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def task_rows_query(user_id, is_done, tag_id=None, after=None, before=None, limit=None):
+    query = task_rows_select(TaskModel, user_id, is_done, tag_id, after, before, limit)
+    if not is_done:
+        return query
+    # завершенные лежат в tasks и в архиве: из каждой таблицы берется своя страница по её индексу,
+    # затем страницы сливаются по тому же ключу
+    archived = task_rows_select(ArchivedTaskModel, user_id, is_done, tag_id, after, before, limit)
+    merged = sqlalchemy.union_all(
+        sqlalchemy.select(query.subquery()), sqlalchemy.select(archived.subquery())
+    ).subquery()
+    order = sqlalchemy.desc if before is not None else sqlalchemy.asc
+    query = sqlalchemy.select(merged).order_by(order(merged.c.due_date), order(merged.c.id))
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+async def fetch_task_rows(session, user_id, is_done, tag_id=None):
+    result = await session.execute(task_rows_query(user_id, is_done, tag_id))
+    return [TaskRow._make(row) for row in result.all()]
+
+
+async def fetch_page(session, user_id, is_done, tag_id=None, after=None, before=None, size=PAGE_SIZE):
+    # страница по ключу (due_date, id): читается только то, что будет показано, плюс одна строка-признак
+    result = await session.execute(task_rows_query(user_id, is_done, tag_id, after, before, size + 1))
+    rows = [TaskRow._make(row) for row in result.all()]
+    has_more = len(rows) > size
+    rows = rows[:size]
+    if before is not None:
+        rows.reverse()
+    return rows, has_more
+
+
+def render_task(row: TaskRow, number):
+    text = f"\nЗадача <b>№{number}</b> \n{escape(row.title)}\nДедлайн: {row.due_date.strftime('%d-%m-%Y')}\n"
+    if not row.is_done:
+        text += f"Напоминание: {row.notify_time.strftime('%d-%m-%Y %H:%M')}\n"
+    if row.tag_title:
+        text += f"Тег: #{escape(row.tag_title)}\n"
+    if row.repeat:
+        text += f"Повтор: {describe_rule(row.repeat)}\n"
+    return text
+
+
+def render_tasks(rows, start=1):  # один проход: текст списка и соответствие номер -> id задачи
+    # ключи - строки, так соответствие без изменений переживает JSON в хранилище FSM
+    parts = list()
+    nums = dict()
+    for number, row in enumerate(rows, start):
+        parts.append(render_task(row, number))
+        nums[str(number)] = row.id
+    return "".join(parts), nums
+
+
+BULK = 2  # режим списка с отметками для массового редактирования
+
+
+class Page(NamedTuple):  # параметры страницы, передаются в callback_data кнопок
+    edit: int  # 0 - просмотр, 1 - выбор номера задачи, BULK - отметки
+    is_done: bool
+    tag_id: Optional[int]
+    direction: str  # n - вперед от ключа, p - назад
+    due_date: date
+    task_id: int
+    start: int  # номер первой задачи страницы
+
+    def pack(self):
+        return (f"pg:{int(self.edit)}:{int(self.is_done)}:{self.tag_id or 0}:{self.direction}:"
+                f"{self.due_date.strftime('%Y%m%d')}:{self.task_id}:{self.start}")
+
+    @classmethod
+    def unpack(cls, data):
+        _, edit, is_done, tag_id, direction, due_date, task_id, start = data.split(":")
+        return cls(int(edit), is_done == "1", int(tag_id) or None, direction,
+                   datetime.strptime(due_date, "%Y%m%d").date(), int(task_id), int(start))
+
+
+def page_buttons(rows, start, has_prev, has_next, edit, is_done, tag_id=None):
+    buttons = list()
+    if has_prev:
+        first = rows[0]
+        buttons.append(InlineKeyboardButton(
+            text="« Назад",
+            callback_data=Page(edit, is_done, tag_id, "p", first.due_date, first.id, max(start - PAGE_SIZE, 1)).pack(),
+        ))
+    if has_next:
+        last = rows[-1]
+        buttons.append(InlineKeyboardButton(
+            text="Далее »",
+            callback_data=Page(edit, is_done, tag_id, "n", last.due_date, last.id, start + len(rows)).pack(),
+        ))
+    return buttons
+
+
+def page_keyboard(rows, start, has_prev, has_next, edit, is_done, tag_id=None):
+    buttons = page_buttons(rows, start, has_prev, has_next, edit, is_done, tag_id)
+    keyboard = [buttons] if buttons else list()
+    if edit:
+        keyboard.append([InlineKeyboardButton(
+            text="Выбрать несколько", callback_data=f"bk:on:{int(is_done)}:{tag_id or 0}"
+        )])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard) if keyboard else None
+
+
+def bulk_actions(count, is_done):
+    if is_done:
+        actions = [[
+            InlineKeyboardButton(text=f"Сделать активными ({count})", callback_data="bk:active"),
+            InlineKeyboardButton(text=f"Удалить ({count})", callback_data="bk:delete"),
+        ]]
+    else:
+        actions = [
+            [
+                InlineKeyboardButton(text=f"Завершить ({count})", callback_data="bk:done"),
+                InlineKeyboardButton(text=f"Удалить ({count})", callback_data="bk:delete"),
+            ],
+            [
+                InlineKeyboardButton(text="Тег", callback_data="bk:tag"),
+                InlineKeyboardButton(text="Дедлайн", callback_data="bk:date"),
+            ],
+        ]
+    return actions + [[InlineKeyboardButton(text="Отмена", callback_data="bk:off")]]
+
+
+def check_button(task_id, text, selected):
+    return InlineKeyboardButton(text=f"{'☑' if task_id in selected else '☐'} {text}", callback_data=f"bk:t:{task_id}")
+
+
+def bulk_keyboard(rows, start, has_prev, has_next, is_done, tag_id, selected):
+    keyboard = [[check_button(row.id, f"{number}. {row.title[:40]}", selected)] for number, row in enumerate(rows, start)]
+    buttons = page_buttons(rows, start, has_prev, has_next, BULK, is_done, tag_id)
+    if buttons:
+        keyboard.append(buttons)
+    return InlineKeyboardMarkup(inline_keyboard=keyboard + bulk_actions(len(selected), is_done))
+
+
+def toggle_keyboard(markup, selected, is_done):
+    # отметка меняется в уже показанной клавиатуре: задачи страницы не перечитываются из базы
+    keyboard = list()
+    for row in markup.inline_keyboard:
+        data = row[0].callback_data
+        if data.startswith("bk:t:"):
+            keyboard.append([check_button(int(data[5:]), row[0].text[2:], selected)])
+        elif data.startswith("pg:"):
+            keyboard.append(row)
+    return InlineKeyboardMarkup(inline_keyboard=keyboard + bulk_actions(len(selected), is_done))
@@ -0,0 +1,132 @@
+from collections import OrderedDict, deque
+from time import monotonic
+
+from aiogram import BaseMiddleware, Dispatcher
+
+from data.metrics import observe_throttled
+from data.settings import (
+    THROTTLE_ENABLED, THROTTLE_MESSAGE_RATE, THROTTLE_MESSAGE_BURST, THROTTLE_CALLBACK_RATE, THROTTLE_CALLBACK_BURST,
+    THROTTLE_CALLBACK_WINDOW, THROTTLE_USERS, THROTTLE_IDLE, THROTTLE_SEEN_UPDATES
+)
+
+# Ограничение частоты обновлений одного пользователя до FSM и обработчиков. У каждого tg_id
+# два ведра токенов: сообщения (команды и ответы в диалогах) и нажатия кнопок. Повтор той же
+# кнопки того же сообщения в течение THROTTLE_CALLBACK_WINDOW - двойное нажатие, он отбрасывается,
+# как и уже обработанный update_id (повторная доставка webhook). Отброшенное обновление не ждет
+# блокировки пользователя в SimpleEventIsolation и не доходит до базы. Память ограничена:
+# пользователи без обновлений дольше THROTTLE_IDLE и сверх THROTTLE_USERS вытесняются.
+# В кластере обновления одного пользователя приходят в один рабочий процесс, поэтому
+# состояние ограничителя у каждого рабочего свое.
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst, now):
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now, rate, burst):  # False - токенов нет, обновление отбрасывается
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class UserLimits:
+    __slots__ = ("messages", "callbacks", "last_callback", "last_callback_at", "seen_at", "warned")
+
+    def __init__(self, now):
+        self.messages = TokenBucket(THROTTLE_MESSAGE_BURST, now)
+        self.callbacks = TokenBucket(THROTTLE_CALLBACK_BURST, now)
+        self.last_callback = None  # (data, message_id) последнего нажатия
+        self.last_callback_at = 0.0
+        self.seen_at = now
+        self.warned = False  # предупреждение уже отправлено и с тех пор ничего не пропущено
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(self, max_users=THROTTLE_USERS, idle=THROTTLE_IDLE, seen_updates=THROTTLE_SEEN_UPDATES):
+        self.max_users = max_users
+        self.idle = idle
+        self.dropped = dict()  # причина -> число отброшенных обновлений
+        self._users = OrderedDict()  # tg_id -> UserLimits, от давно не активных к недавним
+        self._seen = set()
+        self._seen_order = deque(maxlen=seen_updates)
+
+    def __len__(self):
+        return len(self._users)
+
+    def _limits(self, user_id, now):
+        limits = self._users.get(user_id)
+        if limits is None:
+            limits = self._users[user_id] = UserLimits(now)
+        else:
+            self._users.move_to_end(user_id)
+            limits.seen_at = now
+        while len(self._users) > self.max_users or next(iter(self._users.values())).seen_at < now - self.idle:
+            self._users.popitem(last=False)
+        return limits
+
+    def _is_duplicate(self, update_id):
+        if update_id in self._seen:
+            return True
+        if len(self._seen_order) == self._seen_order.maxlen:
+            self._seen.discard(self._seen_order[0])
+        self._seen_order.append(update_id)
+        self._seen.add(update_id)
+        return False
+
+    def check(self, update, now):  # причина отбросить обновление или None
+        if self._is_duplicate(update.update_id):
+            return "duplicate"
+        if update.callback_query is not None:
+            callback = update.callback_query
+            limits = self._limits(callback.from_user.id, now)
+            key = (callback.data, callback.message.message_id if callback.message else None)
+            if key == limits.last_callback and now - limits.last_callback_at < THROTTLE_CALLBACK_WINDOW:
+                return "coalesced"
+            limits.last_callback, limits.last_callback_at = key, now
+            if not limits.callbacks.take(now, THROTTLE_CALLBACK_RATE, THROTTLE_CALLBACK_BURST):
+                return "callbacks"
+        elif update.message is not None and update.message.from_user is not None:
+            limits = self._limits(update.message.from_user.id, now)
+            if not limits.messages.take(now, THROTTLE_MESSAGE_RATE, THROTTLE_MESSAGE_BURST):
+                return "messages"
+        else:
+            return None
+        limits.warned = False
+        return None
+
+    async def __call__(self, handler, event, data):
+        reason = self.check(event, monotonic())
+        if reason is None:
+            return await handler(event, data)
+        self.dropped[reason] = self.dropped.get(reason, 0) + 1
+        observe_throttled(reason)
+        if reason == "coalesced":  # без ответа кнопка остается с индикатором загрузки
+            await event.callback_query.answer()
+        elif reason != "duplicate":  # на оригинал уже ответили
+            # предупреждение одно на серию отброшенных: ответ на каждое - те же запросы к API для нарушителя
+            user = (event.callback_query or event.message).from_user
+            limits = self._users[user.id]
+            if not limits.warned:
+                limits.warned = True
+                if event.callback_query is not None:
+                    await event.callback_query.answer("Слишком часто, подождите немного")
+                else:
+                    await event.message.answer("Слишком много сообщений, подождите немного")
+        return None
+
+
+def setup_throttling(dp: Dispatcher):
+    if not THROTTLE_ENABLED:
+        return None
+    throttling = ThrottlingMiddleware()
+    # перед FSMContextMiddleware: отброшенное обновление не ждет блокировки пользователя
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(throttling)
+    dp.update.outer_middleware(dp.fsm)
+    return throttling
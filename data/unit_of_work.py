@@ -0,0 +1,63 @@
+import contextvars
+from time import perf_counter
+
+from aiogram import BaseMiddleware, Dispatcher
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import Session
+
+from data.database import engine
+from data.metrics import observe_update_session
+
+# Сессия на обновление. Обработчик, объявивший аргумент session, получает одну AsyncSession
+# на всё обновление: соединение берется из пула при первом запросе, в конце обработчика
+# сессия фиксируется, при исключении откатывается и закрывается в любом случае.
+# Чтение FSM и кэш тегов внутри такого обработчика идут через ту же сессию (current_session),
+# поэтому обновление держит не больше одного соединения читателей и не ждет второго из пула,
+# удерживая первое. Записи по-прежнему идут через писателя (writer) - в SQLite он один.
+
+current_session = contextvars.ContextVar("current_session", default=None)
+
+
+class UpdateSyncSession(Session):
+    pass
+
+
+@event.listens_for(UpdateSyncSession, "do_orm_execute")
+def count_statement(orm_execute_state):
+    info = orm_execute_state.session.info
+    if "opened_at" not in info:
+        info["opened_at"] = perf_counter()
+    info["statements"] = info.get("statements", 0) + 1
+
+
+update_session = async_sessionmaker(engine, expire_on_commit=False, sync_session_class=UpdateSyncSession)
+
+
+class UnitOfWorkMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        if handler_object is None or "session" not in handler_object.params:
+            return await handler(event, data)
+        session = update_session()
+        token = current_session.set(session)
+        data["session"] = session
+        try:
+            result = await handler(event, data)
+            await session.commit()
+            return result
+        except Exception:
+            await session.rollback()
+            raise
+        finally:
+            await session.close()
+            current_session.reset(token)
+            opened_at = session.info.get("opened_at")
+            observe_update_session(handler_object.callback.__name__,
+                                   None if opened_at is None else perf_counter() - opened_at,
+                                   session.info.get("statements", 0))
+
+
+def setup_unit_of_work(dp: Dispatcher):  # вызывается при импорте main: обработчикам нужен аргумент session
+    for observer in (dp.message, dp.callback_query):
+        observer.middleware(UnitOfWorkMiddleware())
@@ -0,0 +1,68 @@
+import asyncio
+
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+
+from data.settings import (
+    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_MAX_IN_FLIGHT
+)
+
+
+class WebhookHandler:  # быстрый ответ Telegram и обработка обновления в фоне
+    def __init__(self, dp: Dispatcher, bot: Bot, secret=WEBHOOK_SECRET, max_in_flight=WEBHOOK_MAX_IN_FLIGHT):
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+        # при исчерпании лимита ответ задерживается, и Telegram сам притормаживает доставку
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.in_flight = set()
+
+    async def handle(self, request: web.Request):
+        if self.secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != self.secret:
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        await self.semaphore.acquire()
+        task = asyncio.create_task(self._process(update))
+        self.in_flight.add(task)
+        task.add_done_callback(self.in_flight.discard)
+        return web.Response()
+
+    async def _process(self, update):
+        try:
+            await self.dp.feed_raw_update(self.bot, update)
+        except Exception as error:
+            print(error)
+        finally:
+            self.semaphore.release()
+
+    async def drain(self):  # дождаться обновлений, принятых до остановки
+        if self.in_flight:
+            await asyncio.gather(*self.in_flight, return_exceptions=True)
+
+
+def make_app(dp: Dispatcher, bot: Bot, path=WEBHOOK_PATH, **kwargs):
+    handler = WebhookHandler(dp, bot, **kwargs)
+    app = web.Application()
+    app.router.add_post(path, handler.handle)
+    app["handler"] = handler
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, host=WEBHOOK_HOST, port=WEBHOOK_PORT):
+    app = make_app(dp, bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    if WEBHOOK_URL:
+        await bot.set_webhook(WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None,
+                              max_connections=min(WEBHOOK_MAX_IN_FLIGHT, 100))
+    print(f"Webhook: {host}:{port}{WEBHOOK_PATH}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await app["handler"].drain()
+        await runner.cleanup()
+        await bot.session.close()
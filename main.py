@@ -1,47 +1,107 @@
 import asyncio
-import re
-from datetime import datetime, date, time, timedelta
+import os
+import sys
+import tempfile
+from datetime import datetime
+from time import perf_counter
 
 import sqlalchemy
+from sqlalchemy.ext.asyncio import AsyncSession
 from aiogram import Bot, Dispatcher, Router, F
-from aiogram.filters import Command, StateFilter
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message, CallbackQuery
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from aiogram.fsm.storage.memory import MemoryStorage, SimpleEventIsolation
+from aiogram.types import (
+    InlineKeyboardMarkup, InlineKeyboardButton, Message, CallbackQuery, BufferedInputFile, FSInputFile
+)
 
+from data.archive import archiver, get_archived_task, restore_task
 from data.bot_messages import MESSAGES
+from data.bulk import complete_tasks, reopen_tasks, retag_tasks, reschedule_tasks, delete_tasks
+from data.cluster import run_supervisor, serve_stdin
 from data.config import BOT_TOKEN
-from data.database import new_session, setup_database
-from data.models import TaskModel, TagModel, UserModel
+from data.database import engine, write_engine, new_session, setup_database, writer
+from data.models import TaskModel, TagModel, UserModel, ArchivedTaskModel
+from data.outbox import outbox
+from data.recurrence import materialise, parse_rule, describe_rule
+from data.reminders import reminders
+from data.search import search_tasks
+from data.stats import count_tasks, task_delta, reconcile_users, user_counters, render_stats, stats_maintenance
+from data.digest import digests, set_digest_time
+from data.fsm_storage import SQLiteStorage
+from data.exporter import export_tasks, EXPORT_FORMATS
+from data.importer import import_tasks
+from data.lease import Lease
+from data.metrics import setup_metrics, start_metrics_server, observe_reminder_batch, observe_reminder_run
+from data.profiler import profiler, setup_profiler
+from data.settings import (
+    REMINDER_BATCH_SIZE, FSM_STORAGE, DELIVERY_MODE, BOT_API_URL, PROFILER_ENABLED, ADMIN_IDS, IMPORT_MAX_BYTES,
+    WORKERS, WORKER_INDEX, REMINDER_REFRESH
+)
+from data.tag_cache import tag_cache
+from data.throttling import setup_throttling
+from data.unit_of_work import setup_unit_of_work
+from data.webhook import run_webhook
+from data.tasks import (
+    fetch_page, render_tasks, page_keyboard, bulk_keyboard, toggle_keyboard, Page, BULK, parse_due_date,
+    default_notify_time
+)
 
 form_router = Router()
-dp = Dispatcher()
+# обновления одного пользователя обрабатываются по очереди, чтобы шаги диалога не обгоняли друг друга
+dp = Dispatcher(
+    storage=SQLiteStorage() if FSM_STORAGE == "sqlite" else MemoryStorage(),
+    events_isolation=SimpleEventIsolation(),
+)
+# одна сессия БД на обновление для обработчиков с аргументом session
+setup_unit_of_work(dp)
+# в кластере фоновые задачи выполняет один рабочий процесс - держатель аренды
+leader = Lease("jobs")
+
+
+def make_bot():
+    session = None
+    if BOT_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_URL))
+    return Bot(token=BOT_TOKEN, session=session)
 
 
 async def main():
-    # await setup_database()
-    bot = Bot(token=BOT_TOKEN)
+    await setup_database()
+    bot = make_bot()
+    if WORKERS > 1 and WORKER_INDEX is None:  # супервизор: только получение и раздача обновлений
+        await run_supervisor(bot, [sys.executable, os.path.abspath(__file__)], dp.resolve_used_update_types())
+        return
     await on_startup(bot)
-    await dp.start_polling(bot)
+    if WORKER_INDEX is not None:
+        try:
+            await serve_stdin(dp, bot)
+        finally:
+            await leader.stop()
+            await bot.session.close()
+    elif DELIVERY_MODE == "webhook":
+        await run_webhook(dp, bot)
+    else:
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
 
 
 @dp.message(Command("start"))
-async def process_start_command(message: Message):
-    async with new_session() as session:
-        query = sqlalchemy.select(UserModel).where(
-            UserModel.tg_id == message.from_user.id
-        )
-        result = await session.execute(query)
-        user_id_list = [user.tg_id for user in result.scalars().all()]
-        if not user_id_list:
-            user = UserModel(
-                tg_id=message.from_user.id,
-                username=message.from_user.username
-            )
-            session.add(user)
-            await session.commit()
-        await message.reply(MESSAGES["start text"])
+async def process_start_command(message: Message, session: AsyncSession):
+    query = sqlalchemy.select(UserModel).where(
+        UserModel.tg_id == message.from_user.id
+    )
+    result = await session.execute(query)
+    user_id_list = [user.tg_id for user in result.scalars().all()]
+    if not user_id_list:
+        await writer.add(UserModel(
+            tg_id=message.from_user.id,
+            username=message.from_user.username
+        ))
+    await message.reply(MESSAGES["start text"])
 
 
 @dp.message(Command("stop"))
@@ -54,6 +114,20 @@ async def cancel_handler(message: Message, state: FSMContext) -> None:
     await message.answer("Сброс действий")
 
 
+@dp.message(Command("profile"), F.from_user.id.in_(ADMIN_IDS))
+async def show_profile(message: Message):  # отчет профилировщика запросов, только для администраторов
+    if not PROFILER_ENABLED:
+        await message.answer("Профилировщик выключен (PROFILER_ENABLED=1)")
+        return
+    report = await profiler.dump(engine)
+    if "reset" in (message.text or ""):
+        profiler.reset()
+    if len(report) <= 4000:
+        await message.answer(report, parse_mode=None)
+    else:
+        await message.answer_document(BufferedInputFile(report.encode(), filename="profile.txt"))
+
+
 class TaskStates(StatesGroup):
     title_tag = State()
     due_date = State()
@@ -69,62 +143,106 @@ class TaskStates(StatesGroup):
     type_to = State()
     filter = State()
     filter_edit = State()
-
-
-def setup_scheduler(bot: Bot):
-    scheduler = AsyncIOScheduler()
-    scheduler.add_job(
-        send_reminders,
-        "interval",
-        minutes=1,
-        args=[bot]
-    )
-    scheduler.start()
+    change_repeat = State()
+    set_digest = State()
+    import_file = State()
+    export_type = State()
+    export_tag = State()
+    export_format = State()
+    bulk_tag = State()
+    bulk_deadline = State()
+
+
+async def start_jobs(bot: Bot, refresh=None):
+    await reminders.load(horizon=2 * refresh if refresh else None)
+    reminders.start(send_reminders, refresh)
+    digests.start()
+    outbox.start(bot)
+    archiver.start()
+    stats_maintenance.start()
+
+
+async def stop_jobs():
+    reminders.stop()
+    digests.stop()
+    outbox.stop()
+    archiver.stop()
+    stats_maintenance.stop()
+
+
+async def setup_scheduler(bot: Bot):
+    if WORKER_INDEX is None:
+        await start_jobs(bot)
+        return
+    # рабочий процесс кластера: задачи запускаются при получении аренды и останавливаются при потере
+    leader.start(lambda: start_jobs(bot, REMINDER_REFRESH), stop_jobs)
 
 
 async def on_startup(bot: Bot):
-    setup_scheduler(bot)
-
-
-async def send_reminders(bot: Bot):
+    setup_metrics(dp, engine, write_engine)
+    setup_throttling(dp)
+    setup_profiler(dp, engine, write_engine)
+    await start_metrics_server()
+    await setup_scheduler(bot)
+
+
+def reminder_text(title, due_date, tag_title):
+    if tag_title:
+        return (f"{due_date.strftime('%d-%m-%Y')}\n"
+                f"ДЕДЛАЙН ЗАДАЧИ '{title}' с тегом #{tag_title}\n"
+                f"Перейдите в /edit_task если хотите перенести дедлайн!")
+    return (f"{due_date.strftime('%d-%m-%Y')}\n"
+            f"ДЕДЛАЙН ЗАДАЧИ '{title}'\n"
+            f"Перейдите в /edit_task если хотите перенести дедлайн!")
+
+
+async def send_reminders(task_ids):
+    # напоминания ставятся в outbox в одной транзакции с отметкой send_remind - без потерь и дублей
+    started = perf_counter()
     async with new_session() as session:
-        now = datetime.now()
-        start_time = now - timedelta(minutes=1)
-        end_time = now + timedelta(minutes=1)
         task_query = (
-            sqlalchemy.select(TaskModel).where(
-                TaskModel.notify_time.between(start_time, end_time),
+            sqlalchemy.select(TaskModel.id, TaskModel.user_id, TaskModel.title, TaskModel.due_date,
+                              TagModel.title.label("tag_title"), TaskModel.notify_time, TaskModel.tag_id,
+                              TaskModel.repeat, TaskModel.custom_remind, UserModel.digest_time)
+            .outerjoin(TagModel, TagModel.id == TaskModel.tag_id)
+            .outerjoin(UserModel, UserModel.tg_id == TaskModel.user_id)
+            .where(
+                TaskModel.id.in_(task_ids),
                 TaskModel.is_done == 0,
-                TaskModel.send_remind == 0
+                TaskModel.send_remind == 0,
+                # очередь ведущего в кластере может отставать от переносов, сделанных другими процессами
+                TaskModel.notify_time <= datetime.now(),
             )
         )
-        tasks = (await session.execute(task_query)).scalars().all()
-
-        for task in tasks:
-            try:
-                tag_query = sqlalchemy.select(TagModel).where(
-                    TagModel.id == task.tag_id
-                )
-                tag_result = await session.execute(tag_query)
-                tag = tag_result.scalars().first()
-                if tag:
-                    await bot.send_message(
-                        chat_id=task.user_id,
-                        text=f"{task.due_date.strftime('%d-%m-%Y')}\n"
-                             f"ДЕДЛАЙН ЗАДАЧИ '{task.title}' с тегом #{tag.title}\n"
-                             f"Перейдите в /edit_task если хотите перенести дедлайн!"
-                    )
-                else:
-                    await bot.send_message(
-                        chat_id=task.user_id,
-                        text=f"{task.due_date.strftime('%d-%m-%Y')}\n"
-                             f"ДЕДЛАЙН ЗАДАЧИ '{task.title}'\n"
-                             f"Перейдите в /edit_task если хотите перенести дедлайн!"
-                    )
-                task.send_remind = True
-                await session.commit()
-            except Exception as error:
-                print(error)
+        rows = (await session.execute(task_query)).all()
+
+    for i in range(0, len(rows), REMINDER_BATCH_SIZE):
+        batch = rows[i:i + REMINDER_BATCH_SIZE]
+        # напоминание накануне у пользователей с дайджестом только отмечается: задача придет одним
+        # сообщением в digest_time. Время, заданное через "Напомнить", соблюдается и для них
+        messages = [
+            (f"remind:{row.id}:{row.notify_time:%Y%m%d%H%M}", row.user_id,
+             reminder_text(row.title, row.due_date, row.tag_title))
+            for row in batch if row.digest_time is None or row.custom_remind
+        ]
+
+        async def work(session, messages=messages, batch=batch):
+            await outbox.enqueue(session, messages)
+            await session.execute(
+                sqlalchemy.update(TaskModel)
+                .where(TaskModel.id.in_([row.id for row in batch]))
+                .values(send_remind=True)
+            )
+            return await materialise(session, batch)  # следующие экземпляры повторяющихся задач
+        for task_id, notify_time, _ in await writer.submit(work):
+            reminders.schedule(task_id, notify_time)
+        observe_reminder_batch([row.notify_time for row in batch])
+    outbox.notify()
+    observe_reminder_run(started, len(rows))
+
+    elapsed = perf_counter() - started
+    if rows:
+        print(f"Напоминания: {len(rows)} поставлено в очередь за {elapsed:.2f} c")
 
 
 @dp.message(Command("add_task"))
@@ -148,78 +266,121 @@ async def process_task_title_tag(message: Message, state: FSMContext):
 
 
 async def date_validation(input_date, message):
-    try:
-        due_date = datetime.strptime(input_date, "%d-%m-%Y").date()
-        today = date.today()
-        if due_date < today:
-            await message.answer("Дата в прошлом!!")
-            return
-        return due_date
-    except ValueError:
-        await message.answer("Неверный формат даты! Используйте ДД-ММ-ГГГГ")
-        return
+    due_date, error = parse_due_date(input_date)
+    if error:
+        await message.answer(error)
+    return due_date
 
 
 @dp.message(TaskStates.due_date)
 async def process_due_date(message: Message, state: FSMContext):
-    now = datetime.now()
     due_date = await date_validation(message.text, message)
-    if now.time().hour >= 18 and due_date == now.date() + timedelta(days=1):
-        notify_hour = now.time().hour + 2
-    else:
-        notify_hour = 18
-    notify_date = due_date - timedelta(days=1)
-    notify_time = datetime.combine(notify_date, time(notify_hour, 00))
     if not due_date:
         return
+    notify_time = default_notify_time(due_date)
 
     data = await state.get_data()
-    async with new_session() as session:
+    try:
+        tag_id = None
+        if data["tag"]:
+            tag_id = await tag_cache.find(message.from_user.id, data["tag"])
+            if not tag_id:
+                await message.answer("Тег не найден! Добавьте его через команду /add_tag")
+                return
+        task = TaskModel(
+            user_id=message.from_user.id,
+            title=data["title"],
+            tag_id=tag_id,
+            due_date=due_date,
+            notify_time=notify_time,
+            is_done=False,
+        )
+
+        async def work(session):
+            session.add(task)
+            await session.flush()
+            await count_tasks(session, [task_delta(task)])
+        await writer.submit(work)
+        reminders.schedule(task.id, notify_time)
+        await message.answer(
+            f"Задача успешно добавлена!\nНазвание: {data['title']}\nДедлайн: {due_date.strftime('%d-%m-%Y')}\nНапоминание установлено на {notify_time.strftime('%d-%m-%Y %H:%M')}\n")
+
+    except Exception as e:
+        print(e)
+        await message.answer("Ошибка при сохранении задачи!")
+    finally:
+        await state.clear()
+
+
+@dp.message(Command("import"))
+async def import_command(message: Message, state: FSMContext):
+    await state.set_state(TaskStates.import_file)
+    await message.answer("Отправьте файл .txt или .csv, по задаче в строке:\n"
+                         "название #тег ДД-ММ-ГГГГ\n\n"
+                         "Тег необязателен и должен быть добавлен через /add_tag")
+
+
+@dp.message(TaskStates.import_file, F.document)
+async def process_import_file(message: Message, state: FSMContext, bot: Bot):
+    await state.clear()
+    document = message.document
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        await message.answer(f"Файл больше {IMPORT_MAX_BYTES // 2 ** 20} МБ!")
+        return
+    tags = {title: tag_id for tag_id, title in (await get_tags(message))}
+    with tempfile.TemporaryDirectory(prefix="taskbot-import-") as directory:
+        # файл скачивается на диск частями и читается построчно, целиком в память не загружается
+        path = os.path.join(directory, "import")
+        await bot.download(document, destination=path)
+        with open(path, encoding="utf-8-sig", errors="replace", newline="") as stream:
+            is_csv = (document.file_name or "").lower().endswith(".csv")
+            result = await import_tasks(stream, message.from_user.id, tags, is_csv)
+    await message.answer(result.summary())
+
+
+@dp.message(TaskStates.import_file)
+async def import_not_file(message: Message):
+    await message.answer("Отправьте файл документом или /stop для отмены")
+
+
+@dp.message(Command("digest"))
+async def digest_command(message: Message, state: FSMContext, session: AsyncSession):
+    digest_time = (await session.execute(
+        sqlalchemy.select(UserModel.digest_time).where(UserModel.tg_id == message.from_user.id)
+    )).scalar()
+    status = (f"Сейчас дайджест приходит в {digest_time.strftime('%H:%M')}" if digest_time
+              else "Сейчас напоминания приходят по одному на задачу")
+    await state.set_state(TaskStates.set_digest)
+    await message.answer(f"{status}.\n\nВведите время ежедневного дайджеста (ЧЧ:ММ) - одно сообщение "
+                         f"с задачами на завтра и просроченными вместо отдельных напоминаний, "
+                         f"или \"выкл\", чтобы получать напоминания по одному")
+
+
+@dp.message(TaskStates.set_digest)
+async def process_digest_time(message: Message, state: FSMContext):
+    text = message.text.strip().lower()
+    if text in ("выкл", "нет", "off"):
+        digest_time = None
+    else:
         try:
-            if data["tag"]:
-                query = sqlalchemy.select(TagModel).where(TagModel.title == data["tag"])
-                result = await session.execute(query)
-                tag = result.scalars().first()
-                if not tag:
-                    await message.answer("Тег не найден! Добавьте его через команду /add_tag")
-                    return
-                task = TaskModel(
-                    user_id=message.from_user.id,
-                    title=data["title"],
-                    tag_id=tag.id,
-                    due_date=due_date,
-                    notify_time=notify_time
-                )
-                session.add(task)
-                await session.commit()
-                await message.answer(
-                    f"Задача успешно добавлена!\nНазвание: {data['title']}\nДедлайн: {due_date.strftime('%d-%m-%Y')}\nНапоминание установлено на {notify_time.strftime('%d-%m-%Y %H:%M')}\n")
-            else:
-                task = TaskModel(
-                    user_id=message.from_user.id,
-                    title=data["title"],
-                    due_date=due_date,
-                    notify_time=notify_time
-                )
-                session.add(task)
-                await session.commit()
-                await message.answer(
-                    f"Задача успешно добавлена!\nНазвание: {data['title']}\nДедлайн: {due_date.strftime('%d-%m-%Y')}\nНапоминание установлено на {notify_time.strftime('%d-%m-%Y %H:%M')}\n")
-
-        except Exception as e:
-            print(e)
-            await message.answer("Ошибка при сохранении задачи!")
-        finally:
-            await state.clear()
+            digest_time = datetime.strptime(text, "%H:%M").time()
+        except ValueError:
+            await message.answer("Неверный формат времени! Используйте ЧЧ:ММ или \"выкл\"")
+            return
+    first = await set_digest_time(message.from_user.id, digest_time)
+    await state.clear()
+    if first is None:  # пользователь не прошел /start - сохранять настройку некуда
+        await message.answer("Сначала выполните /start")
+        return
+    if digest_time is None:
+        await message.answer("Дайджест выключен, напоминания снова приходят по одному")
+        return
+    await message.answer(f"Дайджест включен: каждый день в {digest_time.strftime('%H:%M')}, "
+                         f"первый - {first.strftime('%d-%m-%Y')}")
 
 
 async def get_tags(message):
-    async with new_session() as session:
-        query = sqlalchemy.select(TagModel).where(
-            TagModel.user_id == message.from_user.id
-        )
-        result = await session.execute(query)
-        return [(tag.id, tag.title) for tag in result.scalars().all()]
+    return list((await tag_cache.get(message.from_user.id)).items())
 
 
 @dp.message(Command("add_tag"))
@@ -231,24 +392,22 @@ async def add_tag(message: Message, state: FSMContext):
 @dp.message(TaskStates.add_tag)
 async def process_task_add_tag(message: Message, state: FSMContext):
     title = message.text
-    async with new_session() as session:
-        try:
-            new_tag = TagModel(
-                user_id=message.from_user.id,
-                title=title,
-            )
-            session.add(new_tag)
-            await session.commit()
-            await message.answer(f"Тег #{title} успешно добавлен!")
-        except Exception as error:
-            print(error)
-            user_tags = await get_tags(message)
-            if title in [tag[1] for tag in user_tags]:
-                await message.answer("Тег уже существует!")
-            else:
-                await message.answer("Ошибка при сохранении тега!")
-        finally:
-            await state.clear()
+    try:
+        await writer.add(TagModel(
+            user_id=message.from_user.id,
+            title=title,
+        ))
+        tag_cache.invalidate(message.from_user.id)
+        await message.answer(f"Тег #{title} успешно добавлен!")
+    except Exception as error:
+        print(error)
+        user_tags = await get_tags(message)
+        if title in [tag[1] for tag in user_tags]:
+            await message.answer("Тег уже существует!")
+        else:
+            await message.answer("Ошибка при сохранении тега!")
+    finally:
+        await state.clear()
 
 
 @dp.message(Command("delete_tag"))
@@ -259,12 +418,12 @@ async def delete_tag(message: Message, state: FSMContext):
         return
 
     tags_list = "\n".join([f"{tag_id}. {tag_title}" for tag_id, tag_title in user_tags])
+    await state.update_data(user_tags=user_tags)
+    await state.set_state(TaskStates.delete_tag)
     await message.answer(
         "Введите ID тега:\n"
         f"{tags_list}\n\n",
     )
-    await state.update_data(user_tags=user_tags)
-    await state.set_state(TaskStates.delete_tag)
 
 
 @dp.message(TaskStates.delete_tag)
@@ -277,69 +436,47 @@ async def process_task_delete_tag(message: Message, state: FSMContext):
             await message.answer("Тег с таким ID не найден среди ваших тегов.")
             return
 
-        async with new_session() as session:
-            tag = await session.get(TagModel, tag_id)
-            await session.delete(tag)
-            await session.commit()
-            await message.answer(f"Тег #{tag.title} успешно удалён!")
+        async def work(session):
+            deleted = (await session.execute(sqlalchemy.delete(TagModel).where(
+                TagModel.id == tag_id,
+                TagModel.user_id == message.from_user.id,
+            ))).rowcount
+            if deleted:  # задачи тега остаются без тега, их счетчики пересчитываются
+                for model in (TaskModel, ArchivedTaskModel):
+                    await session.execute(sqlalchemy.update(model).where(model.tag_id == tag_id).values(tag_id=None))
+                await reconcile_users(session, [message.from_user.id])
+        await writer.submit(work)
+        tag_cache.invalidate(message.from_user.id)
+        title = dict(user_tags)[tag_id]
+        await message.answer(f"Тег #{title} успешно удалён!")
     except ValueError:
         await message.answer("Введите число (ID тега)!!!")
     finally:
         await state.clear()
 
 
-async def get_tasks(status, message):
-    async with new_session() as session:
-        result = await session.execute(sqlalchemy.select(TaskModel).where(
-            TaskModel.user_id == message.from_user.id,
-            TaskModel.is_done == status,
-        ))
-        data = dict()
-        for el in result.scalars().all():
-            tag = await session.execute(sqlalchemy.select(TagModel).where(
-                TagModel.id == el.tag_id,
-            ))
-            tag = tag.scalars().first()
-            if el.due_date in data:
-                if tag:
-                    data[
-                        el.due_date].append(
-                        f"\nЗадача №{el.id} \n{el.title}\nДедлайн: {el.due_date.strftime('%d-%m-%Y')}\nТег: #{tag.title}\n" if el.is_done else f"\nЗадача №{el.id} \n{el.title}\nДедлайн: {el.due_date.strftime('%d-%m-%Y')}\nНапоминание: {el.notify_time.strftime('%d-%m-%Y %H:%M')}\nТег: #{tag.title}\n")
-                else:
-                    data[el.due_date].append(
-                        f"\nЗадача №{el.id} \n{el.title}\nДедлайн: {el.due_date.strftime('%d-%m-%Y')}\n" if el.is_done else f"\nЗадача №{el.id} \n{el.title}\nДедлайн: {el.due_date.strftime('%d-%m-%Y')}\nНапоминание: {el.notify_time.strftime('%d-%m-%Y %H:%M')}\n")
-            else:
-                if tag:
-                    data[
-                        el.due_date] = [
-                        f"\nЗадача №{el.id} \n{el.title}\nДедлайн: {el.due_date.strftime('%d-%m-%Y')}\nТег: #{tag.title}\n" if el.is_done else f"\nЗадача №{el.id} \n{el.title}\nДедлайн: {el.due_date.strftime('%d-%m-%Y')}\nНапоминание: {el.notify_time.strftime('%d-%m-%Y %H:%M')}\nТег: #{tag.title}\n"]
-                else:
-                    data[
-                        el.due_date] = [
-                        f"\nЗадача №{el.id} \n{el.title}\nДедлайн: {el.due_date.strftime('%d-%m-%Y')}\n" if el.is_done else f"\nЗадача №{el.id} \n{el.title}\nДедлайн: {el.due_date.strftime('%d-%m-%Y')}\nНапоминание: {el.notify_time.strftime('%d-%m-%Y %H:%M')}\n"]
-        data = sorted(data.items())
-        ans = list()
-        for el in data:
-            for i in el[1]:
-                ans.append(i)
-        return ans
-
-
-async def get_task(data, message, nums):
-    async with new_session() as session:
-        try:
-            data = int(data)
-            data = nums[data]
-            result = await session.execute(sqlalchemy.select(TaskModel).where(
-                TaskModel.user_id == message.from_user.id,
-                TaskModel.id == data,
-            ))
-            task = result.scalars().first()
-            return task, session
+async def get_tasks(session, status, message, tag_id=None, after=None, before=None):
+    return await fetch_page(session, message.from_user.id, status, tag_id, after, before)
 
-        except ValueError:
-            await message.answer("Введите номер задачи! (число)")
-            return
+
+async def get_task(session, task_id, message):
+    result = await session.execute(sqlalchemy.select(TaskModel).where(
+        TaskModel.user_id == message.from_user.id,
+        TaskModel.id == task_id,
+    ))
+    # номер из списка "Завершенные" может указывать на задачу, уже перенесенную в архив
+    return result.scalars().first() or await get_archived_task(session, message.from_user.id, task_id)
+
+
+async def update_task(task_id, change, restore=False):  # change(session, task) выполняется в транзакции писателя
+    async def work(session):
+        if restore:  # задача из архива сначала возвращается в tasks
+            await restore_task(session, task_id)
+        task = await session.get(TaskModel, task_id)
+        if task is None:
+            return None, None
+        return task, await change(session, task)
+    return await writer.submit(work)
 
 
 async def task_buttons(message, text1, text2, text3, text4):
@@ -356,50 +493,82 @@ async def task_buttons(message, text1, text2, text3, text4):
     await message.answer(text4, reply_markup=keyboard)
 
 
-async def choose_status(callback, state, arg, text1, text2):
-    data = await get_tasks(arg, callback)
-    if data:
-        count = 1
-        ans = list()
-        for i in data:
-            i = i.replace(re.search(r"(№\d+)[^\n]*", i).group(1).strip(), f"<b>№{count}</b> ", 1)
-            ans.append(i)
-            count += 1
-        await callback.message.answer(text1 + f"{''.join(ans)}", parse_mode="html")
+def list_header(edit, is_done, tag_title=None):
+    if edit == BULK:
+        return "Отметьте задачи и выберите действие:\n"
+    if tag_title:
+        return f"Активные задачи с тегом #{tag_title} : \n"
+    if edit:
+        return "Выберите номер задачи:\n"
+    return "Завершенные задачи:\n" if is_done else "Активные задачи:\n"
+
+
+async def choose_status(callback, state, session, arg, text1, text2):
+    rows, has_next = await get_tasks(session, arg, callback)
+    if rows:
+        edit = text1 == "Выберите номер задачи:\n"
+        text, nums = render_tasks(rows)
+        keyboard = page_keyboard(rows, 1, False, has_next, edit, arg)
         await state.clear()
-        if text1 == "Выберите номер задачи:\n":
-            count = 1
-            answer = dict()
-            nums = list(map(int, [re.search(r"(№\d+)[^\n]*", el).group(1).strip().strip("№") for el in data]))
-            for el in nums:
-                answer[count] = el
-                count += 1
+        if edit:
             await state.set_state(TaskStates.edit_task)
-            await state.update_data(nums=answer)
+            await state.update_data(nums=nums)
+        await callback.message.answer(text1 + text, parse_mode="html", reply_markup=keyboard)
     else:
         await callback.message.answer(text2)
 
 
+@dp.callback_query(F.data.startswith("pg:"))
+async def turn_page(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
+    page = Page.unpack(callback.data)
+    if page.edit and await state.get_state() != TaskStates.edit_task.state:
+        await callback.answer("Список устарел, откройте /edit_task заново")
+        return
+    key = (page.due_date, page.task_id)
+    if page.direction == "n":
+        rows, has_next = await get_tasks(session, page.is_done, callback, page.tag_id, after=key)
+        has_prev = True
+    else:
+        rows, has_prev = await get_tasks(session, page.is_done, callback, page.tag_id, before=key)
+        has_next = True
+    if not rows:
+        await callback.answer("Задач больше нет")
+        return
+    text, nums = render_tasks(rows, page.start)
+    data = await state.get_data()
+    if page.edit == BULK:
+        keyboard = bulk_keyboard(rows, page.start, has_prev, has_next, page.is_done, page.tag_id,
+                                 set(data.get("selected", ())))
+    else:
+        keyboard = page_keyboard(rows, page.start, has_prev, has_next, page.edit, page.is_done, page.tag_id)
+    header = list_header(page.edit, page.is_done, rows[0].tag_title if page.tag_id else None)
+    await callback.message.edit_text(header + text, parse_mode="html", reply_markup=keyboard)
+    if page.edit:
+        # номера накапливаются, поэтому номер с уже просмотренной страницы остается действительным
+        await state.update_data(nums={**data.get("nums", dict()), **nums})
+    await callback.answer()
+
+
 @dp.message(Command("tasks"))
 async def tasks_buttons(message: Message, state: FSMContext):
-    await task_buttons(message, "active", "done", "filter", "Выберите тип задач: ")
     await state.set_state(TaskStates.type_to)
+    await task_buttons(message, "active", "done", "filter", "Выберите тип задач: ")
 
 
 @dp.callback_query(
     F.data == "active",
     StateFilter(TaskStates.type_to)
 )
-async def choose_active(callback: CallbackQuery, state: FSMContext):
-    await choose_status(callback, state, False, "Активные задачи:\n", "Активных задач нет")
+async def choose_active(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
+    await choose_status(callback, state, session, False, "Активные задачи:\n", "Активных задач нет")
 
 
 @dp.callback_query(
     F.data == "done",
     StateFilter(TaskStates.type_to)
 )
-async def choose_done(callback: CallbackQuery, state: FSMContext):
-    await choose_status(callback, state, True, "Завершенные задачи:\n", "Завершенных задач нет")
+async def choose_done(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
+    await choose_status(callback, state, session, True, "Завершенные задачи:\n", "Завершенных задач нет")
 
 
 @dp.callback_query(
@@ -411,37 +580,14 @@ async def view_filter(callback: CallbackQuery, state: FSMContext):
 
 
 async def choose_filter(callback: CallbackQuery, state: FSMContext, arg):
-    tags = dict()
-    async with new_session() as session:
-        query = await session.execute(
-            sqlalchemy.select(TagModel).where(
-                UserModel.tg_id == TagModel.user_id
-            )
-        )
-        query = query.scalars().all()
-        for el in query:
-            tags[el.id] = el.title
-
-    keyboard = list()
-    current_row = list()
-
-    for tag_id, tag_title in tags.items():
-        current_row.append(
-            InlineKeyboardButton(text=tag_title, callback_data=f"tag_{tag_id}")
-        )
-
-        if len(current_row) == 3 or tag_id == list(tags.keys())[-1]:
-            keyboard.append(current_row)
-            current_row = list()
-
-    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard)
-    if tags:
+    keyboard = await tag_cache.keyboard(callback.from_user.id)
+    if keyboard:
+        await state.set_state(TaskStates.filter)
+        await state.update_data(arg=arg)
         await callback.message.answer(
             "Выберите тег для фильтра:",
             reply_markup=keyboard
         )
-        await state.set_state(TaskStates.filter)
-        await state.update_data(arg=arg)
     else:
         await callback.message.answer(
             "Тегов нет. Добавьте их через команду /add_tag",
@@ -451,69 +597,137 @@ async def choose_filter(callback: CallbackQuery, state: FSMContext, arg):
 @dp.callback_query(
     StateFilter(TaskStates.filter)
 )
-async def process_filter(callback: CallbackQuery, state: FSMContext):
+async def process_filter(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     args = await state.get_data()
     arg = args.get("arg")
     tag_id = int(callback.data.split("_")[1])
-    async with new_session() as session:
-        tag = await session.execute(sqlalchemy.select(TagModel).where(
-            TagModel.id == tag_id,
-        ))
-        tag = tag.scalars().first()
-        result = await session.execute(sqlalchemy.select(TaskModel).where(
-            TaskModel.user_id == callback.from_user.id,
-            TaskModel.tag_id == tag_id,
-            TaskModel.is_done == False,
-        ))
-        result = result.scalars().all()
-        if result:
-            data = dict()
-            for el in result:
-                if el.due_date in data:
-                    data[
-                        el.due_date].append(
-                        f"\nЗадача №{el.id} \n{el.title}\nДедлайн: {el.due_date.strftime('%d-%m-%Y')}\nНапоминание: {el.notify_time.strftime('%d-%m-%Y %H:%M')}\nТег: #{tag.title}\n")
-                else:
-                    data[
-                        el.due_date] = [
-                        f"\nЗадача №{el.id} \n{el.title}\nДедлайн: {el.due_date.strftime('%d-%m-%Y')}\nНапоминание: {el.notify_time.strftime('%d-%m-%Y %H:%M')}\nТег: #{tag.title}\n"]
-            data = sorted(data.items())
-            ans = list()
-            for el in data:
-                for i in el[1]:
-                    ans.append(i)
-            count = 1
-            data = ans
-            nums = dict()
-            ans = list()
-            for i in data:
-                nums[count] = int(re.search(r"(\d+)[^\n]*", i).group(1))
-                i = i.replace(re.search(r"(№\d+)[^\n]*", i).group(1).strip(), f"<b>№{count}</b> ", 1)
-                ans.append(i)
-                count += 1
-            await callback.message.answer(f"Активные задачи с тегом #{tag.title} : \n" + f"{''.join(ans)}",
-                                          parse_mode="html")
-            if arg:
-                await state.set_state(TaskStates.edit_task)
-                await state.update_data(nums=nums)
-            else:
-                await state.clear()
+    tag_title = (await tag_cache.get(callback.from_user.id)).get(tag_id)
+    if tag_title is None:
+        await callback.answer("Тег не найден")
+        return
+    result, has_next = await get_tasks(session, False, callback, tag_id)
+    if result:
+        text, nums = render_tasks(result)
+        keyboard = page_keyboard(result, 1, False, has_next, bool(arg), False, tag_id)
+        if arg:
+            await state.set_state(TaskStates.edit_task)
+            await state.update_data(nums=nums)
         else:
-            await callback.message.answer(f"Активных задач с тегом #{tag.title} нет")
+            await state.clear()
+        await callback.message.answer(list_header(arg, False, tag_title) + text,
+                                      parse_mode="html", reply_markup=keyboard)
+    else:
+        await callback.message.answer(f"Активных задач с тегом #{tag_title} нет")
+
+
+@dp.message(Command("export"))
+async def export_buttons(message: Message, state: FSMContext):
+    await state.set_state(TaskStates.export_type)
+    await task_buttons(message, "export_active", "export_done", "export_filter", "Какие задачи выгрузить?")
+
+
+async def choose_export_format(callback, state, is_done, tag_id=None):
+    await state.set_state(TaskStates.export_format)
+    await state.update_data(is_done=is_done, tag_id=tag_id)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="Таблица CSV", callback_data="export_csv"),
+        InlineKeyboardButton(text="Календарь .ics", callback_data="export_ics"),
+    ]])
+    await callback.message.answer("Выберите формат:", reply_markup=keyboard)
+
+
+@dp.callback_query(
+    F.data.in_({"export_active", "export_done"}),
+    StateFilter(TaskStates.export_type)
+)
+async def export_choose_status(callback: CallbackQuery, state: FSMContext):
+    await choose_export_format(callback, state, callback.data == "export_done")
+
+
+@dp.callback_query(
+    F.data == "export_filter",
+    StateFilter(TaskStates.export_type)
+)
+async def export_choose_filter(callback: CallbackQuery, state: FSMContext):
+    keyboard = await tag_cache.keyboard(callback.from_user.id)
+    if keyboard:
+        await state.set_state(TaskStates.export_tag)
+        await callback.message.answer("Выберите тег:", reply_markup=keyboard)
+    else:
+        await callback.message.answer("Тегов нет. Добавьте их через команду /add_tag")
+
+
+@dp.callback_query(
+    F.data.startswith("tag_"),
+    StateFilter(TaskStates.export_tag)
+)
+async def export_choose_tag(callback: CallbackQuery, state: FSMContext):
+    tag_id = int(callback.data.split("_")[1])
+    if tag_id not in await tag_cache.get(callback.from_user.id):
+        await callback.answer("Тег не найден")
+        return
+    await choose_export_format(callback, state, False, tag_id)
+
+
+@dp.callback_query(
+    F.data.in_({"export_csv", "export_ics"}),
+    StateFilter(TaskStates.export_format)
+)
+async def export_file(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    await state.clear()
+    fmt = callback.data.split("_")[1]
+    await callback.answer("Готовлю файл...")
+    with tempfile.TemporaryDirectory(prefix="taskbot-export-") as directory:
+        # задачи пишутся в файл по мере чтения курсором, в память целиком не попадают
+        filename = f"tasks.{EXPORT_FORMATS[fmt][1]}"
+        path = os.path.join(directory, filename)
+        count = await export_tasks(path, fmt, callback.from_user.id, data["is_done"], data["tag_id"])
+        if not count:
+            await callback.message.answer("Задач для выгрузки нет")
+            return
+        await callback.message.answer_document(FSInputFile(path, filename=filename),
+                                               caption=f"Задач в файле: {count}")
+
+
+@dp.message(Command("stats"))
+async def show_stats(message: Message, session: AsyncSession):
+    counters = await user_counters(session, message.from_user.id)
+    if not counters:
+        await message.answer("Задач пока нет. Добавьте первую через /add_task")
+        return
+    await message.answer(render_stats(counters, await tag_cache.get(message.from_user.id)))
+
+
+@dp.message(Command("search"))
+async def search(message: Message, command: CommandObject, state: FSMContext, session: AsyncSession):
+    if not command.args:
+        await message.answer("Напишите, что искать: /search молоко")
+        return
+    rows = await search_tasks(session, message.from_user.id, command.args)
+    if not rows:
+        await message.answer("Ничего не найдено")
+        return
+    # номера те же, что в /edit_task: ответ номером сразу открывает редактирование найденной задачи
+    text, nums = render_tasks(rows)
+    await state.clear()
+    await state.set_state(TaskStates.edit_task)
+    await state.update_data(nums=nums)
+    await message.answer(f"Найдено задач: {len(rows)}. Выберите номер задачи:\n" + text, parse_mode="html")
 
 
 @dp.message(Command("edit_task"))
 async def edit_tasks_buttons(message: Message, state: FSMContext):
-    await task_buttons(message, "edit_active", "edit_done", "filter_edit", "Выберите тип задачи:")
     await state.set_state(TaskStates.type_to_edit)
+    await task_buttons(message, "edit_active", "edit_done", "filter_edit", "Выберите тип задачи:")
 
 
 @dp.callback_query(
     F.data == "edit_active",
     StateFilter(TaskStates.type_to_edit)
 )
-async def edit_choose_active(callback: CallbackQuery, state: FSMContext):
-    await choose_status(callback, state, False, "Выберите номер задачи:\n",
+async def edit_choose_active(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
+    await choose_status(callback, state, session, False, "Выберите номер задачи:\n",
                         "Активных задач нет")
 
 
@@ -521,8 +735,8 @@ async def edit_choose_active(callback: CallbackQuery, state: FSMContext):
     F.data == "edit_done",
     StateFilter(TaskStates.type_to_edit)
 )
-async def edit_choose_done(callback: CallbackQuery, state: FSMContext):
-    await choose_status(callback, state, True, "Выберите номер задачи:\n", "Завершенных задач нет")
+async def edit_choose_done(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
+    await choose_status(callback, state, session, True, "Выберите номер задачи:\n", "Завершенных задач нет")
 
 
 @dp.callback_query(
@@ -534,64 +748,63 @@ async def view_filter_edit(callback: CallbackQuery, state: FSMContext):
 
 
 @dp.message(TaskStates.edit_task)
-async def choose_edit(message: Message, state: FSMContext):
-    data = message.text
+async def choose_edit(message: Message, state: FSMContext, session: AsyncSession):
+    data = message.text.strip()
     nums = await state.get_data()
     nums = nums.get("nums")
     answer = f"№{data}"
-    if not (int(data) in nums):
+    if data not in nums:
+        await message.answer(f"Задача с {answer} не найдена.")
+        return
+    task = await get_task(session, nums[data], message)
+    if not task:
         await message.answer(f"Задача с {answer} не найдена.")
+    elif task.is_done:
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [
+                InlineKeyboardButton(text="Сделать активной", callback_data="to_active"),
+                InlineKeyboardButton(text="Удалить", callback_data="delete"),
+            ],
+        ])
+        await state.update_data(task_id=task.id, answer=answer)
+        await message.answer("Выберите действие", reply_markup=keyboard)
     else:
-        task, session = await get_task(data, message, nums)
-        nums = [nums[i] for i in nums]
-        if task:
-            if not (task.id in nums):
-                if task.is_done:
-                    text = "активной"
-                else:
-                    text = "завершенной"
-                await message.answer(f"Задача с {answer} не является {text}.")
-            elif task.is_done:
-                keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                    [
-                        InlineKeyboardButton(text="Сделать активной", callback_data="to_active"),
-                        InlineKeyboardButton(text="Удалить", callback_data="delete"),
-                    ],
-                ])
-                await state.update_data(task=task, session=session, answer=answer)
-                await message.answer("Выберите действие", reply_markup=keyboard)
-            else:
-                keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                    [
-                        InlineKeyboardButton(text="Название", callback_data="change_text"),
-                        InlineKeyboardButton(text="Дедлайн", callback_data="change_deadline"),
-                    ],
-                    [
-                        InlineKeyboardButton(text="Тег", callback_data="change_tag"),
-                        InlineKeyboardButton(text="Напомнить", callback_data="set_remind"),
-                    ],
-                    [
-                        InlineKeyboardButton(text="Завершить", callback_data="is_done"),
-                        InlineKeyboardButton(text="Удалить", callback_data="delete"),
-                    ],
-                ])
-                await state.update_data(task=task, session=session, answer=answer)
-                await message.answer("Выберите действие", reply_markup=keyboard)
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [
+                InlineKeyboardButton(text="Название", callback_data="change_text"),
+                InlineKeyboardButton(text="Дедлайн", callback_data="change_deadline"),
+            ],
+            [
+                InlineKeyboardButton(text="Тег", callback_data="change_tag"),
+                InlineKeyboardButton(text="Напомнить", callback_data="set_remind"),
+            ],
+            [
+                InlineKeyboardButton(text="Повтор", callback_data="change_repeat"),
+                InlineKeyboardButton(text="Завершить", callback_data="is_done"),
+            ],
+            [
+                InlineKeyboardButton(text="Удалить", callback_data="delete"),
+            ],
+        ])
+        await state.update_data(task_id=task.id, answer=answer)
+        await message.answer("Выберите действие", reply_markup=keyboard)
 
 
 async def get_state(state):
     data = await state.get_data()
-    task = data.get("task")
-    session = data.get("session")
+    task_id = data.get("task_id")
     answer = data.get("answer")
-    return task, session, answer
+    return task_id, answer
+
+
+async def task_not_found(message, state, answer):
+    await message.answer(f"Задача {answer} не найдена.")
+    await state.clear()
 
 
 async def change_smth(callback, state, text, to_update):
-    task, session, answer = await get_state(state)
-    await callback.message.answer(text)
     await state.set_state(to_update)
-    await state.update_data(task=task, session=session, answer=answer)
+    await callback.message.answer(text)
 
 
 @dp.callback_query(
@@ -599,9 +812,12 @@ async def change_smth(callback, state, text, to_update):
     StateFilter(TaskStates.edit_task),
 )
 async def delete(callback: CallbackQuery, state: FSMContext):
-    task, session, answer = await get_state(state)
-    await session.delete(task)
-    await session.commit()
+    task_id, answer = await get_state(state)
+
+    async def work(session):  # задача в одной из таблиц: в tasks или уже в архиве
+        await delete_tasks(session, callback.from_user.id, [task_id])
+    await writer.submit(work)
+    reminders.cancel(task_id)
     await callback.message.answer(f'Задача {answer} успешно удалена!')
     await state.clear()
     return
@@ -619,11 +835,17 @@ async def change_text(callback: CallbackQuery, state: FSMContext, ):
 @dp.message(TaskStates.change_title)
 async def title_is_changed(message: Message, state: FSMContext):
     new_title = message.text
-    task, session, answer = await get_state(state)
-    old_title = task.title
-    task.title = new_title
-    session.add(task)
-    await session.commit()
+    task_id, answer = await get_state(state)
+
+    async def change(session, task):
+        old_title = task.title
+        task.title = new_title
+        return old_title
+
+    task, old_title = await update_task(task_id, change)
+    if not task:
+        await task_not_found(message, state, answer)
+        return
     await message.answer(f'Название задачи {answer} изменено с "{old_title}" на "{task.title}"')
     await state.clear()
     return
@@ -643,11 +865,23 @@ async def date_update(message: Message, state: FSMContext):
     due_date = await date_validation(message.text, message)
     if not due_date:
         return
-    task, session, answer = await get_state(state)
-    old_deadline = task.due_date
-    task.due_date = due_date
-    session.add(task)
-    await session.commit()
+    task_id, answer = await get_state(state)
+
+    async def change(session, task):
+        old_deadline = task.due_date
+        before = task_delta(task, -1)
+        task.due_date = due_date
+        task.notify_time = default_notify_time(due_date)
+        task.send_remind = False
+        task.custom_remind = False
+        await count_tasks(session, [before, task_delta(task)])  # просроченная задача перестает ею быть
+        return old_deadline
+
+    task, old_deadline = await update_task(task_id, change)
+    if not task:
+        await task_not_found(message, state, answer)
+        return
+    reminders.schedule(task.id, task.notify_time)
     await message.answer(
         f"Дедлайн задачи {answer} перенесён с {old_deadline.strftime('%d-%m-%Y')} на {task.due_date.strftime('%d-%m-%Y')}")
     await state.clear()
@@ -666,28 +900,24 @@ async def change_tag(callback: CallbackQuery, state: FSMContext):
 @dp.message(TaskStates.change_tag)
 async def tag_update(message: Message, state: FSMContext):
     title = message.text
-    task, session, answer = await get_state(state)
-    query = sqlalchemy.select(TagModel).where(TagModel.title == title)
-    tag_result = await session.execute(query)
-    tag = tag_result.scalars().first()
-    if not tag:
+    task_id, answer = await get_state(state)
+    user_tags = await tag_cache.get(message.from_user.id)
+    new_tag_id = await tag_cache.find(message.from_user.id, title)
+    if not new_tag_id:
         await message.answer("Тег не найден! Добавьте его через команду /add_tag")
         return
-    new_tag = await session.execute(sqlalchemy.select(TagModel).where(
-        TagModel.title == title,
-    ))
-    new_tag = new_tag.scalars().first()
-    result = await session.execute(sqlalchemy.select(TagModel).where(
-        TagModel.id == task.tag_id,
-    ))
-    tag = result.scalars().first()
-    if tag:
-        old_tag = tag.title
-    else:
-        old_tag = None
-    task.tag_id = new_tag.id
-    session.add(task)
-    await session.commit()
+
+    async def change(session, task):
+        old_tag = user_tags.get(task.tag_id)
+        before = task_delta(task, -1)
+        task.tag_id = new_tag_id
+        await count_tasks(session, [before, task_delta(task)])
+        return old_tag
+
+    task, old_tag = await update_task(task_id, change)
+    if not task:
+        await task_not_found(message, state, answer)
+        return
     if old_tag:
         await message.answer(f'Тег задачи {answer} изменён с #{old_tag} на #{title}')
     else:
@@ -714,11 +944,18 @@ async def set_remind(message: Message, state: FSMContext):
             await message.answer("Дата в прошлом!")
             return
 
-        task, session, answer = await get_state(state)
-        task.notify_time = notify_time
-        task.send_remind = False
-        session.add(task)
-        await session.commit()
+        task_id, answer = await get_state(state)
+
+        async def change(session, task):
+            task.notify_time = notify_time
+            task.send_remind = False
+            task.custom_remind = True
+
+        task, _ = await update_task(task_id, change)
+        if not task:
+            await task_not_found(message, state, answer)
+            return
+        reminders.schedule(task.id, notify_time)
         formatted_time = notify_time.strftime("%d.%m.%Y в %H:%M")
         await message.answer(f"Напоминание о дедлайне задачи {answer} установлено на {formatted_time}!!!")
         await state.clear()
@@ -730,15 +967,68 @@ async def set_remind(message: Message, state: FSMContext):
 
 
 async def change_status(callback, state, arg, text):
-    task, session, answer = await get_state(state)
-    task.is_done = arg
-    session.add(task)
-    await session.commit()
+    task_id, answer = await get_state(state)
+
+    async def change(session, task):
+        before = task_delta(task, -1)
+        task.is_done = arg
+        task.done_at = datetime.now() if arg else None
+        await count_tasks(session, [before, task_delta(task)])
+        if arg:
+            return await materialise(session, [task])
+        return list()
+
+    task, created = await update_task(task_id, change, restore=not arg)
+    if not task:
+        await task_not_found(callback.message, state, answer)
+        return
+    if task.is_done:
+        reminders.cancel(task.id)
+    elif not task.send_remind:
+        reminders.schedule(task.id, task.notify_time)
+    for next_id, notify_time, due_date in created:
+        reminders.schedule(next_id, notify_time)
+        text += f"\nСледующий повтор: {due_date.strftime('%d-%m-%Y')}"
     await callback.message.answer(f"Задача {answer} " + text)
     await state.clear()
     return
 
 
+@dp.callback_query(
+    F.data == "change_repeat",
+    StateFilter(TaskStates.edit_task),
+)
+async def change_repeat(callback: CallbackQuery, state: FSMContext):
+    await change_smth(callback, state, "Как повторять задачу?\n"
+                                       "ежедневно, по будням, еженедельно [пн ср пт], ежемесячно, "
+                                       "каждые N дней или нет", TaskStates.change_repeat)
+    return
+
+
+@dp.message(TaskStates.change_repeat)
+async def repeat_update(message: Message, state: FSMContext):
+    task_id, answer = await get_state(state)
+
+    async def change(session, task):
+        rule = parse_rule(message.text, task.due_date)
+        if rule is not None:
+            task.repeat = rule or None
+        return rule
+
+    task, rule = await update_task(task_id, change)
+    if not task:
+        await task_not_found(message, state, answer)
+        return
+    if rule is None:
+        await message.answer("Не понял правило. Например: ежедневно, еженедельно пн чт, каждые 3 дня")
+        return
+    if rule:
+        await message.answer(f"Задача {answer} повторяется {describe_rule(rule)}")
+    else:
+        await message.answer(f"Повтор задачи {answer} отключен")
+    await state.clear()
+
+
 @dp.callback_query(
     F.data == "is_done",
     StateFilter(TaskStates.edit_task),
@@ -757,5 +1047,173 @@ async def to_active(callback: CallbackQuery, state: FSMContext):
     return
 
 
+@dp.callback_query(
+    F.data.startswith("bk:on:"),
+    StateFilter(TaskStates.edit_task),
+)
+async def bulk_start(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
+    _, _, is_done, tag_id = callback.data.split(":")
+    is_done, tag_id = is_done == "1", int(tag_id) or None
+    rows, has_next = await get_tasks(session, is_done, callback, tag_id)
+    if not rows:
+        await callback.answer("Задач больше нет")
+        return
+    await state.update_data(selected=list(), bulk_done=is_done)
+    text, _ = render_tasks(rows)
+    keyboard = bulk_keyboard(rows, 1, False, has_next, is_done, tag_id, set())
+    await callback.message.edit_text(list_header(BULK, is_done) + text, parse_mode="html", reply_markup=keyboard)
+    await callback.answer()
+
+
+@dp.callback_query(
+    F.data.startswith("bk:t:"),
+    StateFilter(TaskStates.edit_task),
+)
+async def bulk_toggle(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    selected = set(data.get("selected", ())) ^ {int(callback.data[5:])}
+    await state.update_data(selected=sorted(selected))
+    await callback.message.edit_reply_markup(
+        reply_markup=toggle_keyboard(callback.message.reply_markup, selected, data.get("bulk_done"))
+    )
+    await callback.answer()
+
+
+async def bulk_selection(callback, state):
+    selected = (await state.get_data()).get("selected")
+    if not selected:
+        await callback.answer("Отметьте хотя бы одну задачу")
+    return selected
+
+
+async def bulk_finish(callback, state, text):  # список с отметками заменяется итогом действия
+    await callback.message.edit_text(text)
+    await callback.answer()
+    await state.clear()
+
+
+@dp.callback_query(
+    F.data == "bk:done",
+    StateFilter(TaskStates.edit_task),
+)
+async def bulk_complete(callback: CallbackQuery, state: FSMContext):
+    task_ids = await bulk_selection(callback, state)
+    if not task_ids:
+        return
+
+    async def work(session):
+        return await complete_tasks(session, callback.from_user.id, task_ids)
+    done, created = await writer.submit(work)
+    for row in done:
+        reminders.cancel(row.id)
+    for next_id, notify_time, due_date in created:
+        reminders.schedule(next_id, notify_time)
+    text = f"Завершено задач: {len(done)}"
+    if created:
+        text += f"\nСоздано следующих повторов: {len(created)}"
+    await bulk_finish(callback, state, text)
+
+
+@dp.callback_query(
+    F.data == "bk:active",
+    StateFilter(TaskStates.edit_task),
+)
+async def bulk_reopen(callback: CallbackQuery, state: FSMContext):
+    task_ids = await bulk_selection(callback, state)
+    if not task_ids:
+        return
+
+    async def work(session):
+        return await reopen_tasks(session, callback.from_user.id, task_ids)
+    reopened = await writer.submit(work)
+    for row in reopened:
+        if not row.send_remind:
+            reminders.schedule(row.id, row.notify_time)
+    await bulk_finish(callback, state, f"Снова активны задач: {len(reopened)}")
+
+
+@dp.callback_query(
+    F.data == "bk:delete",
+    StateFilter(TaskStates.edit_task),
+)
+async def bulk_delete(callback: CallbackQuery, state: FSMContext):
+    task_ids = await bulk_selection(callback, state)
+    if not task_ids:
+        return
+
+    async def work(session):
+        return await delete_tasks(session, callback.from_user.id, task_ids)
+    deleted = await writer.submit(work)
+    for task_id in deleted:
+        reminders.cancel(task_id)
+    await bulk_finish(callback, state, f"Удалено задач: {len(deleted)}")
+
+
+@dp.callback_query(
+    F.data == "bk:off",
+    StateFilter(TaskStates.edit_task),
+)
+async def bulk_cancel(callback: CallbackQuery, state: FSMContext):
+    await bulk_finish(callback, state, "Выбор отменен")
+
+
+@dp.callback_query(
+    F.data == "bk:tag",
+    StateFilter(TaskStates.edit_task),
+)
+async def bulk_change_tag(callback: CallbackQuery, state: FSMContext):
+    if await bulk_selection(callback, state):
+        await change_smth(callback, state, "Введите тег для отмеченных задач (без #):", TaskStates.bulk_tag)
+        await callback.answer()
+
+
+@dp.message(TaskStates.bulk_tag)
+async def bulk_tag_update(message: Message, state: FSMContext):
+    title = message.text
+    tag_id = await tag_cache.find(message.from_user.id, title)
+    if not tag_id:
+        await message.answer("Тег не найден! Добавьте его через команду /add_tag")
+        return
+    task_ids = (await state.get_data()).get("selected", list())
+
+    async def work(session):
+        return await retag_tasks(session, message.from_user.id, task_ids, tag_id)
+    changed = await writer.submit(work)
+    await message.answer(f"Тег #{title} установлен у задач: {len(changed)}")
+    await state.clear()
+
+
+@dp.callback_query(
+    F.data == "bk:date",
+    StateFilter(TaskStates.edit_task),
+)
+async def bulk_change_deadline(callback: CallbackQuery, state: FSMContext):
+    if await bulk_selection(callback, state):
+        await change_smth(callback, state, "Введите новую дату выполнения для отмеченных задач (ДД-ММ-ГГГГ):",
+                          TaskStates.bulk_deadline)
+        await callback.answer()
+
+
+@dp.message(TaskStates.bulk_deadline)
+async def bulk_date_update(message: Message, state: FSMContext):
+    due_date = await date_validation(message.text, message)
+    if not due_date:
+        return
+    task_ids = (await state.get_data()).get("selected", list())
+
+    async def work(session):
+        return await reschedule_tasks(session, message.from_user.id, task_ids, due_date)
+    changed = await writer.submit(work)
+    for row in changed:
+        reminders.schedule(row.id, row.notify_time)
+    await message.answer(f"Дедлайн {due_date.strftime('%d-%m-%Y')} установлен у задач: {len(changed)}")
+    await state.clear()
+
+
+@dp.callback_query(F.data.startswith("bk:"))
+async def bulk_expired(callback: CallbackQuery):  # отметки в сообщении, диалог которого уже завершен
+    await callback.answer("Список устарел, откройте /edit_task заново")
+
+
 if __name__ == "__main__":
     asyncio.run(main())